@@ -1,15 +1,34 @@
 """ energy_in_time script """
 from common import info, info_cyan
-from postprocess import get_steps, rank
+from postprocess import get_steps, map_steps, rank, FunctionalSet
 import numpy as np
 import dolfin as df
 import os
+from functools import partial
 
 
 def description(ts, **kwargs):
     info("Plot energy in time.")
 
 
+def init(ts, discrete_energy=None, params=None):
+    """ Compile the energy terms on the mesh of ts. """
+    x_ = ts.functions()
+    energy = FunctionalSet(ts.mesh, [f*df.dx
+                                     for f in discrete_energy(x_, **params)])
+    return dict(x_=x_, energy=energy)
+
+
+def kernel(ts, step, x_=None, energy=None):
+    """ Energy terms at a single step. """
+    info("Step {} of {}".format(step, len(ts)))
+
+    for field in x_:
+        ts.update(x_[field], field, step)
+
+    return [ts.times[step]] + list(energy.assemble())
+
+
 def method(ts, dt=0, **kwargs):
     """ Plot energy in time. """
     info_cyan("Plot energy in time.")
@@ -25,28 +44,13 @@ def method(ts, dt=0, **kwargs):
 
     exec("from solvers.{} import discrete_energy".format(solver))
 
-    t = np.zeros(len(steps))
-
-    x_ = ts.functions()
-
     F_keys = discrete_energy(None, **params)
-    F = []
-    for i in range(len(F_keys)):
-        F.append(np.zeros(len(steps)))
-
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
-
-        for field in x_:
-            ts.update(x_[field], field, step)
-
-        fs = discrete_energy(x_, **params)
-        for j in range(len(F_keys)):
-            F[j][i] = df.assemble(fs[j]*df.dx)
 
-        t[i] = ts.times[step]
+    rows = map_steps(ts, steps, kernel,
+                     partial(init, discrete_energy=discrete_energy,
+                             params=params))
 
-    data = np.array(zip(steps, t, *F))
+    data = np.hstack((np.array(steps).reshape(-1, 1), np.array(rows)))
 
     if rank == 0:
         filename = os.path.join(ts.analysis_folder,
@@ -1,25 +1,22 @@
 """ flux_in_time script """
 from common import info, info_cyan, info_blue
-from postprocess import get_steps, rank
+from postprocess import get_steps, map_steps, rank, FunctionalSet
 import numpy as np
 import dolfin as df
 import os
+from functools import partial
 from common.functions import ramp, dramp, diff_pf_potential_linearised, \
     unit_interval_filter
+from common.bcs import Plane
 
 
 def description(ts, **kwargs):
     info("Plot flux in time.")
 
 
-class CrossSection(df.SubDomain):
+class CrossSection(Plane):
     def __init__(self, x0, dim):
-        self.x0 = x0
-        self.dim = dim
-        df.SubDomain.__init__(self)
-
-    def inside(self, x, on_boundary):
-        return df.near(x[self.dim], self.x0) and on_boundary
+        Plane.__init__(self, dim, x0)
 
 
 def get_boundaries_list(boundaries, pbc, extra_boundaries_keys, nodes):
@@ -82,19 +79,11 @@ def fetch_boundaries(ts, problem, params, extra_boundaries):
     return boundary_to_mark, ds
 
 
-def method(ts, dt=0, extra_boundaries="", **kwargs):
-    """ Plot flux in time. """
-    info_cyan("Plot flux in time.")
-
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
-
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
-
+def init(ts, problem=None, params=None, extra_boundaries=""):
+    """ Set up the flux forms on the mesh of ts. """
     boundary_to_mark, ds = fetch_boundaries(
         ts, problem, params, extra_boundaries)
-    
+
     x_ = ts.functions()
 
     if params["enable_NS"]:
@@ -146,8 +135,6 @@ def method(ts, dt=0, extra_boundaries="", **kwargs):
     dveps = dramp(params["permittivity"])
     drho = dramp(params["density"])
 
-    t = np.zeros(len(steps))
-
     # Define the fluxes
     fluxes = dict()
     fluxes["Velocity"] = u
@@ -162,37 +149,71 @@ def method(ts, dt=0, extra_boundaries="", **kwargs):
             fluxes["Solute {}".format(solute[0])] = K[i]*c_grad_g_c[i]
         fluxes["E-field"] = -df.grad(V)
 
-    data = dict()
-    for boundary_name in boundary_to_mark:
-        data[boundary_name] = dict()
-        for flux_name in fluxes:
-            data[boundary_name][flux_name] = np.zeros(len(steps))
-
     n = df.FacetNormal(ts.mesh)
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+    # All fluxes through the boundaries marked in the same subdomain
+    # function are evaluated in a single assembly.
+    flux_sets = []
+    for k in range(len(ds)):
+        keys = []
+        functionals = []
+        for boundary_name, (mark, k_b) in boundary_to_mark.iteritems():
+            if k_b == k:
+                for flux_name, flux in fluxes.items():
+                    keys.append((boundary_name, flux_name))
+                    functionals.append(df.dot(flux, n)*ds[k](mark))
+        if len(keys) > 0:
+            flux_sets.append((keys, FunctionalSet(ts.mesh, functionals)))
+
+    return dict(x_=x_, flux_sets=flux_sets,
+                boundary_names=boundary_to_mark.keys())
+
+
+def kernel(ts, step, x_=None, flux_sets=None, boundary_names=None):
+    """ Fluxes through all boundaries at a single step. """
+    info("Step {} of {}".format(step, len(ts)))
+
+    for field in x_:
+        ts.update(x_[field], field, step)
+
+    data = dict((boundary_name, dict()) for boundary_name in boundary_names)
+    for keys, flux_set in flux_sets:
+        for (boundary_name, flux_name), value in zip(keys,
+                                                     flux_set.assemble()):
+            data[boundary_name][flux_name] = value
+    return ts.times[step], data
+
+
+def method(ts, dt=0, extra_boundaries="", **kwargs):
+    """ Plot flux in time. """
+    info_cyan("Plot flux in time.")
+
+    params = ts.get_parameters()
+    steps = get_steps(ts, dt)
+
+    problem = params["problem"]
+    info("Problem: {}".format(problem))
 
-        for field in x_:
-            ts.update(x_[field], field, step)
+    results = map_steps(ts, steps, kernel,
+                        partial(init, problem=problem, params=params,
+                                extra_boundaries=extra_boundaries))
 
-        for boundary_name, (mark, k) in boundary_to_mark.iteritems():
-            for flux_name, flux in fluxes.items():
-                data[boundary_name][flux_name][i] = df.assemble(
-                    df.dot(flux, n)*ds[k](mark))
+    t = np.array([time for time, _ in results])
+    data = [data_step for _, data_step in results]
 
-        t[i] = ts.times[step]
+    boundary_names = data[0].keys()
+    flux_keys = sorted(data[0][boundary_names[0]].keys())
 
     savedata = dict()
-    flux_keys = sorted(fluxes.keys())
-    for boundary_name in boundary_to_mark:
+    for boundary_name in boundary_names:
         savedata[boundary_name] = np.array(
-            zip(steps, t, *[data[boundary_name][flux_name]
+            zip(steps, t, *[[data_step[boundary_name][flux_name]
+                             for data_step in data]
                             for flux_name in flux_keys]))
 
     if rank == 0:
         header = "Step\tTime\t"+"\t".join(flux_keys)
-        for boundary_name in boundary_to_mark:
+        for boundary_name in boundary_names:
             filename = os.path.join(ts.analysis_folder,
                                     "flux_in_time_{}.dat".format(boundary_name))
             np.savetxt(filename, savedata[boundary_name], header=header)
@@ -2,60 +2,77 @@ import dolfin as df
 from common import info, makedirs_safe, info_cyan
 import os
 import numpy as np
-from utilities.plot import zero_level_set
-from postprocess import get_steps, path_length, rank
+from utilities.level_set import LevelSetExtractor
+from postprocess import get_steps, map_steps, rank, comm
 
 
 def description(ts, **kwargs):
     info("Analyze geometry in time.")
 
 
-def method(ts, dt=0, **kwargs):
-    """ Analyze geometry in time."""
-
-    info_cyan("Analyzing the evolution of the geometry through time.")
-
-    if not ts.get_parameter("enable_PF"):
-        print "Phase field not enabled."
-        return False
-
+def init(ts):
+    """ Set up the mask functions and the interface extractor on the
+    mesh of ts. """
     f_mask = df.Function(ts.function_space)
     f_mask_x = []
     f_mask_u = []
     for d in range(ts.dim):
         f_mask_x.append(df.Function(ts.function_space))
         f_mask_u.append(df.Function(ts.function_space))
+    return dict(f_mask=f_mask, f_mask_x=f_mask_x, f_mask_u=f_mask_u,
+                level_set=LevelSetExtractor(ts.nodes, ts.elems))
 
-    length = np.zeros(len(ts))
-    area = np.zeros(len(ts))
-    com = np.zeros((len(ts), ts.dim))
-    u = np.zeros((len(ts), ts.dim))
 
-    makedirs_safe(os.path.join(ts.analysis_folder, "contour"))
+def kernel(ts, step, f_mask=None, f_mask_x=None, f_mask_u=None,
+           level_set=None):
+    """ Interface length, area, and the integrated position and velocity
+    of the phase at a single step. """
+    info("Step " + str(step) + " of " + str(len(ts)))
 
-    steps = get_steps(ts, dt)
+    phi = ts["phi", step][:, 0]
+    mask = 0.5*(1.-phi)  # 0.5*(1.-np.sign(phi))
+    ts.set_val(f_mask, mask)
+    for d in range(ts.dim):
+        ts.set_val(f_mask_x[d], mask*ts.nodes[:, d])
+        ts.set_val(f_mask_u[d], mask*ts["u", step][:, d])
+
+    # Each step is handled by a single worker, which saves its contour.
+    paths, lengths, _ = level_set.measure(phi)
+    contour_file = os.path.join(ts.analysis_folder, "contour",
+                                "contour_{:06d}.dat".format(step))
+    with open(contour_file, "w") as f:
+        for path in paths:
+            np.savetxt(f, path)
+            f.write("\n")
 
-    for step in steps:
-        info("Step " + str(step) + " of " + str(len(ts)))
+    length = np.sum(lengths)
 
-        phi = ts["phi", step][:, 0]
-        mask = 0.5*(1.-phi)  # 0.5*(1.-np.sign(phi))
-        ts.set_val(f_mask, mask)
-        for d in range(ts.dim):
-            ts.set_val(f_mask_x[d], mask*ts.nodes[:, d])
-            ts.set_val(f_mask_u[d], mask*ts["u", step][:, d])
+    area = df.assemble(f_mask*df.dx)
+    com = [df.assemble(f_mask_x[d]*df.dx) for d in range(ts.dim)]
+    u = [df.assemble(f_mask_u[d]*df.dx) for d in range(ts.dim)]
+    return [length, area] + com + u
 
-        contour_file = os.path.join(ts.analysis_folder, "contour",
-                                    "contour_{:06d}.dat".format(step))
-        paths = zero_level_set(ts.nodes, ts.elems, phi,
-                               save_file=contour_file)
 
-        length[step] = path_length(paths)
+def method(ts, dt=0, **kwargs):
+    """ Analyze geometry in time."""
+
+    info_cyan("Analyzing the evolution of the geometry through time.")
+
+    if not ts.get_parameter("enable_PF"):
+        print "Phase field not enabled."
+        return False
+
+    makedirs_safe(os.path.join(ts.analysis_folder, "contour"))
+    comm.Barrier()
+
+    steps = get_steps(ts, dt)
+
+    data = np.array(map_steps(ts, steps, kernel, init))
 
-        area[step] = df.assemble(f_mask*df.dx)
-        for d in range(ts.dim):
-            com[step, d] = df.assemble(f_mask_x[d]*df.dx)
-            u[step, d] = df.assemble(f_mask_u[d]*df.dx)
+    length = data[:, 0]
+    area = data[:, 1]
+    com = data[:, 2:2+ts.dim]
+    u = data[:, 2+ts.dim:2+2*ts.dim]
 
     for d in range(ts.dim):
         com[:, d] /= area
@@ -64,7 +81,8 @@ def method(ts, dt=0, **kwargs):
     if rank == 0:
         np.savetxt(os.path.join(ts.analysis_folder,
                                 "time_data.dat"),
-                   np.array(zip(np.arange(len(ts)), ts.times, length, area,
+                   np.array(zip(steps, [ts.times[step] for step in steps],
+                                length, area,
                                 com[:, 0], com[:, 1], u[:, 0], u[:, 1])),
                    header=("Timestep\tTime\tLength\tArea\t"
                            "CoM_x\tCoM_y\tU_x\tU_y"))
@@ -1,9 +1,10 @@
 """ line_probe script """
 from common import info, info_cyan, info_on_red, makedirs_safe
 import numpy as np
-from postprocess import get_steps, index2letter, rank
+from postprocess import get_steps, map_steps, index2letter, rank
 from utilities.plot import plot_probes
 import os
+from functools import partial
 from utilities.generate_mesh import line_points
 
 
@@ -11,6 +12,29 @@ def description(ts, **kwargs):
     info("Probe along a line.")
 
 
+def probe(f, x):
+    """ Values of f at the points x, or nan where outside the mesh. """
+    values = np.zeros((len(x), f.value_size()))
+    for i, pt in enumerate(x):
+        try:
+            values[i, :] = f(*pt)
+        except RuntimeError:
+            values[i, :] = np.nan
+    return values
+
+
+def init(ts):
+    """ Set up the functions on the mesh of ts. """
+    return dict(f=ts.functions())
+
+
+def kernel(ts, step, f=None, x=None):
+    """ Values of all fields along the line at a single step. """
+    info("Step " + str(step) + " of " + str(len(ts)))
+    ts.update_all(f, step)
+    return dict((field, probe(func, x)) for field, func in f.iteritems())
+
+
 def method(ts, dx=0.1, line="[0.,0.]--[1.,1.]", time=None, dt=None,
            skip=0, **kwargs):
     """ Probe along a line. """
@@ -35,45 +59,29 @@ def method(ts, dx=0.1, line="[0.,0.]--[1.,1.]", time=None, dt=None,
         plot_probes(ts.nodes, ts.elems, x,
                     colorbar=False, title="Probes")
 
-    f = ts.functions()
-    probes = dict()
-    from fenicstools import Probes
-    for field, func in f.iteritems():
-        probes[field] = Probes(x.flatten(), func.function_space())
-
     steps = get_steps(ts, dt, time)
 
-    for step in steps:
-        info("Step " + str(step) + " of " + str(len(ts)))
-        ts.update_all(f, step)
-        for field, probe in probes.iteritems():
-            probe(f[field])
-
-    probe_arr = dict()
-    for field, probe in probes.iteritems():
-        probe_arr[field] = probe.array()
+    # The kernel evaluates the fields directly, since each worker holds
+    # the whole mesh.
+    probe_arr = map_steps(ts, steps, partial(kernel, x=x), init)
 
     if rank == 0:
-        for i, step in enumerate(steps):
+        makedirs_safe(os.path.join(ts.analysis_folder, "probes"))
+        for step, probe_step in zip(steps, probe_arr):
             chunks = [x]
             header_list = [index2letter(d) for d in range(ts.dim)]
-            for field, chunk in probe_arr.iteritems():
-                if chunk.ndim == 1:
-                    header_list.append(field)
-                    chunk = chunk[:].reshape(-1, 1)
-                elif chunk.ndim == 2:
+            for field, chunk in probe_step.iteritems():
+                if chunk.shape[1] == 1:
                     header_list.append(field)
-                    chunk = chunk[:, i].reshape(-1, 1)
-                elif chunk.ndim > 2:
+                else:
                     header_list.extend(
                         [field + "_" + index2letter(d)
                          for d in range(ts.dim)])
-                    chunk = chunk[:, :, i]
+                    chunk = chunk[:, :ts.dim]
                 chunks.append(chunk)
 
             data = np.hstack(chunks)
             header = "\t".join(header_list)
-            makedirs_safe(os.path.join(ts.analysis_folder, "probes"))
             np.savetxt(os.path.join(ts.analysis_folder, "probes",
                                     "probes_{:06d}.dat".format(step)),
                        data, header=header)
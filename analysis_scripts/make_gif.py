@@ -19,6 +19,9 @@ def method(ts, show=False, save=True, dt=None, fps=25, skip=0,
 
     steps = get_steps(ts, dt)[::(skip+1)]
 
+    charge_max = max(ts.max("charge"), -ts.min("charge"))
+    charge_max = max(charge_max, 1e-8)  # Remove numerical noise
+
     for step in steps[rank::size]:
         info("Step " + str(step) + " of " + str(len(ts)))
         if "phi" in ts:
@@ -28,8 +31,6 @@ def method(ts, show=False, save=True, dt=None, fps=25, skip=0,
         if inverse_phase:
             phi = -phi
         charge = ts["charge", step][:, 0]
-        charge_max = max(ts.max("charge"), -ts.min("charge"))
-        charge_max = max(charge_max, 1e-8)  # Remove numerical noise
         if plot_u and "u" in ts:
             u = ts["u", step]
         else:
@@ -0,0 +1,71 @@
+""" timings script """
+from common import info, info_cyan, info_on_red, info_split
+from common.profiling import load_timings, summarize_timings
+from postprocess import rank
+import os
+
+
+def description(ts, **kwargs):
+    info("Summarize where the time of a run is spent, from the phase "
+         "timings in Statistics/timings.jsonl. Use compare=[folder] to "
+         "compare with the timings of another run.")
+
+
+def get_summary(folder):
+    filename = os.path.join(folder, "Statistics", "timings.jsonl")
+    if not os.path.exists(filename):
+        info_on_red("Found no timings in {}.".format(folder))
+        return None
+    return summarize_timings(load_timings(filename))
+
+
+def method(ts, compare=None, tablefmt="simple", **kwargs):
+    """ Summarize the phase timings of a run. """
+    info_cyan("Summarize the phase timings of a run.")
+
+    summary = get_summary(ts.folder)
+    if summary is None:
+        return
+    reference = get_summary(compare) if compare else None
+
+    phases = summary["phases"]
+    total = sum([phase["total"] for key, phase in phases.iteritems()
+                 if "/" not in key])
+    info_split("Timesteps:", "{}".format(summary["num_steps"]))
+    info_split("Total time:", "{:.3f} s".format(total))
+
+    headers = ["Phase", "Total [s]", "Per step [s]", "Share [%]",
+               "Calls/step"]
+    if reference is not None:
+        headers += ["Reference [s]", "Ratio"]
+    table = []
+    for key in sorted(phases.keys()):
+        phase = phases[key]
+        row = [key, phase["total"], phase["mean"],
+               100.*phase["total"]/total if total > 0. else 0.,
+               phase["calls"]]
+        if reference is not None:
+            ref_phase = reference["phases"].get(key)
+            if ref_phase is not None and ref_phase["mean"] > 0.:
+                row += [ref_phase["mean"], phase["mean"]/ref_phase["mean"]]
+            else:
+                row += [None, None]
+        table.append(row)
+
+    values_headers = ["Value", "Count/step", "Mean last value"]
+    values_table = [[key, value["count"], value["last"]]
+                    for key, value in sorted(summary["values"].items())]
+
+    from tabulate import tabulate
+    tab_string = tabulate(table, headers, tablefmt=tablefmt,
+                          floatfmt=".4g")
+    if values_table:
+        tab_string += "\n\n" + tabulate(values_table, values_headers,
+                                        tablefmt=tablefmt, floatfmt=".4g")
+    info("\n" + tab_string + "\n")
+
+    if rank == 0:
+        filename = os.path.join(ts.analysis_folder, "timings.dat")
+        info_split("Saving to file:", filename)
+        with open(filename, "w") as outfile:
+            outfile.write(tab_string + "\n")
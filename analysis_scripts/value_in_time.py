@@ -1,6 +1,6 @@
 """ energy_in_time script """
 from common import info, info_cyan
-from postprocess import get_steps, rank
+from postprocess import get_steps, map_steps, rank, FunctionalSet
 import numpy as np
 import dolfin as df
 import os
@@ -10,48 +10,56 @@ def description(ts, **kwargs):
     info("Plot mean field values in time.")
 
 
-def method(ts, dt=0, **kwargs):
-    """ Plot mean field values in time. """
-    info_cyan("Plot mean field values in time.")
+def value_keys(ts):
+    """ Sorted keys of the integrated values, with one key per component
+    of the velocity, and the field and component (or None) of each. """
+    keys = dict()
+    for field in ts.fields:
+        if field == "u":
+            for i in range(ts.dim):
+                keys["u_" + "xyz"[i]] = (field, i)
+        else:
+            keys[field] = (field, None)
+    return [(key,) + keys[key] for key in sorted(keys.keys())]
 
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
 
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
+def init(ts):
+    """ Set up the fields to integrate on the mesh of ts. """
+    x_ = ts.functions()
 
-    t = np.zeros(len(steps))
+    integrands = []
+    for key, field, i in value_keys(ts):
+        f = x_[field]
+        integrands.append((f[i] if i is not None else f)*df.dx)
+    values = FunctionalSet(ts.mesh, integrands)
+    return dict(x_=x_, values=values)
 
-    x_ = ts.functions()
 
-    fields = dict()
-    for field, f in x_.items():
-        if field == "u":
-            fields["u_x"] = f[0]
-            fields["u_y"] = f[1]
-        else:
-            fields[field] = f
+def kernel(ts, step, x_=None, values=None):
+    """ Integrated field values at a single step. """
+    info("Step {} of {}".format(step, len(ts)))
+
+    for field in x_.keys():
+        ts.update(x_[field], field, step)
 
-    data = dict()
+    return [ts.times[step]] + list(values.assemble())
 
-    for field in fields:
-        data[field] = np.zeros(len(steps))
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+def method(ts, dt=0, **kwargs):
+    """ Plot mean field values in time. """
+    info_cyan("Plot mean field values in time.")
 
-        for field in x_.keys():
-            ts.update(x_[field], field, step)
+    params = ts.get_parameters()
+    steps = get_steps(ts, dt)
 
-        for field, f in fields.items():
-            data[field][i] = df.assemble(f*df.dx)
+    problem = params["problem"]
+    info("Problem: {}".format(problem))
 
-        t[i] = ts.times[step]
+    field_keys = [key for key, _, _ in value_keys(ts)]
 
-    field_keys = sorted(fields.keys())
+    rows = map_steps(ts, steps, kernel, init)
 
-    savedata = np.array(
-        zip(steps, t, *[data[field] for field in field_keys]))
+    savedata = np.hstack((np.array(steps).reshape(-1, 1), np.array(rows)))
 
     if rank == 0:
         header = "Step\tTime\t"+"\t".join(field_keys)
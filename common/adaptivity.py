@@ -0,0 +1,140 @@
+"""
+This module contains adaptive mesh refinement around the diffuse interface
+and regions of high charge density.
+
+Since dolfin can only refine meshes, every adapted mesh is obtained by
+refining the base mesh a number of levels. Cells are marked for refinement
+where the refinement indicators are large, and regions where the
+indicators have decayed are thereby coarsened back towards the base mesh.
+"""
+import dolfin as df
+import numpy as np
+from cmd import info_cyan
+
+__author__ = "Gaute Linga"
+
+
+def field_function(w_, field, field_to_subproblem):
+    """ Returns a (collapsed) copy of a field from the work functions. """
+    name, i = field_to_subproblem[field]
+    if i < 0:
+        return w_[name]
+    return w_[name].split(deepcopy=True)[i]
+
+
+def interpolate_to_mesh(f, mesh):
+    """ Interpolate a function onto a function space of the same element
+    on another, possibly non-matching, mesh. """
+    space = df.FunctionSpace(mesh, f.function_space().ufl_element())
+    f_new = df.Function(space)
+    df.LagrangeInterpolator.interpolate(f_new, f)
+    return f_new
+
+
+def cell_averages(f, mesh):
+    """ Cell averages of an UFL expression on the mesh, ordered as the
+    cells. """
+    DG0 = df.FunctionSpace(mesh, "DG", 0)
+    q = df.TestFunction(DG0)
+    f_avg = df.assemble(q*f/df.CellVolume(mesh)*df.dx)
+    dofs = DG0.dofmap().entity_dofs(mesh, mesh.topology().dim())
+    return f_avg.get_local()[dofs]
+
+
+def refinement_indicator(mesh, phi, charge, interface_thickness,
+                         amr_phi_threshold, amr_charge_threshold):
+    """ Returns array of bools marking the cells that should be refined.
+
+    The phase field is resolved where eps*|grad phi| is above the
+    threshold, i.e. within the diffuse interface, and the charge density
+    where |rho_e| is above the threshold relative to its maximum.
+    """
+    marked = np.zeros(mesh.num_cells(), dtype=bool)
+    if phi is not None:
+        phi = interpolate_to_mesh(phi, mesh)
+        grad_phi = df.sqrt(df.dot(df.grad(phi), df.grad(phi)))
+        marked |= (cell_averages(interface_thickness*grad_phi, mesh)
+                   > amr_phi_threshold)
+    if charge is not None:
+        rho_e = abs(cell_averages(interpolate_to_mesh(charge, mesh), mesh))
+        rho_e_max = df.MPI.max(mesh.mpi_comm(),
+                               float(rho_e.max()) if rho_e.size else 0.)
+        if rho_e_max > 0.:
+            marked |= rho_e > amr_charge_threshold*rho_e_max
+    return marked
+
+
+def adapt_mesh(mesh_0, w_, field_to_subproblem, solutes,
+               interface_thickness, amr_levels,
+               amr_phi_threshold, amr_charge_threshold,
+               enable_PF, enable_EC, **namespace):
+    """ Returns a new mesh refined from the base mesh mesh_0 to resolve the
+    current solution. """
+    phi = None
+    if enable_PF:
+        phi = field_function(w_, "phi", field_to_subproblem)
+    charge = None
+    if enable_EC and any([solute[1] != 0 for solute in solutes]):
+        c = [field_function(w_, solute[0], field_to_subproblem)
+             for solute in solutes]
+        charge = df.project(sum([solute[1]*ci
+                                 for solute, ci in zip(solutes, c)]),
+                            c[0].function_space())
+
+    mesh = mesh_0
+    for level in xrange(amr_levels):
+        marked = refinement_indicator(mesh, phi, charge,
+                                      interface_thickness,
+                                      amr_phi_threshold,
+                                      amr_charge_threshold)
+        if df.MPI.sum(mesh.mpi_comm(), int(marked.sum())) == 0:
+            break
+        markers = df.MeshFunction("bool", mesh, mesh.topology().dim(), False)
+        markers.array()[:] = marked
+        mesh = df.refine(mesh, markers)
+
+    info_cyan("Adapted mesh: {} cells (base mesh: {} cells).".format(
+        int(df.MPI.sum(mesh.mpi_comm(), mesh.num_cells())),
+        int(df.MPI.sum(mesh_0.mpi_comm(), mesh_0.num_cells()))))
+    return mesh
+
+
+def has_real(element):
+    """ Check if the element is, or contains, a Real element, e.g. the
+    Lagrange multipliers of p_lagrange and V_lagrange. """
+    if element.family() == "Real":
+        return True
+    return any([has_real(sub_element)
+                for sub_element in element.sub_elements()])
+
+
+def transfer_function(f_old, f_new):
+    """ Transfer a function onto the function space of a new mesh.
+
+    LagrangeInterpolator does not support Real spaces, so the values of
+    Real functions are copied directly, and mixed functions with Real
+    components are transferred component by component.
+    """
+    element = f_new.function_space().ufl_element()
+    if not has_real(element):
+        df.LagrangeInterpolator.interpolate(f_new, f_old)
+    elif element.family() == "Real":
+        # The Real dof is owned by a single process, such that the sum
+        # over the processes is its value.
+        f_new.assign(df.Constant(f_old.vector().sum()))
+    else:
+        space = f_new.function_space()
+        parts_old = f_old.split(deepcopy=True)
+        parts_new = [df.Function(space.sub(i).collapse())
+                     for i in xrange(space.num_sub_spaces())]
+        for part_old, part_new in zip(parts_old, parts_new):
+            transfer_function(part_old, part_new)
+        df.FunctionAssigner(
+            space, [part.function_space() for part in parts_new]).assign(
+                f_new, parts_new)
+
+
+def transfer_functions(w_old, w_new):
+    """ Transfer work functions onto the function spaces of a new mesh. """
+    for name in w_new:
+        transfer_function(w_old[name], w_new[name])
@@ -0,0 +1,200 @@
+"""
+This module contains tools for reusing assembled matrices across timesteps.
+"""
+import dolfin as df
+import ufl
+from ufl.algorithms import extract_coefficients
+from profiling import profiler, Timer
+
+__author__ = "Gaute Linga"
+
+
+def is_time_invariant(expr):
+    """ Check if an UFL expression only depends on constants, i.e. not on
+    any functions or expressions that change during the simulation. """
+    return all([isinstance(coeff, df.Constant)
+                for coeff in extract_coefficients(expr)])
+
+
+def sum_terms(expr):
+    """ Split an UFL expression into the terms of its top-level sum. """
+    if isinstance(expr, ufl.classes.Sum):
+        terms = []
+        for operand in expr.ufl_operands:
+            terms.extend(sum_terms(operand))
+        return terms
+    return [expr]
+
+
+def split_form(a):
+    """ Split a form into a time-invariant and a coefficient-dependent part.
+    Either part is None if it is empty. """
+    integrals_const = []
+    integrals_var = []
+    for integral in a.integrals():
+        for term in sum_terms(integral.integrand()):
+            integral_term = integral.reconstruct(integrand=term)
+            if is_time_invariant(term):
+                integrals_const.append(integral_term)
+            else:
+                integrals_var.append(integral_term)
+    a_const = ufl.Form(integrals_const) if integrals_const else None
+    a_var = ufl.Form(integrals_var) if integrals_var else None
+    return a_const, a_var
+
+
+class CachedMatrix:
+    """ Matrix of a bilinear form, where the time-invariant part is kept
+    assembled in memory and only the coefficient-dependent part is
+    reassembled.
+
+    With split=False, the form is not split into terms: a time-invariant
+    form is assembled once, and any other form is reassembled as a whole.
+    The matrix is always assembled into the same tensor, with the
+    sparsity pattern of the whole form, such that the pattern is kept
+    and a direct solver only needs to redo the numeric factorization.
+
+    Note that df.Constants are considered time-invariant, so reset()
+    must be called if any of them are changed during the simulation.
+    """
+    def __init__(self, a, bcs=None, split=True):
+        if split:
+            self.a_const, self.a_var = split_form(a)
+        elif is_time_invariant(a):
+            self.a_const, self.a_var = a, None
+        else:
+            self.a_const, self.a_var = None, a
+        self.a = a
+        self.split = split
+        self.bcs = bcs if bcs is not None else []
+        self.A_const = None
+        self.A = None
+
+    def reset(self):
+        """ Force reassembly of the time-invariant part. """
+        self.A_const = None
+        self.A = None
+
+    def assemble(self):
+        """ Assemble the matrix, with boundary conditions applied.
+        Returns True if the matrix was changed. """
+        if self.A_const is not None and self.a_var is None:
+            return False
+
+        timer = Timer("assemble")
+        if self.a_const is None and not self.split:
+            self.A = df.assemble(self.a_var, tensor=self.A)
+        else:
+            if self.A_const is None:
+                if self.a_var is None:
+                    self.A_const = df.assemble(self.a_const)
+                else:
+                    # The parts may differ in their sparsity patterns,
+                    # e.g. if only one of them has facet integrals, so
+                    # both are kept in the pattern of the whole form.
+                    self.A_const = df.assemble(self.a)
+                    self.A_const.zero()
+                    if self.a_const is not None:
+                        df.assemble(self.a_const, tensor=self.A_const,
+                                    add_values=True)
+                self.A = self.A_const.copy()
+            else:
+                self.A.zero()
+                self.A.axpy(1.0, self.A_const, True)
+
+            if self.a_var is not None:
+                df.assemble(self.a_var, tensor=self.A, add_values=True)
+        timer.stop()
+
+        timer = Timer("bcs")
+        for bc in self.bcs:
+            bc.apply(self.A)
+        timer.stop()
+        return True
+
+
+class CachedLinearSolver:
+    """ Linear solver that keeps the time-invariant part of the bilinear
+    form assembled in memory (see CachedMatrix). The right hand side is
+    assembled at every solve.
+
+    A separate bilinear form a_P can be given to build the preconditioner
+    from, in which case solver must be a Krylov solver.
+
+    The solver keeps its operator between solves. With a direct solver,
+    the symbolic factorization is therefore done only once, the numeric
+    factorization is redone only when the matrix has changed, and a
+    time-invariant matrix is factorized only once.
+    """
+    def __init__(self, a, L, w, bcs=None,
+                 method="default", preconditioner="default",
+                 a_P=None, solver=None, split=True):
+        self.bcs = bcs if bcs is not None else []
+        self.A = CachedMatrix(a, self.bcs, split)
+        self.P = (CachedMatrix(a_P, self.bcs, split)
+                  if a_P is not None else None)
+        self.L = L
+        self.w = w
+        if solver is None:
+            solver = df.LinearSolver(method, preconditioner)
+        self.solver = solver
+        self.b = None
+
+    def forms(self):
+        """ Returns all forms that are assembled by the solver. """
+        forms = [self.A.a_const, self.A.a_var, self.L]
+        if self.P is not None:
+            forms += [self.P.a_const, self.P.a_var]
+        return [form for form in forms if form is not None]
+
+    def reset(self):
+        """ Force reassembly of the time-invariant parts. """
+        self.A.reset()
+        if self.P is not None:
+            self.P.reset()
+
+    def solve(self):
+        """ Assemble what has changed and solve the system. Returns the
+        number of iterations. """
+        changed = self.A.assemble()
+        if self.P is not None:
+            changed = self.P.assemble() or changed
+        timer = Timer("setup")
+        if self.P is not None:
+            if changed:
+                self.solver.set_operators(self.A.A, self.P.A)
+        elif changed:
+            self.solver.set_operator(self.A.A)
+        timer.stop()
+
+        timer = Timer("rhs")
+        self.b = df.assemble(self.L, tensor=self.b)
+        for bc in self.bcs:
+            bc.apply(self.b)
+        timer.stop()
+
+        # The factorization or preconditioner setup of a changed
+        # operator is done here.
+        timer = Timer("linear_solve")
+        num_iterations = self.solver.solve(self.w.vector(), self.b)
+        timer.stop()
+        profiler.record("iterations", num_iterations)
+        return num_iterations
+
+
+def projection_solver(a, L, w, bcs=None, method=None,
+                      preconditioner="amg"):
+    """ Solver for a projection step, i.e. a linear problem where the
+    matrix only depends on the mesh and fixed parameters. The matrix is
+    assembled and factorized, or its preconditioner built, once, such
+    that only the right hand side is assembled at every solve.
+
+    If a Krylov method is given, it is started from the previous
+    solution. A matrix that turns out not to be time-invariant is
+    reassembled as in CachedLinearSolver with split=False.
+    """
+    solver = None
+    if method is not None:
+        solver = df.PETScKrylovSolver(method, preconditioner)
+        solver.parameters["nonzero_initial_guess"] = True
+    return CachedLinearSolver(a, L, w, bcs, solver=solver, split=False)
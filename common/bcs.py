@@ -1,7 +1,9 @@
 """
-This module defines a range of different boundary conditions.
+This module defines a range of different boundary conditions, and
+boundaries that are marked by vectorized tests on the boundary facets.
 """
-from dolfin import DirichletBC, Constant, Expression
+from dolfin import DirichletBC, Constant, Expression, SubDomain, \
+    BoundaryMesh, DOLFIN_EPS
 import numpy as np
 
 __author__ = "Gaute Linga"
@@ -126,3 +128,110 @@ class Open(GenericBC):
 
     def nbc(self):
         return Constant(self.value)
+
+
+# Boundary facets of the last mesh that was marked
+_boundary_facets = dict()
+
+
+def boundary_facets(mesh):
+    """ Returns the indices of the exterior facets of the mesh, the
+    coordinates of their vertices, with shape (facets, vertices, gdim),
+    and their midpoints. """
+    if mesh.id() not in _boundary_facets:
+        bmesh = BoundaryMesh(mesh, "exterior")
+        facets = bmesh.entity_map(bmesh.topology().dim()).array()
+        x = bmesh.coordinates()[bmesh.cells()]
+        _boundary_facets.clear()
+        _boundary_facets[mesh.id()] = (np.array(facets, dtype=np.intp),
+                                       x, x.mean(axis=1))
+    return _boundary_facets[mesh.id()]
+
+
+class VectorizedSubDomain(SubDomain):
+    """ A boundary that is given by a vectorized test on many points at
+    once, inside_points(x), where x has one point per row.
+
+    Facet functions are marked by testing the vertices and midpoints of
+    all exterior facets in a single call, instead of calling back into
+    Python for each vertex. As for a SubDomain, a facet is marked if all
+    its vertices and its midpoint are inside. Other uses go through
+    inside() one point at a time.
+    """
+    def inside_points(self, x):
+        raise NotImplementedError()
+
+    def inside(self, x, on_boundary):
+        return bool(on_boundary and
+                    self.inside_points(np.array(x, ndmin=2))[0])
+
+    def mark(self, subdomains, value, check_midpoint=True):
+        mesh = subdomains.mesh()
+        if subdomains.dim() != mesh.topology().dim()-1:
+            return SubDomain.mark(self, subdomains, value, check_midpoint)
+        facets, x, x_mid = boundary_facets(mesh)
+        num_facets, num_vertices, gdim = x.shape
+        if check_midpoint:
+            points = np.vstack((x.reshape(-1, gdim), x_mid))
+        else:
+            points = x.reshape(-1, gdim)
+        inside = self.inside_points(points)
+        is_marked = np.all(
+            inside[:num_facets*num_vertices].reshape(num_facets, -1),
+            axis=1)
+        if check_midpoint:
+            is_marked &= inside[num_facets*num_vertices:]
+        values = subdomains.array()
+        values[facets[is_marked]] = value
+        subdomains.set_values(values)
+
+
+class Plane(VectorizedSubDomain):
+    """ The part of the boundary where coordinate dim equals x0, e.g. a
+    side of a box. """
+    def __init__(self, dim, x0, tol=DOLFIN_EPS):
+        self.dim = dim
+        self.x0 = x0
+        self.tol = tol
+        VectorizedSubDomain.__init__(self)
+
+    def inside_points(self, x):
+        return np.abs(x[:, self.dim] - self.x0) < self.tol
+
+
+class Disks(VectorizedSubDomain):
+    """ The boundaries of circular obstacles, i.e. the points closer than
+    radius + tol to any of the centroids. The centroids are put in a
+    KD-tree if scipy is available, such that the test scales to many
+    obstacles. """
+    def __init__(self, centroids, radii, tol=0.):
+        self.centroids = np.array(centroids, dtype=float, ndmin=2)
+        self.reach = np.ones(len(self.centroids))*radii + tol
+        try:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(self.centroids)
+        except ImportError:
+            self.tree = None
+        VectorizedSubDomain.__init__(self)
+
+    def inside_points(self, x):
+        x = x[:, :self.centroids.shape[1]]
+        num_centroids = len(self.centroids)
+        if self.tree is None:
+            inside = np.zeros(len(x), dtype=bool)
+            for x_c, reach in zip(self.centroids, self.reach):
+                inside |= np.sum((x - x_c)**2, axis=1) < reach**2
+            return inside
+
+        # Query more neighbours until all centroids within the largest
+        # reach are found.
+        k = 1
+        while True:
+            dist, ids = self.tree.query(x, k=k,
+                                       distance_upper_bound=self.reach.max())
+            dist = dist.reshape(len(x), k)
+            ids = np.minimum(ids.reshape(len(x), k), num_centroids-1)
+            inside = np.any(dist < self.reach[ids], axis=1)
+            if k == num_centroids or not np.isfinite(dist[:, -1]).any():
+                return inside
+            k = min(2*k, num_centroids)
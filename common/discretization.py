@@ -0,0 +1,212 @@
+"""
+This module sets up the discretization of the problem on a given mesh,
+i.e. function spaces, work functions, boundary conditions and measures.
+It is called once at startup, and again whenever the mesh is adapted.
+"""
+import dolfin as df
+from cmd import info_on_red
+
+__author__ = "Gaute Linga"
+
+
+def discretize(mesh, subproblems, base_elements,
+               constrained_domain, create_bcs, dump_subdomains,
+               **namespace):
+    """ Returns dict with everything on the mesh that the solvers need. """
+    ns = dict(namespace, mesh=mesh, subproblems=subproblems,
+              base_elements=base_elements, dump_subdomains=dump_subdomains)
+
+    # Declare finite elements
+    elements = dict()
+    for name, (family, degree, is_vector) in base_elements.iteritems():
+        if is_vector:
+            elements[name] = df.VectorElement(family, mesh.ufl_cell(), degree)
+        else:
+            elements[name] = df.FiniteElement(family, mesh.ufl_cell(), degree)
+    ns["elements"] = elements
+
+    # Declare function spaces
+    spaces = dict()
+    for name, subproblem in subproblems.iteritems():
+        if len(subproblem) > 1:
+            spaces[name] = df.FunctionSpace(
+                mesh, df.MixedElement(
+                    [elements[s["element"]] for s in subproblem]),
+                constrained_domain=constrained_domain(**ns))
+        # If there is only one field in the subproblem, don't bother with
+        # the MixedElement.
+        elif len(subproblem) == 1:
+            spaces[name] = df.FunctionSpace(
+                mesh, elements[subproblem[0]["element"]],
+                constrained_domain=constrained_domain(**ns))
+        else:
+            info_on_red("Something went wrong here!")
+            exit("")
+
+    # dim = mesh.geometry().dim()  # In case the velocity fields should be
+    #                              # segregated at some point
+    fields = []
+    field_to_subspace = dict()
+    field_to_subproblem = dict()
+    for name, subproblem in subproblems.iteritems():
+        if len(subproblem) > 1:
+            for i, s in enumerate(subproblem):
+                field = s["name"]
+                fields.append(field)
+                field_to_subspace[field] = spaces[name].sub(i)
+                field_to_subproblem[field] = (name, i)
+        else:
+            field = subproblem[0]["name"]
+            fields.append(field)
+            field_to_subspace[field] = spaces[name]
+            field_to_subproblem[field] = (name, -1)
+
+    # Create overarching test and trial functions
+    test_functions = dict()
+    trial_functions = dict()
+    for name, subproblem in subproblems.iteritems():
+        if len(subproblem) > 1:
+            test_functions[name] = df.TestFunctions(spaces[name])
+            trial_functions[name] = df.TrialFunctions(spaces[name])
+        else:
+            test_functions[name] = df.TestFunction(spaces[name])
+            trial_functions[name] = df.TrialFunction(spaces[name])
+
+    # Create work dictionaries for all subproblems
+    w_ = dict((subproblem, df.Function(space, name=subproblem))
+              for subproblem, space in spaces.iteritems())
+    w_1 = dict((subproblem, df.Function(space, name=subproblem+"_1"))
+               for subproblem, space in spaces.iteritems())
+    w_tmp = dict((subproblem, df.Function(space, name=subproblem+"_tmp"))
+                 for subproblem, space in spaces.iteritems())
+
+    # Shortcuts to the fields
+    x_ = dict()
+    for name, subproblem in subproblems.iteritems():
+        if len(subproblem) > 1:
+            w_loc = df.split(w_[name])
+            for i, field in enumerate(subproblem):
+                x_[field["name"]] = w_loc[i]
+        else:
+            x_[subproblem[0]["name"]] = w_[name]
+
+    ns.update(spaces=spaces, fields=fields,
+              field_to_subspace=field_to_subspace,
+              field_to_subproblem=field_to_subproblem,
+              test_functions=test_functions, trial_functions=trial_functions,
+              w_=w_, w_1=w_1, w_tmp=w_tmp, x_=x_)
+
+    # Get boundary conditions, from fields to subproblems
+    bcs_tuple = create_bcs(**ns)
+    if len(bcs_tuple) == 3:
+        boundaries, bcs, bcs_pointwise = bcs_tuple
+    elif len(bcs_tuple) == 2:
+        boundaries, bcs = bcs_tuple
+        bcs_pointwise = None
+    else:
+        info_on_red("Wrong implementation of create_bcs.")
+        exit()
+
+    # Set up subdomains
+    subdomains = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1)
+    subdomains.set_all(0)
+    boundary_to_mark = dict()
+    mark_to_boundary = dict()
+    for i, (boundary_name, markers) in enumerate(boundaries.iteritems()):
+        for marker in markers:
+            marker.mark(subdomains, i+1)
+        boundary_to_mark[boundary_name] = i+1
+        mark_to_boundary[i] = boundary_name
+
+    if dump_subdomains:
+        subdomains_xdmf = df.XDMFFile("subdomains_dump.xdmf")
+        subdomains_xdmf.write(subdomains)
+
+    # Set up dirichlet part of bcs
+    dirichlet_bcs = dict()
+    for subproblem_name in subproblems.keys():
+        dirichlet_bcs[subproblem_name] = []
+
+    # Neumann BCs (per field)
+    neumann_bcs = dict()
+    for field in fields:
+        neumann_bcs[field] = dict()
+
+    for boundary_name, bcs_fields in bcs.iteritems():
+        for field, bc in bcs_fields.iteritems():
+            subproblem_name = field_to_subproblem[field][0]
+            subspace = field_to_subspace[field]
+            mark = boundary_to_mark[boundary_name]
+            if bc.is_dbc():
+                dirichlet_bcs[subproblem_name].append(
+                    bc.dbc(subspace, subdomains, mark))
+            if bc.is_nbc():
+                neumann_bcs[field][boundary_name] = bc.nbc()
+
+    # Pointwise dirichlet bcs
+    for field, (value, c_code) in bcs_pointwise.iteritems():
+        subproblem_name = field_to_subproblem[field][0]
+        subspace = field_to_subspace[field]
+        if not isinstance(value, df.Expression):
+            value = df.Constant(value)
+        dirichlet_bcs[subproblem_name].append(
+            df.DirichletBC(subspace, value, c_code, "pointwise"))
+
+    # Compute some mesh related stuff
+    dx = df.dx
+    ds = df.Measure("ds", domain=mesh, subdomain_data=subdomains)
+    normal = df.FacetNormal(mesh)
+
+    return dict(mesh=mesh, elements=elements, spaces=spaces, fields=fields,
+                field_to_subspace=field_to_subspace,
+                field_to_subproblem=field_to_subproblem,
+                test_functions=test_functions,
+                trial_functions=trial_functions,
+                w_=w_, w_1=w_1, w_tmp=w_tmp, x_=x_,
+                boundaries=boundaries, bcs=bcs, bcs_pointwise=bcs_pointwise,
+                subdomains=subdomains,
+                boundary_to_mark=boundary_to_mark,
+                mark_to_boundary=mark_to_boundary,
+                dirichlet_bcs=dirichlet_bcs, neumann_bcs=neumann_bcs,
+                dx=dx, ds=ds, normal=normal)
+
+
+def initialize_fields(initialize, subproblems, w_, w_1, **namespace):
+    """ Set the work functions to the initial state given by the problem. """
+    w_init_fields = initialize(subproblems=subproblems, w_=w_, w_1=w_1,
+                               **namespace)
+    if w_init_fields:
+        for name, subproblem in subproblems.iteritems():
+            w_init_vector = []
+            if len(subproblem) > 1:
+                for i, s in enumerate(subproblem):
+                    field = s["name"]
+                    # Only change initial state if it is given in
+                    # w_init_fields.
+                    if field in w_init_fields:
+                        w_init_field = w_init_fields[field]
+                    else:
+                        # Otherwise take the default value of that field.
+                        w_init_field = w_[name].sub(i)
+                    # Use df.project(df.as_vector(...)) with care...
+                    num_subspaces = \
+                        w_init_field.function_space().num_sub_spaces()
+                    if num_subspaces == 0:
+                        w_init_vector.append(w_init_field)
+                    else:
+                        for j in xrange(num_subspaces):
+                            w_init_vector.append(w_init_field.sub(j))
+                assert len(w_init_vector) == w_[name].value_size()
+                w_init = df.project(
+                    df.as_vector(tuple(w_init_vector)),
+                    w_[name].function_space())
+            else:
+                field = subproblem[0]["name"]
+                if field in w_init_fields:
+                    w_init_field = w_init_fields[field]
+                else:
+                    # Take default value...
+                    w_init_field = w_[name]
+                w_init = df.project(w_init_field, w_[name].function_space())
+            w_[name].interpolate(w_init)
+            w_1[name].interpolate(w_init)
@@ -1,6 +1,9 @@
 import os
-from dolfin import MPI, mpi_comm_world, XDMFFile, HDF5File, Mesh
+import numpy as np
+from dolfin import MPI, mpi_comm_world, XDMFFile, HDF5File, Mesh, \
+    Function, FunctionAssigner, assemble, inner, dx
 from cmd import info_red, info_cyan
+from ordering import reorder_mesh
 import simplejson as json
 from xml.etree import cElementTree as ET
 
@@ -11,7 +14,10 @@ __license__ = "MIT"
 
 __all__ = ["mpi_is_root", "makedirs_safe", "load_parameters",
            "dump_parameters", "create_initial_folders",
+           "create_tstepfiles", "StatisticsIndex", "XDMFWriter",
+           "CheckpointWriter",
            "save_solution", "save_checkpoint", "load_checkpoint",
+           "load_checkpoint_mesh",
            "load_mesh", "remove_safe", "parse_xdmf"]
 
 
@@ -70,13 +76,8 @@ def create_initial_folders(folder, restart_folder, fields, tstep,
     makedirs_safe(os.path.join(newfolder, "Checkpoint"))
 
     # Initialize timestep files
-    tstepfiles = dict()
-    for field in fields:
-        filename = os.path.join(tstepfolder,
-                                field + "_from_tstep_{}.xdmf".format(tstep))
-        tstepfiles[field] = XDMFFile(mpi_comm_world(), filename)
-        tstepfiles[field].parameters["rewrite_function_mesh"] = False
-        tstepfiles[field].parameters["flush_output"] = True
+    tstepfiles = create_tstepfiles(newfolder, fields, tstep,
+                                   parameters["xdmf_flush"])
 
     # Dump settings
     if mpi_is_root():
@@ -86,18 +87,43 @@ def create_initial_folders(folder, restart_folder, fields, tstep,
     return newfolder, tstepfiles
 
 
+def create_tstepfiles(newfolder, fields, tstep, flush=True):
+    """ Create XDMF files for the timeseries of each field, starting from
+    the given timestep. """
+    tstepfolder = os.path.join(newfolder, "Timeseries")
+    tstepfiles = dict()
+    for field in fields:
+        filename = os.path.join(tstepfolder,
+                                field + "_from_tstep_{}.xdmf".format(tstep))
+        tstepfiles[field] = XDMFFile(mpi_comm_world(), filename)
+        tstepfiles[field].parameters["rewrite_function_mesh"] = False
+        tstepfiles[field].parameters["flush_output"] = flush
+    return tstepfiles
+
+
 def save_solution(tstep, t, T, w_, w_1, folder, newfolder,
                   save_intv, checkpoint_intv,
-                  parameters, tstepfiles, subproblems, **namespace):
+                  parameters, tstepfiles, subproblems,
+                  mesh, adaptive_mesh, xdmf_writer=None,
+                  checkpoint_writer=None, stats_index=None, **namespace):
     """ Save solution either to  """
     if tstep % save_intv == 0:
         # Save snapshot to xdmf
-        save_xdmf(t, w_, subproblems, tstepfiles)
+        if xdmf_writer is not None:
+            xdmf_writer.write(t)
+        else:
+            save_xdmf(t, w_, subproblems, tstepfiles, stats_index)
 
     stop = check_if_kill(folder) or t >= T
     if tstep % checkpoint_intv == 0 or stop:
-        # Save checkpoint
-        save_checkpoint(tstep, t, w_, w_1, newfolder, parameters)
+        # Save checkpoint. The mesh is stored along with the fields
+        # if it changes during the simulation.
+        if checkpoint_writer is not None:
+            checkpoint_writer.write(tstep, t, w_, w_1, parameters,
+                                    mesh if adaptive_mesh else None)
+        else:
+            save_checkpoint(tstep, t, w_, w_1, newfolder, parameters,
+                            mesh if adaptive_mesh else None)
 
     return stop
 
@@ -116,7 +142,7 @@ def check_if_kill(folder):
         return False
 
 
-def save_xdmf(t, w_, subproblems, tstepfiles):
+def save_xdmf(t, w_, subproblems, tstepfiles, stats_index=None):
     """ Save snapshot of solution to xdmf file. """
     for name, subproblem in subproblems.iteritems():
         q_ = w_[name].split()
@@ -126,51 +152,212 @@ def save_xdmf(t, w_, subproblems, tstepfiles):
                 if field in tstepfiles:
                     q.rename(field, "tmp")
                     tstepfiles[field].write(q, float(t))
+                    if stats_index is not None:
+                        stats_index.write(field, q, t)
         else:
             field = subproblem[0]["name"]
             if field in tstepfiles:
                 q = w_[name]
                 q.rename(field, "tmp")
                 tstepfiles[field].write(q, float(t))
+                if stats_index is not None:
+                    stats_index.write(field, q, t)
+
+
+def vertex_weights(mesh):
+    """ Weight of each local vertex, such that vertices shared between
+    processes are counted once in total. """
+    weights = np.ones(mesh.num_vertices())
+    for vertex, processes in mesh.topology().shared_entities(0).iteritems():
+        weights[vertex] = 1./(len(processes)+1)
+    return weights
+
+
+def field_statistics(q, weights):
+    """ Returns the min, max and mean of the vertex values (i.e. the values
+    stored in the XDMF file) and the integral of each component of q,
+    followed by the L2 norm of q. """
+    comm = mpi_comm_world()
+    mesh = q.function_space().mesh()
+    num_components = q.value_size()
+    values = q.compute_vertex_values(mesh).reshape((num_components, -1))
+    stats_min = [MPI.min(comm, float(v.min())) for v in values]
+    stats_max = [MPI.max(comm, float(v.max())) for v in values]
+    num_vertices = MPI.sum(comm, float(weights.sum()))
+    stats_mean = [MPI.sum(comm, float(np.dot(v, weights)))/num_vertices
+                  for v in values]
+    if num_components == 1:
+        stats_integral = [assemble(q*dx)]
+    else:
+        stats_integral = [assemble(q[i]*dx) for i in xrange(num_components)]
+    stats_L2 = np.sqrt(assemble(inner(q, q)*dx))
+    if num_components == 2:
+        # 2D vectors are stored with three components in XDMF.
+        for stats in [stats_min, stats_max, stats_mean, stats_integral]:
+            stats.append(0.)
+    return stats_min + stats_max + stats_mean + stats_integral + [stats_L2]
+
+
+class StatisticsIndex:
+    """ Index of the statistics of each snapshot of the fields, stored in
+    Statistics/<field>_from_tstep_<tstep>.dat, with one line per snapshot:
+
+        t min max mean integral L2
+
+    where min, max, mean and integral are given for each component.
+    This allows the postprocessing to get e.g. the extrema of a field
+    without reading the timeseries.
+    """
+    def __init__(self, newfolder, fields, tstep):
+        statsfolder = os.path.join(newfolder, "Statistics")
+        self.filenames = dict(
+            (field, os.path.join(statsfolder,
+                                 field + "_from_tstep_{}.dat".format(tstep)))
+            for field in fields)
+        self.weights = dict()
+        if mpi_is_root():
+            for filename in self.filenames.values():
+                with file(filename, "w") as statsfile:
+                    statsfile.write("# t min max mean integral L2\n")
+
+    def write(self, field, q, t):
+        """ Append the statistics of q, the snapshot of field at time t. """
+        if field not in self.filenames:
+            return
+        mesh = q.function_space().mesh()
+        if mesh.id() not in self.weights:
+            self.weights = {mesh.id(): vertex_weights(mesh)}
+        stats = field_statistics(q, self.weights[mesh.id()])
+        if mpi_is_root():
+            with file(self.filenames[field], "a") as statsfile:
+                statsfile.write(" ".join(
+                    [repr(float(t))] + [repr(float(v)) for v in stats]) + "\n")
+
+
+class XDMFWriter:
+    """ Writes snapshots of the solution to the XDMF timestep files.
+
+    The fields are copied from the work functions into preallocated
+    buffer functions, which avoids the allocations of split().
+    The statistics of each snapshot are added to stats_index, if given.
+
+    The snapshots are written synchronously, since the XDMF output is
+    collective over MPI and goes through HDF5, neither of which may be
+    used from a second thread. The flush after each write can be turned
+    off with xdmf_flush=False.
+    """
+    def __init__(self, w_, subproblems, tstepfiles, stats_index=None):
+        self.tstepfiles = tstepfiles
+        self.stats_index = stats_index
+
+        # Sources of the fields: the subfunction to copy from, and
+        # the assigner to use (None if not part of a mixed space).
+        self.sources = dict()
+        self.buffers = dict()
+        for name, subproblem in subproblems.iteritems():
+            if len(subproblem) > 1:
+                for i, s in enumerate(subproblem):
+                    field = s["name"]
+                    if field in tstepfiles:
+                        w_sub = w_[name].sub(i)
+                        space = w_sub.function_space().collapse()
+                        self.buffers[field] = Function(space, name=field)
+                        self.sources[field] = (w_sub, FunctionAssigner(
+                            space, w_sub.function_space()))
+            else:
+                field = subproblem[0]["name"]
+                if field in tstepfiles:
+                    self.buffers[field] = Function(
+                        w_[name].function_space(), name=field)
+                    self.sources[field] = (w_[name], None)
+
+    def write(self, t):
+        """ Copy the current solution and write it at time t. """
+        for field, (source, assigner) in self.sources.iteritems():
+            q = self.buffers[field]
+            if assigner is not None:
+                assigner.assign(q, source)
+            else:
+                q.assign(source)
+            if self.stats_index is not None:
+                self.stats_index.write(field, q, t)
+            self.tstepfiles[field].write(q, float(t))
+
+
+def rotate_safe(path, generations):
+    """ Keep the given number of generations of a file, as path, path.1,
+    path.2, etc. The current file stays in place (as a hard link), such
+    that a complete file exists at all times. """
+    if not mpi_is_root() or not os.path.exists(path):
+        return
+    for k in xrange(generations-1, 0, -1):
+        older = "{}.{}".format(path, k-1) if k > 1 else path
+        oldest = "{}.{}".format(path, k)
+        if os.path.exists(older):
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            if k > 1:
+                os.rename(older, oldest)
+            else:
+                os.link(older, oldest)
+
+
+def replace_safe(path_tmp, path, generations=1):
+    """ Atomically replace path by path_tmp, keeping older generations. """
+    if mpi_is_root():
+        rotate_safe(path, generations)
+        os.rename(path_tmp, path)
 
 
-def save_checkpoint(tstep, t, w_, w_1, newfolder, parameters):
+def save_checkpoint(tstep, t, w_, w_1, newfolder, parameters, mesh=None,
+                    generations=1):
     """ Save checkpoint files.
 
+    The files are written under temporary names and atomically renamed,
+    such that a complete checkpoint exists at all times, also if the
+    simulation is killed while writing. Older checkpoints are kept as
+    fields.h5.1, ... up to the given number of generations.
+    Both the current and the previous solution are stored, since not
+    every solver has set the previous solution to the current one when
+    the checkpoint is taken.
+
     A part of this is taken from the Oasis code."""
     checkpointfolder = os.path.join(newfolder, "Checkpoint")
     parameters["num_processes"] = MPI.size(mpi_comm_world())
     parameters["t_0"] = t
     parameters["tstep"] = tstep
     parametersfile = os.path.join(checkpointfolder, "parameters.dat")
-    parametersfile_old = parametersfile + ".old"
     if mpi_is_root():
-        # In case of failure, keep old file.
-        if os.path.exists(parametersfile):
-            os.system("mv {0} {1}".format(parametersfile,
-                                          parametersfile_old))
-        dump_parameters(parameters, parametersfile)
+        dump_parameters(parameters, parametersfile + ".tmp")
 
-    MPI.barrier(mpi_comm_world())
     h5filename = os.path.join(checkpointfolder, "fields.h5")
-    h5filename_old = h5filename + ".old"
-    # In case of failure, keep old file.
-    if mpi_is_root() and os.path.exists(h5filename):
-        os.system("mv {0} {1}".format(h5filename, h5filename_old))
-    h5file = HDF5File(mpi_comm_world(), h5filename, "w")
+    h5file = HDF5File(mpi_comm_world(), h5filename + ".tmp", "w")
     h5file.flush()
+    if mesh is not None:
+        h5file.write(mesh, "mesh")
     for field in w_:
         info_red("Storing subproblem: " + field)
-        MPI.barrier(mpi_comm_world())
         h5file.write(w_[field], field + "/current")
         if field in w_1:
             h5file.write(w_1[field], field + "/previous")
-        MPI.barrier(mpi_comm_world())
     h5file.close()
-    # Since program is still running, delete the old files.
-    remove_safe(h5filename_old)
+
+    MPI.barrier(mpi_comm_world())
+    replace_safe(h5filename + ".tmp", h5filename, generations)
+    replace_safe(parametersfile + ".tmp", parametersfile, generations)
     MPI.barrier(mpi_comm_world())
-    remove_safe(parametersfile_old)
+
+
+class CheckpointWriter:
+    """ Writes checkpoints of the run in newfolder, keeping the given
+    number of generations. """
+    def __init__(self, newfolder, generations=1):
+        self.newfolder = newfolder
+        self.generations = generations
+
+    def write(self, tstep, t, w_, w_1, parameters, mesh=None):
+        save_checkpoint(tstep, t, w_, w_1, self.newfolder, parameters,
+                        mesh, self.generations)
 
 
 def load_checkpoint(checkpointfolder, w_, w_1):
@@ -180,17 +367,38 @@ def load_checkpoint(checkpointfolder, w_, w_1):
         for field in w_:
             info_red("Loading subproblem: " + field)
             h5file.read(w_[field], field + "/current")
-            h5file.read(w_1[field], field + "/previous")
+            if h5file.has_dataset(field + "/previous"):
+                h5file.read(w_1[field], field + "/previous")
+            else:
+                w_1[field].assign(w_[field])
+        h5file.close()
+
+
+def load_checkpoint_mesh(checkpointfolder):
+    """ Load the mesh stored in the checkpoint, if any. """
+    mesh = None
+    if checkpointfolder:
+        h5filename = os.path.join(checkpointfolder, "fields.h5")
+        h5file = HDF5File(mpi_comm_world(), h5filename, "r")
+        if h5file.has_dataset("mesh"):
+            info_red("Loading mesh from checkpoint.")
+            mesh = Mesh()
+            h5file.read(mesh, "mesh", False)
         h5file.close()
+    return mesh
 
 
-def load_mesh(filename):
-    """ Loads in the mesh specified by the argument filename. """
+def load_mesh(filename, reorder=None):
+    """ Loads in the mesh specified by the argument filename. With reorder
+    "rcm" or "hilbert", the vertices and cells are renumbered, see
+    common/ordering.py. """
     info_cyan("Loading mesh: " + filename)
     mesh = Mesh()
     h5file = HDF5File(mesh.mpi_comm(), filename, "r")
     h5file.read(mesh, "mesh", False)
     h5file.close()
+    if reorder:
+        mesh = reorder_mesh(mesh, reorder)
     return mesh
 
 
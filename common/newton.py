@@ -0,0 +1,174 @@
+"""
+This module contains a Newton solver for the monolithic solvers, where
+the Jacobian can be reused over several iterations and timesteps.
+"""
+import math
+import dolfin as df
+from cmd import info_blue
+from profiling import profiler, Timer
+
+__author__ = "Gaute Linga"
+
+
+class LaggedNewtonSolver:
+    """ Newton solver with Jacobian lagging.
+
+    The Jacobian (and thereby its factorization or preconditioner) is
+    kept for up to max_lag iterations, also across timesteps, as long as
+    the residual decreases by at least a factor lag_ratio per iteration.
+    With max_lag = 0, the Jacobian is reassembled at every iteration, as
+    in standard Newton. If the solver fails to converge with a lagged
+    Jacobian, the step is repeated with a fresh Jacobian at every
+    iteration.
+
+    Steps are damped by a backtracking line search on the residual norm.
+    With a Krylov solver, the linear tolerance is chosen by the
+    Eisenstat-Walker rule (choice 2), such that the linear systems are
+    solved only as accurately as the current Newton iterate warrants.
+
+    Since the Jacobian depends on the timestep, reset() must be called
+    when it is changed.
+    """
+    def __init__(self, F, w, bcs, J, method="default",
+                 preconditioner="default", max_lag=0, lag_ratio=0.5,
+                 rtol=1e-9, atol=1e-10, max_it=50, name="Newton"):
+        self.F = F
+        self.J = J
+        self.w = w
+        self.bcs = bcs
+        self.bcs_hom = []
+        for bc in bcs:
+            bc_hom = df.DirichletBC(bc)
+            bc_hom.homogenize()
+            self.bcs_hom.append(bc_hom)
+        self.iterative = method not in ["default", "lu", "mumps",
+                                        "superlu_dist", "umfpack"]
+        if self.iterative:
+            self.solver = df.PETScKrylovSolver(method, preconditioner)
+        else:
+            self.solver = df.LUSolver(method)
+        self.max_lag = max_lag
+        self.lag_ratio = lag_ratio
+        self.rtol = rtol
+        self.atol = atol
+        self.max_it = max_it
+        self.name = name
+
+        # Eisenstat-Walker parameters
+        self.eta_0 = 0.5
+        self.eta_max = 0.9
+        self.ew_gamma = 0.9
+        self.ew_alpha = 2.
+
+        # Line search parameters
+        self.armijo = 1e-4
+        self.max_backtracks = 4
+
+        self.A = None
+        self.b = None
+        self.dw = df.Function(w.function_space())
+        self.w_0 = df.Function(w.function_space())
+        self.jacobian_age = None
+        self.num_jacobians = 0
+
+    def forms(self):
+        """ Returns all forms that are assembled by the solver. """
+        return [self.F, self.J]
+
+    def reset(self):
+        """ Force reassembly of the Jacobian. """
+        self.jacobian_age = None
+
+    def residual(self):
+        with Timer("residual"):
+            self.b = df.assemble(self.F, tensor=self.b)
+            for bc in self.bcs_hom:
+                bc.apply(self.b)
+            r = self.b.norm("l2")
+        profiler.record("residual", r)
+        return r
+
+    def assemble_jacobian(self):
+        with Timer("jacobian"):
+            self.A = df.assemble(self.J, tensor=self.A)
+            for bc in self.bcs_hom:
+                bc.apply(self.A)
+        with Timer("setup"):
+            self.solver.set_operator(self.A)
+        self.jacobian_age = 0
+        self.num_jacobians += 1
+
+    def solve(self):
+        """ Solve the nonlinear problem. Raises RuntimeError if it does not
+        converge. Returns the number of Newton and Krylov iterations. """
+        self.w_0.assign(self.w)
+        try:
+            return self._solve(self.max_lag)
+        except RuntimeError:
+            if self.max_lag == 0:
+                raise
+        self.w.assign(self.w_0)
+        self.reset()
+        return self._solve(0)
+
+    def _solve(self, max_lag):
+        for bc in self.bcs:
+            bc.apply(self.w.vector())
+
+        num_jacobians_0 = self.num_jacobians
+        num_krylov = 0
+        r = self.residual()
+        r_0 = r
+        r_prev = None
+        eta = self.eta_0
+        tol = max(self.atol, self.rtol*r_0)
+
+        it = 0
+        while not r <= tol:
+            if math.isnan(r) or math.isinf(r) or it == self.max_it:
+                raise RuntimeError(
+                    "{} solver did not converge in {} iterations "
+                    "(residual {:e}).".format(self.name, it, r))
+            # Reuse the Jacobian if it is recent and still gives
+            # sufficient convergence.
+            if bool(self.jacobian_age is None or
+                    self.jacobian_age >= max_lag or
+                    (r_prev is not None and r > self.lag_ratio*r_prev)):
+                self.assemble_jacobian()
+
+            if self.iterative:
+                if r_prev is not None:
+                    eta_prev = eta
+                    eta = self.ew_gamma*(r/r_prev)**self.ew_alpha
+                    eta_safe = self.ew_gamma*eta_prev**self.ew_alpha
+                    if eta_safe > 0.1:
+                        eta = max(eta, eta_safe)
+                eta = min(self.eta_max, max(eta, 0.5*tol/r))
+                self.solver.parameters["relative_tolerance"] = eta
+
+            with Timer("linear_solve"):
+                num_krylov += self.solver.solve(self.dw.vector(), self.b)
+
+            # Backtracking line search
+            step = 1.
+            x = self.w.vector()
+            x.axpy(-step, self.dw.vector())
+            r_new = self.residual()
+            for k in xrange(self.max_backtracks):
+                if r_new <= (1.-self.armijo*step)*r:
+                    break
+                x.axpy(0.5*step, self.dw.vector())
+                step *= 0.5
+                r_new = self.residual()
+
+            r_prev, r = r, r_new
+            self.jacobian_age += 1
+            it += 1
+
+        profiler.record("iterations", it)
+        profiler.record("krylov_iterations", num_krylov)
+        info_blue("{}: {} iterations, {} Krylov iterations, "
+                  "{} Jacobian assemblies, residual {:e}".format(
+                      self.name, it, num_krylov if self.iterative else 0,
+                      self.num_jacobians - num_jacobians_0, r))
+        return it, num_krylov
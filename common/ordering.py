@@ -0,0 +1,234 @@
+"""
+This module contains reorderings of the vertices and cells of meshes,
+which improve the memory locality in assembly and reduce the bandwidth
+of the assembled matrices, e.g. for the direct solvers.
+"""
+import numpy as np
+import dolfin as df
+from cmd import info, info_warning
+
+__author__ = "Gaute Linga"
+
+__all__ = ["fill_mesh", "bandwidth", "hilbert_index", "rcm_ordering",
+           "hilbert_ordering", "reorder_arrays", "reorder_mesh"]
+
+
+# Adds all vertices and cells through the MeshEditor in compiled code,
+# which avoids a Python call per vertex and cell.
+fill_mesh_code = """
+#include <dolfin/mesh/Mesh.h>
+#include <dolfin/mesh/MeshEditor.h>
+
+namespace dolfin
+{
+  void fill_mesh(Mesh& mesh, const Array<double>& nodes,
+                 const Array<std::size_t>& elements,
+                 std::size_t tdim, std::size_t gdim)
+  {
+    const std::size_t num_vertices = nodes.size()/gdim;
+    const std::size_t num_cell_vertices = tdim + 1;
+    const std::size_t num_cells = elements.size()/num_cell_vertices;
+
+    MeshEditor editor;
+    editor.open(mesh, tdim, gdim);
+    editor.init_vertices(num_vertices);
+    editor.init_cells(num_cells);
+    std::vector<double> x(gdim);
+    for (std::size_t i = 0; i < num_vertices; ++i)
+    {
+      for (std::size_t j = 0; j < gdim; ++j)
+        x[j] = nodes[i*gdim + j];
+      editor.add_vertex(i, x);
+    }
+    std::vector<std::size_t> v(num_cell_vertices);
+    for (std::size_t i = 0; i < num_cells; ++i)
+    {
+      for (std::size_t j = 0; j < num_cell_vertices; ++j)
+        v[j] = elements[i*num_cell_vertices + j];
+      editor.add_cell(i, v);
+    }
+    editor.close();
+  }
+}
+"""
+
+# Cache of the compiled module, which is False if it could not be compiled.
+fill_mesh_module = dict()
+
+
+def fill_mesh_compiled(mpi_comm):
+    """ Returns the compiled fill_mesh, or None if it is not available. """
+    if "module" not in fill_mesh_module:
+        try:
+            fill_mesh_module["module"] = df.compile_extension_module(
+                fill_mesh_code, mpi_comm=mpi_comm)
+        except RuntimeError:
+            info_warning("Could not compile fill_mesh. "
+                         "Adding the vertices and cells one by one.")
+            fill_mesh_module["module"] = False
+    module = fill_mesh_module["module"]
+    return module.fill_mesh if module else None
+
+
+def fill_mesh(mesh, nodes, elements):
+    """ Add the nodes and elements to the empty mesh. """
+    nodes = np.asarray(nodes, dtype=float)
+    elements = np.asarray(elements, dtype=np.uintp)
+    fill_mesh_bulk = fill_mesh_compiled(mesh.mpi_comm())
+    if fill_mesh_bulk is None:
+        fill_mesh_editor(mesh, nodes, elements)
+        return
+    fill_mesh_bulk(mesh, np.ascontiguousarray(nodes).ravel(),
+                   np.ascontiguousarray(elements).ravel(),
+                   elements.shape[1]-1, nodes.shape[1])
+
+
+def fill_mesh_editor(mesh, nodes, elements):
+    """ Add the nodes and elements to the empty mesh one by one through
+    the Python interface of the MeshEditor. """
+    nodes = np.asarray(nodes, dtype=float)
+    elements = np.asarray(elements, dtype=np.uintp)
+    tdim, gdim = elements.shape[1]-1, nodes.shape[1]
+    editor = df.MeshEditor()
+    editor.open(mesh, tdim, gdim)
+    editor.init_vertices(len(nodes))
+    editor.init_cells(len(elements))
+    for i, node in enumerate(nodes):
+        editor.add_vertex(i, node)
+    for i, element in enumerate(elements):
+        editor.add_cell(i, element)
+    editor.close()
+
+
+def bandwidth(elements):
+    """ Bandwidth of the vertex adjacency of the elements, i.e. of a
+    matrix assembled with linear elements. """
+    elements = np.asarray(elements, dtype=np.int64)
+    if len(elements) == 0:
+        return 0
+    return int(np.max(elements.max(axis=1) - elements.min(axis=1)))
+
+
+def hilbert_index(x, order=16):
+    """ Index of the points x along a Hilbert curve through their bounding
+    box, at 2**order by 2**order resolution. """
+    x = np.asarray(x, dtype=float)[:, :2]
+    n = 2**order
+    x_min = x.min(axis=0)
+    span = max(np.max(x.max(axis=0) - x_min), np.finfo(float).tiny)
+    ij = np.minimum(((x - x_min)/span*n).astype(np.int64), n-1)
+    i = ij[:, 0].copy()
+    j = ij[:, 1].copy()
+    index = np.zeros(len(x), dtype=np.int64)
+    s = n//2
+    while s > 0:
+        ri = (i & s) > 0
+        rj = (j & s) > 0
+        index += s*s*((3*ri) ^ rj)
+        # Rotate the quadrant
+        flip = np.logical_and(ri, np.logical_not(rj))
+        i[flip] = n-1 - i[flip]
+        j[flip] = n-1 - j[flip]
+        swap = np.logical_not(rj)
+        i[swap], j[swap] = j[swap], i[swap]
+        s //= 2
+    return index
+
+
+def hilbert_ordering(nodes, elements):
+    """ Order the vertices along a Hilbert curve. """
+    if nodes.shape[1] != 2:
+        raise ValueError("The Hilbert ordering is only implemented in 2D.")
+    return np.argsort(hilbert_index(nodes), kind="mergesort")
+
+
+def vertex_graph(elements, num_vertices):
+    """ Neighbors of each vertex through the elements, in compressed
+    rows, i.e. the neighbors of vertex i are
+    neighbors[offsets[i]:offsets[i+1]]. """
+    k = elements.shape[1]
+    rows = np.repeat(elements, k, axis=1).ravel()
+    cols = np.tile(elements, (1, k)).ravel()
+    keys = np.unique(rows[rows != cols]*num_vertices + cols[rows != cols])
+    rows, neighbors = keys // num_vertices, keys % num_vertices
+    offsets = np.zeros(num_vertices+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(rows, minlength=num_vertices))
+    return offsets, neighbors
+
+
+def rcm_ordering(nodes, elements):
+    """ Reverse Cuthill-McKee ordering of the vertices. """
+    elements = np.asarray(elements, dtype=np.int64)
+    num_vertices = len(nodes)
+    offsets, neighbors = vertex_graph(elements, num_vertices)
+    try:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+        graph = csr_matrix((np.ones(len(neighbors), dtype=np.int8),
+                            neighbors, offsets),
+                           shape=(num_vertices, num_vertices))
+        return np.asarray(reverse_cuthill_mckee(graph, symmetric_mode=True),
+                          dtype=np.int64)
+    except ImportError:
+        pass
+
+    # Breadth-first search from a vertex of lowest degree in each
+    # connected component, visiting the neighbors by increasing degree.
+    degree = np.diff(offsets)
+    visited = np.zeros(num_vertices, dtype=bool)
+    order = []
+    for start in np.argsort(degree, kind="mergesort"):
+        if visited[start]:
+            continue
+        visited[start] = True
+        queue = [start]
+        k = 0
+        while k < len(queue):
+            v = queue[k]
+            k += 1
+            nbs = neighbors[offsets[v]:offsets[v+1]]
+            nbs = nbs[np.logical_not(visited[nbs])]
+            nbs = nbs[np.argsort(degree[nbs], kind="mergesort")]
+            visited[nbs] = True
+            queue.extend(nbs)
+        order.extend(queue)
+    return np.array(order[::-1], dtype=np.int64)
+
+
+orderings = dict(rcm=rcm_ordering, hilbert=hilbert_ordering)
+
+
+def reorder_arrays(nodes, elements, method="rcm"):
+    """ Renumber the vertices by the given method, and sort the cells by
+    their lowest vertex numbers. Returns the reordered nodes and
+    elements. """
+    if method not in orderings:
+        raise ValueError("Unknown mesh ordering: {}. Use one of {}.".format(
+            method, ", ".join(sorted(orderings.keys()))))
+    nodes = np.asarray(nodes, dtype=float)
+    elements = np.asarray(elements, dtype=np.int64)
+    order = orderings[method](nodes, elements)
+    new_index = np.empty(len(order), dtype=np.int64)
+    new_index[order] = np.arange(len(order))
+    elements = new_index[elements]
+    elements.sort(axis=1)
+    elements = elements[np.lexsort(elements.T[::-1])]
+    return nodes[order], elements
+
+
+def reorder_mesh(mesh, method="rcm"):
+    """ Returns a copy of the mesh with reordered vertices and cells, see
+    reorder_arrays. Only meshes that are not distributed can be
+    reordered; other meshes are returned as they are. """
+    if df.MPI.size(mesh.mpi_comm()) > 1:
+        info_warning("Distributed meshes are not reordered. Reorder the "
+                     "mesh in a serial run, and store it.")
+        return mesh
+    elements = mesh.cells()
+    bandwidth_before = bandwidth(elements)
+    nodes, elements = reorder_arrays(mesh.coordinates(), elements, method)
+    mesh_new = df.Mesh(mesh.mpi_comm())
+    fill_mesh(mesh_new, nodes, elements)
+    info("Reordered mesh ({}): bandwidth {} -> {}".format(
+        method, bandwidth_before, bandwidth(mesh_new.cells())))
+    return mesh_new
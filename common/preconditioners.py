@@ -0,0 +1,121 @@
+"""
+This module contains block preconditioned Krylov solvers for the coupled
+subproblems, set up through the PETSc options database.
+"""
+import dolfin as df
+import numpy as np
+
+__author__ = "Gaute Linga"
+
+
+NS_preconditioners = ["default", "fieldsplit_mass", "fieldsplit_lsc"]
+EC_preconditioners = ["default", "fieldsplit_amg", "fieldsplit_ilu"]
+
+
+def set_petsc_options(prefix, options):
+    """ Set PETSc options for the solver with the given prefix. """
+    for key, value in options.iteritems():
+        df.PETScOptions.set(prefix + key, value)
+
+
+def owned_dofs(space):
+    """ Returns the global indices of the dofs owned by this process. """
+    return np.array(space.dofmap().dofs(), dtype=np.intc)
+
+
+def fieldsplit_NS_solver(W, NS_preconditioner,
+                         prefix="NS_", rtol=1e-8, max_it=500):
+    """ Returns a GMRES solver for the mixed velocity/pressure system,
+    preconditioned with a Schur complement fieldsplit.
+
+    The velocity block is approximated by algebraic multigrid.
+    The Schur complement is approximated either by the pressure block of
+    the preconditioning matrix, i.e. a viscosity-scaled pressure mass
+    matrix ("fieldsplit_mass", see ns_schur_mass_form), or by the least
+    squares commutator ("fieldsplit_lsc"), which is assembled by PETSc
+    from the off-diagonal blocks and needs no extra operators.
+    """
+    assert(NS_preconditioner in NS_preconditioners[1:])
+    u_dofs = owned_dofs(W.sub(0))
+    p_dofs = np.setdiff1d(owned_dofs(W), u_dofs)
+
+    solver = df.PETScKrylovSolver("gmres")
+    solver.set_options_prefix(prefix)
+    df.PETScPreconditioner.set_fieldsplit(
+        solver, [u_dofs.tolist(), p_dofs.tolist()], ["u", "p"])
+
+    options = {"ksp_type": "gmres",
+               "ksp_gmres_restart": 100,
+               "ksp_rtol": rtol,
+               "ksp_max_it": max_it,
+               "pc_type": "fieldsplit",
+               "pc_fieldsplit_type": "schur",
+               "pc_fieldsplit_schur_fact_type": "upper",
+               "fieldsplit_u_ksp_type": "preonly",
+               "fieldsplit_u_pc_type": "hypre",
+               "fieldsplit_u_pc_hypre_type": "boomeramg"}
+    if NS_preconditioner == "fieldsplit_mass":
+        options.update({"pc_fieldsplit_schur_precondition": "a11",
+                        "fieldsplit_p_ksp_type": "preonly",
+                        "fieldsplit_p_pc_type": "jacobi"})
+    elif NS_preconditioner == "fieldsplit_lsc":
+        options.update({"pc_fieldsplit_schur_precondition": "self",
+                        "fieldsplit_p_ksp_type": "preonly",
+                        "fieldsplit_p_pc_type": "lsc",
+                        "fieldsplit_p_lsc_pc_type": "hypre"})
+    set_petsc_options(prefix, options)
+    solver.set_from_options()
+    return solver
+
+
+def ns_schur_mass_form(p, q, mu_, dx):
+    """ Pressure block of the preconditioning matrix, approximating the
+    Schur complement -B A^{-1} B^T of the NS system by the pressure mass
+    matrix scaled with the inverse viscosity. """
+    return -1./mu_*p*q*dx
+
+
+def fieldsplit_EC_solver(W, solutes, EC_preconditioner,
+                         prefix="EC_", rtol=1e-8, max_it=500):
+    """ Returns a GMRES solver for the mixed concentration/potential system,
+    preconditioned by a block Gauss-Seidel fieldsplit.
+
+    The potential block (including a possible Lagrange multiplier) comes
+    first and is approximated by algebraic multigrid. Each concentration
+    block is then approximated by algebraic multigrid ("fieldsplit_amg")
+    or incomplete LU ("fieldsplit_ilu"). Since every block is a
+    diffusion-type operator, the iteration count stays bounded under mesh
+    refinement and as more species are added.
+    """
+    assert(EC_preconditioner in EC_preconditioners[1:])
+    c_dofs = [owned_dofs(W.sub(i)) for i in xrange(len(solutes))]
+    V_dofs = np.setdiff1d(owned_dofs(W), np.concatenate(c_dofs))
+    c_names = [solute[0] for solute in solutes]
+
+    solver = df.PETScKrylovSolver("gmres")
+    solver.set_options_prefix(prefix)
+    df.PETScPreconditioner.set_fieldsplit(
+        solver, [V_dofs.tolist()] + [ci_dofs.tolist() for ci_dofs in c_dofs],
+        ["V"] + c_names)
+
+    options = {"ksp_type": "gmres",
+               "ksp_gmres_restart": 100,
+               "ksp_rtol": rtol,
+               "ksp_max_it": max_it,
+               "pc_type": "fieldsplit",
+               "pc_fieldsplit_type": "multiplicative",
+               "fieldsplit_V_ksp_type": "preonly",
+               "fieldsplit_V_pc_type": "hypre",
+               "fieldsplit_V_pc_hypre_type": "boomeramg"}
+    for name in c_names:
+        options["fieldsplit_{}_ksp_type".format(name)] = "preonly"
+        if EC_preconditioner == "fieldsplit_amg":
+            options["fieldsplit_{}_pc_type".format(name)] = "hypre"
+            options["fieldsplit_{}_pc_hypre_type".format(name)] = "boomeramg"
+        elif EC_preconditioner == "fieldsplit_ilu":
+            # ILU is only available on the local blocks in parallel
+            options["fieldsplit_{}_pc_type".format(name)] = "bjacobi"
+            options["fieldsplit_{}_sub_pc_type".format(name)] = "ilu"
+    set_petsc_options(prefix, options)
+    solver.set_from_options()
+    return solver
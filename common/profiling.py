@@ -0,0 +1,152 @@
+"""
+This module contains the profiler, which records the time spent in each
+phase of a timestep, e.g. assembly, boundary conditions, solver setup
+and linear solves of each subproblem, together with iteration counts
+and residual histories. The records are written to
+Statistics/timings.jsonl, with one JSON object per timestep.
+"""
+import time
+import numpy as np
+import dolfin as df
+import simplejson as json
+from io import mpi_is_root
+
+__author__ = "Gaute Linga"
+
+__all__ = ["profiler", "Timer", "load_timings", "summarize_timings"]
+
+
+class Profiler:
+    """ Records the phases of the current timestep.
+
+    A phase is named by its path in the stack of running timers, e.g.
+    "solve/PF/assemble" for the matrix assembly of the PF subproblem.
+    The time of a phase is accumulated if it runs several times in the
+    step, e.g. in inner iterations or retried steps. Values given to
+    record(), e.g. the residual of each Newton iteration, are collected
+    in lists under the path of the running phase.
+
+    Only the root process writes, i.e. the times are those of rank 0.
+    """
+    def __init__(self):
+        self.stack = []
+        self.times = dict()
+        self.calls = dict()
+        self.values = dict()
+        self.filename = None
+
+    def open(self, filename):
+        """ Append the records of each timestep to filename. """
+        self.filename = filename
+        self.clear()
+
+    def close(self):
+        self.filename = None
+
+    def clear(self):
+        """ Forget the records of the current step. """
+        self.stack = []
+        self.times = dict()
+        self.calls = dict()
+        self.values = dict()
+
+    def push(self, name):
+        self.stack.append(name)
+        return "/".join(self.stack)
+
+    def unwind(self, depth):
+        """ Drop the phases above the given depth, e.g. those left running
+        by an exception. """
+        del self.stack[depth:]
+
+    def pop(self, key, elapsed):
+        if self.stack:
+            self.stack.pop()
+        self.times[key] = self.times.get(key, 0.) + elapsed
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def record(self, name, value):
+        """ Append value to the history of name in the running phase. """
+        key = "/".join(self.stack + [name])
+        self.values.setdefault(key, []).append(value)
+
+    def end_step(self, tstep, t, dt):
+        """ Write the records of the finished timestep, and start the
+        next one. """
+        if self.filename is not None and mpi_is_root():
+            with file(self.filename, "a") as timingsfile:
+                timingsfile.write(json.dumps(dict(
+                    tstep=tstep, t=float(t), dt=float(dt),
+                    times=self.times, calls=self.calls,
+                    values=self.values)) + "\n")
+        self.clear()
+
+
+profiler = Profiler()
+
+
+class Timer:
+    """ Timer of a phase, which is recorded by the profiler, and also in
+    the dolfin timings under the given label, or else the phase path.
+    Can be used as a context manager. """
+    def __init__(self, name, label=None):
+        self.key = profiler.push(name)
+        self.timer = df.Timer(label if label is not None else self.key)
+        self.t_start = time.time()
+        self.running = True
+
+    def stop(self):
+        """ Stop the timer. Returns the elapsed time. """
+        if not self.running:
+            return 0.
+        self.running = False
+        elapsed = time.time() - self.t_start
+        self.timer.stop()
+        profiler.pop(self.key, elapsed)
+        return elapsed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def load_timings(filename):
+    """ Load the records of a timings.jsonl file. """
+    records = []
+    with open(filename, "r") as timingsfile:
+        for line in timingsfile:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def summarize_timings(records):
+    """ Returns a dict with, for each phase, the total and mean time per
+    step, and the number of calls per step. For the recorded values, the
+    mean number of values per step, e.g. iterations, and the mean of the
+    last value of each step, e.g. the final residual, are given. """
+    num_steps = max(len(records), 1)
+    phases = dict()
+    for record in records:
+        for key, elapsed in record["times"].iteritems():
+            phase = phases.setdefault(key, dict(total=0., calls=0))
+            phase["total"] += elapsed
+            phase["calls"] += record["calls"].get(key, 0)
+    for phase in phases.values():
+        phase["mean"] = phase["total"]/num_steps
+        phase["calls"] = float(phase["calls"])/num_steps
+
+    values = dict()
+    for record in records:
+        for key, history in record["values"].iteritems():
+            value = values.setdefault(key, dict(count=0, last=[]))
+            value["count"] += len(history)
+            if history:
+                value["last"].append(history[-1])
+    for value in values.values():
+        value["count"] = float(value["count"])/num_steps
+        value["last"] = (float(np.mean(value["last"]))
+                         if value["last"] else float("nan"))
+    return dict(num_steps=len(records), phases=phases, values=values)
@@ -0,0 +1,61 @@
+"""
+This module contains tools for calling the solver and problem functions
+in the time loop without expanding the whole namespace at every call.
+"""
+import inspect
+import opcode
+
+__author__ = "Gaute Linga"
+
+
+def uses_variable(func, name):
+    """ Check if a function reads the local variable with the given name. """
+    code = func.__code__
+    if name in code.co_cellvars:
+        return True
+    index = code.co_varnames.index(name)
+    co_code = code.co_code
+    i = 0
+    while i < len(co_code):
+        op = ord(co_code[i])
+        if op >= opcode.HAVE_ARGUMENT:
+            arg = ord(co_code[i+1]) + 256*ord(co_code[i+2])
+            if op == opcode.opmap["LOAD_FAST"] and arg == index:
+                return True
+            i += 3
+        else:
+            i += 1
+    return False
+
+
+class BoundCall:
+    """ A function bound to a namespace dict.
+
+    The names of the arguments are resolved once, and at each call only
+    those are looked up in the namespace, instead of expanding the whole
+    namespace as in func(**vars()). Since the namespace is looked up at
+    call time, the function always sees the current values.
+
+    Functions that actually use their **namespace argument, e.g. to pass
+    it on, are still called with the whole namespace.
+    """
+    def __init__(self, func, namespace):
+        self.func = func
+        self.namespace = namespace
+        args, varargs, keywords, defaults = inspect.getargspec(func)
+        self.argnames = args
+        self.pass_all = bool(keywords is not None and
+                             uses_variable(func, keywords))
+
+    def __call__(self):
+        if self.pass_all:
+            return self.func(**self.namespace)
+        namespace = self.namespace
+        return self.func(**dict((name, namespace[name])
+                                for name in self.argnames
+                                if name in namespace))
+
+
+def bind(func, namespace):
+    """ Bind function to namespace, see BoundCall. """
+    return BoundCall(func, namespace)
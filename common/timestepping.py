@@ -0,0 +1,177 @@
+"""
+This module contains the adaptive timestep controller used in the main
+time loop.
+"""
+import math
+import numpy as np
+from dolfin import MPI, mpi_comm_world
+from cmd import info_yellow
+from profiling import profiler
+
+__author__ = "Gaute Linga"
+
+
+def reset_solvers(solvers):
+    """ Reset the cached solvers in a (nested) dict of solvers. """
+    for solver in solvers.values():
+        if isinstance(solver, dict):
+            reset_solvers(solver)
+        elif hasattr(solver, "reset"):
+            solver.reset()
+
+
+class AdaptiveTimestep:
+    """ Adaptive timestep controller.
+
+    The next timestep is the smallest of:
+    * the CFL limit based on the velocity u,
+    * the limit from the speed of the interface, estimated from the change
+      in phi over the last step,
+    * the limit from an embedded error estimate, i.e. the difference
+      between the solution and its linear extrapolation from the two
+      previous steps, which is the local error of the first order scheme.
+
+    If a solver diverges, gives non-finite values, or the error estimate
+    exceeds the tolerance, the step is retried with a smaller timestep.
+
+    The timestep is kept in the df.Constant dt_const, which the solvers
+    use in their forms. Solvers with cached matrices are reset when it
+    changes.
+    """
+    def __init__(self, dt_const, dt, dt_min, dt_max, cfl, dt_tol,
+                 dt_max_retries, mesh, interface_thickness,
+                 field_to_subproblem, field_to_subspace):
+        self.dt_const = dt_const
+        self.dt = dt
+        self.dt_min = dt_min
+        self.dt_max = dt_max if dt_max is not None else float("inf")
+        self.cfl = cfl
+        self.tol = dt_tol
+        self.max_retries = dt_max_retries
+        self.eps = interface_thickness
+        self.field_to_subproblem = field_to_subproblem
+        self.update_mesh(mesh, field_to_subspace)
+        self.safety = 0.9
+        self.max_growth = 2.0
+        self.comm = mpi_comm_world()
+
+    def update_mesh(self, mesh, field_to_subspace):
+        """ (Re)compute mesh dependent quantities, e.g. after the mesh has
+        been adapted. The error estimate is restarted. """
+        self.h_min = mesh.hmin()
+        self.field_dofs = dict()
+        for field in ["u", "phi"]:
+            if field in self.field_to_subproblem:
+                self.field_dofs[field] = np.array(
+                    field_to_subspace[field].dofmap().dofs())
+        self.dt_1 = None
+        self.w_2 = None
+
+    def set_dt(self, dt, solvers):
+        """ Update the timestep constant and reset cached solvers. """
+        if float(self.dt_const) != dt:
+            self.dt_const.assign(dt)
+            reset_solvers(solvers)
+
+    def field_values(self, w, field):
+        """ Local values of a field from the work functions. """
+        name, i = self.field_to_subproblem[field]
+        vec = w[name].vector()
+        if i < 0:
+            return vec.get_local()
+        return vec.get_local()[self.field_dofs[field] - vec.local_range()[0]]
+
+    def max_abs(self, array):
+        local_max = np.max(np.abs(array)) if array.size > 0 else 0.
+        return MPI.max(self.comm, float(local_max))
+
+    def is_finite(self, w_):
+        local_finite = all([np.all(np.isfinite(w_[name].vector().get_local()))
+                            for name in w_])
+        return MPI.min(self.comm, int(local_finite)) == 1
+
+    def error_estimate(self, w_, w_1, dt):
+        """ Relative difference between the solution and the linear
+        extrapolation from the two previous steps. """
+        if self.w_2 is None:
+            return 0.
+        err = 0.
+        for name in w_:
+            x = w_[name].vector().get_local()
+            x_1 = w_1[name].vector().get_local()
+            x_pred = x_1 + dt/self.dt_1*(x_1 - self.w_2[name])
+            scale = max(self.max_abs(x), 1e-12)
+            err = max(err, self.max_abs(x - x_pred)/scale)
+        return err
+
+    def stability_limit(self, w_, w_1, dt):
+        """ Timestep limit from the CFL condition and the interface speed. """
+        dt_lim = float("inf")
+        if "u" in self.field_dofs:
+            u_max = self.max_abs(self.field_values(w_, "u"))
+            if u_max > 0.:
+                dt_lim = min(dt_lim, self.cfl*self.h_min/u_max)
+        if "phi" in self.field_dofs and self.eps > 0.:
+            dphi_max = self.max_abs(self.field_values(w_, "phi")
+                                    - self.field_values(w_1, "phi"))
+            # A displacement of the tanh profile by dx changes phi by
+            # at most dx/(sqrt(2)*eps).
+            v_interface = math.sqrt(2)*self.eps*dphi_max/dt
+            if v_interface > 0.:
+                dt_lim = min(dt_lim, self.cfl*self.h_min/v_interface)
+        return dt_lim
+
+    def restore(self, w_, w_1):
+        for name in w_:
+            w_[name].assign(w_1[name])
+
+    def solve(self, solve, namespace):
+        """ Attempt a timestep, retrying with smaller timesteps if needed.
+        solve is the solver's solve function bound to the namespace
+        (see common.timeloop). Returns the timestep that was used. """
+        w_ = namespace["w_"]
+        w_1 = namespace["w_1"]
+        solvers = namespace["solvers"]
+        t = namespace["t"]
+        T = namespace["T"]
+
+        dt = min(self.dt, T-t) if T > t else self.dt
+        depth = len(profiler.stack)
+        for attempt in xrange(self.max_retries+1):
+            self.set_dt(dt, solvers)
+            namespace["dt"] = dt
+            try:
+                solve()
+                success = self.is_finite(w_)
+            except RuntimeError:
+                profiler.unwind(depth)
+                success = False
+
+            err = self.error_estimate(w_, w_1, dt) if success else None
+            if success and (err <= self.tol or dt <= self.dt_min):
+                break
+
+            if attempt == self.max_retries or dt <= self.dt_min:
+                raise RuntimeError(
+                    "Timestep failed with dt = {}.".format(dt))
+            profiler.record("rejected_dt", dt)
+            self.restore(w_, w_1)
+            if success:
+                dt_new = dt*max(self.safety*math.sqrt(self.tol/err), 0.2)
+            else:
+                dt_new = 0.5*dt
+            info_yellow("Rejecting step with dt = {}, retrying with "
+                        "dt = {}.".format(dt, max(dt_new, self.dt_min)))
+            dt = max(dt_new, self.dt_min)
+
+        # Propose timestep for next step
+        dt_next = self.max_growth*dt
+        if err > 0.:
+            dt_next = min(dt_next, dt*self.safety*math.sqrt(self.tol/err))
+        dt_next = min(dt_next, self.stability_limit(w_, w_1, dt))
+        self.dt = min(max(dt_next, self.dt_min), self.dt_max)
+
+        self.w_2 = dict((name, w_1[name].vector().get_local())
+                        for name in w_1)
+        self.dt_1 = dt
+        return dt
@@ -1,5 +1,6 @@
 from utilities.TimeSeries import TimeSeries
 import dolfin as df
+import ufl
 from common import info, parse_command_line, \
     info_cyan, info_split, info_on_red, info_red, info_yellow
 import os
@@ -84,6 +85,67 @@ def get_steps(ts, dt=None, time=None):
     return steps
 
 
+class FunctionalSet:
+    """ A set of scalar functionals, compiled once into a single linear
+    form on a Real vector space, such that all of them are evaluated in
+    one assembly pass. The functionals must live on the same mesh, which
+    must be local to the process (see map_steps), and their integrals
+    of a given type must share subdomain data.
+    """
+    def __init__(self, mesh, functionals):
+        num_functionals = len(functionals)
+        if num_functionals == 1:
+            R = df.FunctionSpace(mesh, "R", 0)
+            v = [df.TestFunction(R)]
+            self.dofs = [R.dofmap().cell_dofs(0)[0]]
+        else:
+            R = df.VectorFunctionSpace(mesh, "R", 0, dim=num_functionals)
+            v = df.TestFunction(R)
+            self.dofs = [R.sub(i).dofmap().cell_dofs(0)[0]
+                         for i in range(num_functionals)]
+
+        integrals = []
+        for i, functional in enumerate(functionals):
+            for integral in functional.integrals():
+                integrals.append(integral.reconstruct(
+                    integrand=integral.integrand()*v[i]))
+        self.form = df.Form(ufl.Form(integrals))
+        self.b = None
+
+    def assemble(self):
+        """ Returns the values of all functionals. """
+        self.b = df.assemble(self.form, tensor=self.b)
+        return self.b.get_local()[self.dofs]
+
+
+def _run_steps(ts, steps, ids, kernel, init):
+    """ Apply kernel to steps[i] for each i in ids. """
+    context = init(ts) if init is not None else dict()
+    return [(i, kernel(ts, steps[i], **context)) for i in ids]
+
+
+def map_steps(ts, steps, kernel, init=None):
+    """ Apply the per-step kernel to the given steps in parallel, and
+    return the results in the order of steps, on all ranks.
+
+    The kernel is called as kernel(ts, step, **context), where context
+    is the dict returned by init(ts), which is called once per worker,
+    e.g. to set up functions and forms. In MPI runs, the steps are
+    distributed over the ranks, each working on its own serial copy of
+    the mesh. The results must be picklable.
+    """
+    steps = list(steps)
+    if size > 1:
+        ts_loc = ts.serial_copy()
+        results = _run_steps(ts_loc, steps, range(rank, len(steps), size),
+                             kernel, init)
+        results = sum(comm.allgather(results), [])
+    else:
+        results = _run_steps(ts, steps, range(len(steps)), kernel, init)
+    results = dict(results)
+    return [results[i] for i in range(len(steps))]
+
+
 def get_step_and_info(ts, time, step=0):
     if time is not None:
         step, time = ts.get_nearest_step_and_time(time)
@@ -0,0 +1,129 @@
+"""
+BERNAISE: Form precompilation tool.
+
+Sets up the given problem and solver in the same way as sauce.py, and
+compiles all forms the solver uses, without running any timesteps.
+This populates the JIT cache, such that subsequent runs with the same
+problem, solver and parameters start without compiling.
+
+Usage:
+   python precompile.py problem=[...] solver=[...] ...
+"""
+import os
+import time
+import ufl
+import dolfin as df
+import dolfin.fem.form
+from common import *
+from common.discretization import discretize
+
+__author__ = "Gaute Linga"
+
+
+def jit_cache_dir():
+    """ Returns the folder of the JIT cache. """
+    try:
+        from dijitso.params import validate_params
+        cache_dir = validate_params(None)["cache"]["cache_dir"]
+        if cache_dir:
+            return cache_dir
+    except (ImportError, KeyError, TypeError):
+        pass
+    return os.environ.get("DIJITSO_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"),
+                                       ".cache", "dijitso"))
+
+
+def count_files(folder):
+    """ Number of files in folder, including subfolders. """
+    return sum([len(files) for _, _, files in os.walk(folder)])
+
+
+class JITRecorder:
+    """ Wraps the JIT compiler to record, for each compiled form, whether it
+    was found in the cache or had to be compiled. """
+    def __init__(self, jit):
+        self.jit = jit
+        self.cache_dir = jit_cache_dir()
+        self.context = "setup"
+        self.records = []
+
+    def __call__(self, form, *args, **kwargs):
+        num_files = count_files(self.cache_dir)
+        t_start = time.time()
+        result = self.jit(form, *args, **kwargs)
+        elapsed = time.time() - t_start
+        compiled = count_files(self.cache_dir) > num_files
+        if isinstance(form, ufl.Form):
+            name = "{} form {}".format(
+                ["functional", "linear", "bilinear"][
+                    min(len(form.arguments()), 2)],
+                form.signature()[:10])
+        else:
+            name = type(form).__name__
+        self.records.append((self.context, name, compiled, elapsed))
+        return result
+
+
+def solver_forms(solver):
+    """ Returns the forms a solver assembles during the solve. Forms of
+    the variational solvers are already compiled when they are set up. """
+    if hasattr(solver, "forms"):
+        return solver.forms()
+    elif isinstance(solver, dict):
+        return sum([solver_forms(solver_i)
+                    for solver_i in solver.values()], [])
+    elif isinstance(solver, tuple):
+        return [form for form in solver if isinstance(form, ufl.Form)]
+    return []
+
+
+cmd_kwargs = parse_command_line()
+
+if cmd_kwargs.get("help", False):
+    help_menu()
+    exit()
+
+# Import problem and default parameters
+default_problem = "simple"
+exec("from problems.{} import *".format(
+    cmd_kwargs.get("problem", default_problem)))
+
+# Problem specific parameters
+parameters.update(problem())
+
+# Internalize cmd arguments and mesh
+vars().update(import_problem_hook(**vars()))
+
+# Import solver functionality
+exec("from solvers.{} import *".format(solver))
+
+jit_recorder = JITRecorder(dolfin.fem.form.jit)
+dolfin.fem.form.jit = jit_recorder
+
+info_cyan("Setting up problem.")
+subproblems = get_subproblems(**vars())
+vars().update(discretize(**vars()))
+q_rhs = rhs_source(t=t_0, **vars())
+vars().update(setup(**dict(vars(), dt=df.Constant(dt))))
+
+for name, solver_obj in solvers.iteritems():
+    jit_recorder.context = name
+    for form in solver_forms(solver_obj):
+        df.Form(form)
+
+dolfin.fem.form.jit = jit_recorder.jit
+
+info_cyan("\nForms:")
+for context, name, compiled, elapsed in jit_recorder.records:
+    info_split("   {:8s} {:34s}".format(context, name),
+               "{:10s} {:8.3f} s".format(
+                   "compiled" if compiled else "cached", elapsed))
+
+num_compiled = sum([record[2] for record in jit_recorder.records])
+info_split("\nJIT cache:", jit_recorder.cache_dir)
+info_split("Compiled:", "{} forms".format(num_compiled))
+info_split("Cached:", "{} forms".format(
+    len(jit_recorder.records) - num_compiled))
+info_split("Total time:", "{:.3f} s".format(
+    sum([record[3] for record in jit_recorder.records])))
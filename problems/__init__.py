@@ -34,7 +34,29 @@ parameters = dict(
     info_intv=10,
     use_iterative_solvers=False,
     use_pressure_stabilization=False,
+    use_cached_assembly=False,
+    reuse_factorization=False,  # keep direct solver factorizations
+    NS_preconditioner="default",  # or "fieldsplit_mass", "fieldsplit_lsc"
+    EC_preconditioner="default",  # or "fieldsplit_amg", "fieldsplit_ilu"
+    jacobian_max_lag=0,  # Newton iterations a Jacobian may be reused for
+    jacobian_lag_ratio=0.5,
+    ipcs_max_iter=1,  # inner iterations of the basic_IPCS solver
+    ipcs_tol=1e-6,
+    adaptive_dt=False,
+    dt_min=0.,
+    dt_max=None,
+    cfl=0.5,
+    dt_tol=1e-2,
+    dt_max_retries=5,
+    adaptive_mesh=False,
+    amr_intv=10,
+    amr_levels=3,
+    amr_phi_threshold=0.05,
+    amr_charge_threshold=0.1,
+    xdmf_flush=True,
+    checkpoint_generations=1,
     dump_subdomains=False,
+    dump_timings=True,  # phase timings per step to Statistics/timings.jsonl
     V_lagrange=False,
     p_lagrange=False,
     base_elements=base_elements,
@@ -2,7 +2,7 @@ import dolfin as df
 import os
 from . import *
 from common.io import mpi_is_root, load_mesh
-from common.bcs import Fixed, Pressure, Charged
+from common.bcs import Fixed, Pressure, Charged, Plane, Disks
 import numpy as np
 __author__ = "Gaute Linga"
 
@@ -22,37 +22,24 @@ class PeriodicBoundary(df.SubDomain):
         y[1] = x[1] - self.Ly
 
 
-class Left(df.SubDomain):
+class Left(Plane):
     def __init__(self, Lx):
         self.Lx = Lx
-        df.SubDomain.__init__(self)
-
-    def inside(self, x, on_boundary):
-        return bool(df.near(x[0], -self.Lx/2) and on_boundary)
+        Plane.__init__(self, 0, -Lx/2)
 
 
-class Right(df.SubDomain):
+class Right(Plane):
     def __init__(self, Lx):
         self.Lx = Lx
-        df.SubDomain.__init__(self)
+        Plane.__init__(self, 0, Lx/2)
 
-    def inside(self, x, on_boundary):
-        return bool(df.near(x[0], self.Lx/2) and on_boundary)
 
-
-class Obstacles(df.SubDomain):
+class Obstacles(Disks):
     def __init__(self, Lx, centroids, rad, grid_spacing):
         self.Lx = Lx
-        self.centroids = centroids
         self.rad = rad
         self.grid_spacing = grid_spacing
-        df.SubDomain.__init__(self)
-
-    def inside(self, x, on_boundary):
-        dx = self.centroids - np.outer(np.ones(len(self.centroids)), x)
-        dist = np.sqrt(dx[:, 0]**2 + dx[:, 1]**2)
-        return bool(on_boundary
-                    and any(dist < self.rad + 0.1*self.grid_spacing))
+        Disks.__init__(self, centroids, rad, 0.1*grid_spacing)
 
 
 def problem():
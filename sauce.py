@@ -4,6 +4,11 @@ More specific info will follow in a later commit.
 """
 import dolfin as df
 from common import *
+from common.timestepping import AdaptiveTimestep
+from common.discretization import discretize, initialize_fields
+from common.adaptivity import adapt_mesh, transfer_functions
+from common.timeloop import bind
+from common.profiling import profiler, Timer
 
 __author__ = "Gaute Linga"
 
@@ -40,195 +45,66 @@ exec("from solvers.{} import *".format(solver))
 # Get subproblems
 subproblems = get_subproblems(**vars())
 
-# Declare finite elements
-elements = dict()
-for name, (family, degree, is_vector) in base_elements.iteritems():
-    if is_vector:
-        elements[name] = df.VectorElement(family, mesh.ufl_cell(), degree)
-    else:
-        elements[name] = df.FiniteElement(family, mesh.ufl_cell(), degree)
-
-# Declare function spaces
-spaces = dict()
-for name, subproblem in subproblems.iteritems():
-    if len(subproblem) > 1:
-        spaces[name] = df.FunctionSpace(
-            mesh, df.MixedElement(
-                [elements[s["element"]] for s in subproblem]),
-            constrained_domain=constrained_domain(**vars()))
-    # If there is only one field in the subproblem, don't bother with
-    # the MixedElement.
-    elif len(subproblem) == 1:
-        spaces[name] = df.FunctionSpace(
-            mesh, elements[subproblem[0]["element"]],
-            constrained_domain=constrained_domain(**vars()))
-    else:
-        info_on_red("Something went wrong here!")
-        exit("")
-
-# dim = mesh.geometry().dim()  # In case the velocity fields should be
-#                              # segregated at some point
-fields = []
-field_to_subspace = dict()
-field_to_subproblem = dict()
-for name, subproblem in subproblems.iteritems():
-    if len(subproblem) > 1:
-        for i, s in enumerate(subproblem):
-            field = s["name"]
-            fields.append(field)
-            field_to_subspace[field] = spaces[name].sub(i)
-            field_to_subproblem[field] = (name, i)
-    else:
-        field = subproblem[0]["name"]
-        fields.append(field)
-        field_to_subspace[field] = spaces[name]
-        field_to_subproblem[field] = (name, -1)
+# Base mesh, from which adapted meshes are refined
+mesh_0 = mesh
+if adaptive_mesh and restart_folder:
+    mesh_checkpoint = load_checkpoint_mesh(restart_folder)
+    if mesh_checkpoint is not None:
+        mesh = mesh_checkpoint
 
+# Declare function spaces, work functions, boundary conditions and measures
+vars().update(discretize(**vars()))
 
 # Create initial folders for storing results
 newfolder, tstepfiles = create_initial_folders(folder, restart_folder,
                                                fields, tstep, parameters)
 
-# Create overarching test and trial functions
-test_functions = dict()
-trial_functions = dict()
-for name, subproblem in subproblems.iteritems():
-    if len(subproblem) > 1:
-        test_functions[name] = df.TestFunctions(spaces[name])
-        trial_functions[name] = df.TrialFunctions(spaces[name])
-    else:
-        test_functions[name] = df.TestFunction(spaces[name])
-        trial_functions[name] = df.TrialFunction(spaces[name])
-
-# Create work dictionaries for all subproblems
-w_ = dict((subproblem, df.Function(space, name=subproblem))
-           for subproblem, space in spaces.iteritems())
-w_1 = dict((subproblem, df.Function(space, name=subproblem+"_1"))
-            for subproblem, space in spaces.iteritems())
-w_tmp = dict((subproblem, df.Function(space, name=subproblem+"_tmp"))
-             for subproblem, space in spaces.iteritems())
-
-# Shortcuts to the fields
-x_ = dict()
-for name, subproblem in subproblems.iteritems():
-    if len(subproblem) > 1:
-        w_loc = df.split(w_[name])
-        for i, field in enumerate(subproblem):
-            x_[field["name"]] = w_loc[i]
-    else:
-        x_[subproblem[0]["name"]] = w_[name]
-
 # If continuing from previously, restart from checkpoint
 load_checkpoint(restart_folder, w_, w_1)
 
-# Get boundary conditions, from fields to subproblems
-bcs_tuple = create_bcs(**vars())
-if len(bcs_tuple) == 3:
-    boundaries, bcs, bcs_pointwise = bcs_tuple
-elif len(bcs_tuple) == 2:
-    boundaries, bcs = bcs_tuple
-    bcs_pointwise = None
-else:
-    info_on_red("Wrong implementation of create_bcs.")
-    exit()
-
-# Set up subdomains
-subdomains = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1)
-subdomains.set_all(0)
-boundary_to_mark = dict()
-mark_to_boundary = dict()
-for i, (boundary_name, markers) in enumerate(boundaries.iteritems()):
-    for marker in markers:
-        marker.mark(subdomains, i+1)
-    boundary_to_mark[boundary_name] = i+1
-    mark_to_boundary[i] = boundary_name
-
-if dump_subdomains:
-    subdomains_xdmf = df.XDMFFile("subdomains_dump.xdmf")
-    subdomains_xdmf.write(subdomains)
-
-# Set up dirichlet part of bcs
-dirichlet_bcs = dict()
-for subproblem_name in subproblems.keys():
-    dirichlet_bcs[subproblem_name] = []
-
-# Neumann BCs (per field)
-neumann_bcs = dict()
-for field in fields:
-    neumann_bcs[field] = dict()
-
-for boundary_name, bcs_fields in bcs.iteritems():
-    for field, bc in bcs_fields.iteritems():
-        subproblem_name = field_to_subproblem[field][0]
-        subspace = field_to_subspace[field]
-        mark = boundary_to_mark[boundary_name]
-        if bc.is_dbc():
-            dirichlet_bcs[subproblem_name].append(
-                bc.dbc(subspace, subdomains, mark))
-        if bc.is_nbc():
-            neumann_bcs[field][boundary_name] = bc.nbc()
-
-# Pointwise dirichlet bcs
-for field, (value, c_code) in bcs_pointwise.iteritems():
-    subproblem_name = field_to_subproblem[field][0]
-    subspace = field_to_subspace[field]
-    if not isinstance(value, df.Expression):
-        value = df.Constant(value)
-    dirichlet_bcs[subproblem_name].append(
-        df.DirichletBC(subspace, value, c_code, "pointwise"))
-
-# Compute some mesh related stuff
-dx = df.dx
-ds = df.Measure("ds", domain=mesh, subdomain_data=subdomains)
-normal = df.FacetNormal(mesh)
-
 # Initialize solutions
-w_init_fields = initialize(**vars())
-if w_init_fields:
-    for name, subproblem in subproblems.iteritems():
-        w_init_vector = []
-        if len(subproblem) > 1:
-            for i, s in enumerate(subproblem):
-                field = s["name"]
-                # Only change initial state if it is given in w_init_fields.
-                if field in w_init_fields:
-                    w_init_field = w_init_fields[field]
-                else:
-                    # Otherwise take the default value of that field.
-                    w_init_field = w_[name].sub(i)
-                # Use df.project(df.as_vector(...)) with care...
-                num_subspaces = w_init_field.function_space().num_sub_spaces()
-                if num_subspaces == 0:
-                    w_init_vector.append(w_init_field)
-                else:
-                    for j in xrange(num_subspaces):
-                        w_init_vector.append(w_init_field.sub(j))
-            assert len(w_init_vector) == w_[name].value_size()
-            w_init = df.project(
-                df.as_vector(tuple(w_init_vector)), w_[name].function_space())
-        else:
-            field = subproblem[0]["name"]
-            if field in w_init_fields:
-                w_init_field = w_init_fields[field]
-            else:
-                # Take default value...
-                w_init_field = w_[name]
-            w_init = df.project(w_init_field, w_[name].function_space())
-        w_[name].interpolate(w_init)
-        w_1[name].interpolate(w_init)
+initialize_fields(**vars())
+
+# Refine the mesh around the initial state
+if adaptive_mesh and not restart_folder:
+    for level in xrange(amr_levels):
+        mesh = adapt_mesh(**vars())
+        vars().update(discretize(**vars()))
+        initialize_fields(**vars())
 
 # Get rhs source terms (if any)
 q_rhs = rhs_source(t=t_0, **vars())
 
-# Setup problem
-vars().update(setup(**vars()))
+# Setup problem. The solvers get the timestep as a mutable constant,
+# such that it can be changed during the simulation.
+dt_const = df.Constant(dt)
+vars().update(setup(**dict(vars(), dt=dt_const)))
+
+if adaptive_dt:
+    dt_controller = AdaptiveTimestep(dt_const, dt, dt_min, dt_max, cfl,
+                                     dt_tol, dt_max_retries, mesh,
+                                     interface_thickness,
+                                     field_to_subproblem, field_to_subspace)
 
 # Problem-specific hook before time loop
 vars().update(start_hook(**vars()))
 
+stats_index = StatisticsIndex(newfolder, fields, tstep)
+xdmf_writer = XDMFWriter(w_, subproblems, tstepfiles, stats_index)
+checkpoint_writer = CheckpointWriter(newfolder, checkpoint_generations)
+if dump_timings:
+    profiler.open(os.path.join(newfolder, "Statistics", "timings.jsonl"))
+
 stop = False
 t = t_0
 
+# Bind the functions called at every timestep to the namespace, such that
+# only the arguments they need are passed.
+tstep_hook_bound = bind(tstep_hook, vars())
+solve_bound = bind(solve, vars())
+update_bound = bind(update, vars())
+save_solution_bound = bind(save_solution, vars())
+
 # Initial state to XDMF
 stop = save_solution(**vars())
 
@@ -239,16 +115,44 @@ tstep_0 = tstep
 df.tic()
 while not stop:
 
-    tstep_hook(**vars())
+    timer = Timer("tstep_hook")
+    tstep_hook_bound()
+    timer.stop()
 
-    solve(**vars())
+    if adaptive_dt:
+        dt = dt_controller.solve(solve_bound, vars())
+        parameters["dt"] = dt
+    else:
+        solve_bound()
 
-    update(**vars())
+    timer = Timer("update")
+    update_bound()
+    timer.stop()
 
     t += dt
     tstep += 1
 
-    stop = save_solution(**vars())
+    timer = Timer("save", "Save solution")
+    stop = save_solution_bound()
+    timer.stop()
+
+    if adaptive_mesh and not stop and tstep % amr_intv == 0:
+        timer = Timer("adapt_mesh", "Adapt mesh")
+        w_old, w_1_old = w_, w_1
+        mesh = adapt_mesh(**vars())
+        vars().update(discretize(**vars()))
+        transfer_functions(w_old, w_)
+        transfer_functions(w_1_old, w_1)
+        del w_old, w_1_old
+        q_rhs = rhs_source(t=t, **vars())
+        vars().update(setup(**dict(vars(), dt=dt_const)))
+        tstepfiles = create_tstepfiles(newfolder, fields, tstep, xdmf_flush)
+        xdmf_writer = XDMFWriter(w_, subproblems, tstepfiles, stats_index)
+        if adaptive_dt:
+            dt_controller.update_mesh(mesh, field_to_subspace)
+        timer.stop()
+
+    profiler.end_step(tstep, t, dt)
 
     if tstep % info_intv == 0 or stop:
         info_green("Time = {0:f}, timestep = {1:d}".format(t, tstep))
@@ -7,8 +7,10 @@ and with a implicit euler timeintegartion.
 AB, 2017-06-1(based on basic.py) 
 """
 import dolfin as df
+from common.profiling import Timer
 import math
 from common.functions import ramp, dramp, diff_pf_potential
+from common.newton import LaggedNewtonSolver
 from . import *
 from . import __all__
 
@@ -40,17 +42,19 @@ def get_subproblems(base_elements, solutes,
     return subproblems
 
 
-def setup(test_functions, trial_functions, w_, w_1, bcs, permittivity,
+def setup(test_functions, trial_functions, w_, w_1, dirichlet_bcs,
+          permittivity,
           density, viscosity,
           solutes, enable_PF, enable_EC, enable_NS,
           surface_tension, dt, interface_thickness,
           grav_const, pf_mobility_coeff, pf_mobility,
           use_iterative_solvers,
+          jacobian_max_lag, jacobian_lag_ratio,
           **namespace):
     """ Set up problem. """
     # Constant
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
-    per_tau = df.Constant(1./dt)
+    per_tau = 1./dt
     grav = df.Constant((0., -grav_const))
     gamma = pf_mobility_coeff
     eps = interface_thickness
@@ -116,7 +120,8 @@ def setup(test_functions, trial_functions, w_, w_1, bcs, permittivity,
         rho_e_1 = sum([c_e*z_e for c_e, z_e in zip(c_1, z)])  # prev sol.
 
     solver = dict()
-    solver["NSPFEC"] = setup_NSPFEC(w_["NSPFEC"], w_1["NSPFEC"], bcs["NSPFEC"],
+    solver["NSPFEC"] = setup_NSPFEC(w_["NSPFEC"], w_1["NSPFEC"],
+                                    dirichlet_bcs["NSPFEC"],
                                     trial_functions["NSPFEC"],
                                     v, q, psi, h, b, U,
                                     u_, p_, phi_, g_, c_, V_,
@@ -126,7 +131,8 @@ def setup(test_functions, trial_functions, w_, w_1, bcs, permittivity,
                                     dbeta, dveps, drho,
                                     per_tau, sigma_bar, eps, grav, z,
                                     enable_NS, enable_PF, enable_EC,
-                                    use_iterative_solvers)
+                                    use_iterative_solvers,
+                                    jacobian_max_lag, jacobian_lag_ratio)
     return dict(solvers=solver)
 
 
@@ -139,7 +145,8 @@ def setup_NSPFEC(w_NSPFEC, w_1NSPFEC, bcs_NSPFEC, trial_func_NSPFEC,
                  dbeta, dveps, drho,
                  per_tau, sigma_bar, eps, grav, z,
                  enable_NS, enable_PF, enable_EC,
-                 use_iterative_solvers):
+                 use_iterative_solvers,
+                 jacobian_max_lag, jacobian_lag_ratio):
     """ The full problem of electrohydrodynamics in two pahase.
     Note that it is possioble to trun off the dirffent parts at will.
     """
@@ -161,18 +168,25 @@ def setup_NSPFEC(w_NSPFEC, w_1NSPFEC, bcs_NSPFEC, trial_func_NSPFEC,
     F = 0.5*(F_imp + F_exp)
     J = df.derivative(F, w_NSPFEC)
 
-    problem_NSPFEC = df.NonlinearVariationalProblem(F, w_NSPFEC, bcs_NSPFEC, J)
-    solver_NSPFEC = df.NonlinearVariationalSolver(problem_NSPFEC)
     if use_iterative_solvers:
-        solver_NSPFEC.parameters['newton_solver']['linear_solver'] = 'gmres'
-        solver_NSPFEC.parameters['newton_solver']['preconditioner'] = 'ilu'
+        method, preconditioner = "gmres", "ilu"
+    else:
+        method, preconditioner = "default", "default"
+    solver_NSPFEC = LaggedNewtonSolver(F, w_NSPFEC, bcs_NSPFEC, J,
+                                       method, preconditioner,
+                                       jacobian_max_lag, jacobian_lag_ratio,
+                                       name="NSPFEC")
 
     return solver_NSPFEC
 
 
 def solve(solvers, **namespace):
     """ Solve equations. """
+    timer_outer = Timer("solve", "Solve system")
+    timer_inner = Timer("NSPFEC", "Solve subproblem NSPFEC")
     solvers["NSPFEC"].solve()
+    timer_inner.stop()
+    timer_outer.stop()
 
 
 def update(w_, w_1, enable_PF, enable_EC, enable_NS, **namespace):
@@ -245,21 +259,4 @@ def NSPFEC_action(u_, u_1, phi_, phi_1, c_, c_1,
         F_E = sum(F_E_c) + F_E_V
         F.append(F_E)
 
-    F = sum(F)
-    J = df.derivative(F, w_NSPFEC)
-
-    problem_NSPFEC = df.NonlinearVariationalProblem(F, w_NSPFEC, bcs_NSPFEC, J)
-    solver_NSPFEC = df.NonlinearVariationalSolver(problem_NSPFEC)
-    if use_iterative_solvers:
-        solver_NSPFEC.parameters['newton_solver']['linear_solver'] = 'gmres'
-        solver_NSPFEC.parameters['newton_solver']['preconditioner'] = 'ilu'
-
-    return solver_NSPFEC
-
-def solve(solvers, **namespace):
-    """ Solve equations. """
-    solvers["NSPFEC"].solve()
-
-def update(w_, w_1, enable_PF, enable_EC, enable_NS, **namespace):
-    """ Update work variables at end of timestep. """
-    w_1["NSPFEC"].assign(w_["NSPFEC"])
+    return sum(F)
@@ -19,9 +19,11 @@ GL, 2017-05-29
 
 """
 import dolfin as df
+from common.profiling import Timer
 import math
 from common.functions import ramp, dramp, diff_pf_potential
 from common.cmd import info_red
+from common.assembly import CachedLinearSolver, projection_solver
 from basic import unit_interval_filter  # GL: Move this to common.functions?
 from . import *
 from . import __all__
@@ -54,7 +56,7 @@ def unpack_quantities(surface_tension, grav_const, pf_mobility_coeff,
     """ """
     # Constant
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
-    per_tau = df.Constant(1./dt)
+    per_tau = 1./dt
     grav = df.Constant((0., -grav_const))
     gamma = pf_mobility_coeff
     eps = interface_thickness
@@ -152,7 +154,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
           solutes, enable_PF, enable_EC, enable_NS,
           surface_tension, dt, interface_thickness,
           grav_const, pf_mobility, pf_mobility_coeff,
-          use_iterative_solvers,
+          use_iterative_solvers, reuse_factorization,
           **namespace):
     """ Set up problem. """
 
@@ -190,7 +192,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
                                  dt, sigma_bar, eps,
                                  dbeta, dveps,
                                  enable_NS, enable_EC,
-                                 use_iterative_solvers)
+                                 use_iterative_solvers, reuse_factorization)
 
     if enable_EC:
         solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e,
@@ -201,7 +203,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
                                  u_1, K_, veps_, phi_flt_, rho_1,
                                  dt, z, dbeta,
                                  enable_NS, enable_PF,
-                                 use_iterative_solvers)
+                                 use_iterative_solvers, reuse_factorization)
 
     if enable_NS:
         solvers["NSu"] = setup_NSu(
@@ -212,7 +214,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
             M_, nu_, nu_1, rho_e_, rho_e_1, V_,
             dt, drho, sigma_bar, eps, dveps, grav, dbeta, z,
             enable_PF, enable_EC,
-            use_iterative_solvers
+            use_iterative_solvers, reuse_factorization
         )
         solvers["NSp"] = setup_NSp(w_["NSp"], p, q,
                                    dx, ds,
@@ -231,7 +233,7 @@ def setup_PF(w_PF, phi, g, psi, h,
              dt, sigma_bar, eps,
              dbeta, dveps,
              enable_NS, enable_EC,
-             use_iterative_solvers):
+             use_iterative_solvers, reuse_factorization):
     """ Set up phase field subproblem. """
     # Projected velocity (for energy stability)
     u_proj = u_1 - dt*phi_1*df.grad(g)/rho_1
@@ -251,6 +253,12 @@ def setup_PF(w_PF, phi, g, psi, h,
     F = F_phi + F_g
     a, L = df.lhs(F), df.rhs(F)
 
+    if reuse_factorization:
+        if use_iterative_solvers:
+            return CachedLinearSolver(a, L, w_PF, method="gmres",
+                                      split=False)
+        return CachedLinearSolver(a, L, w_PF, split=False)
+
     problem = df.LinearVariationalProblem(a, L, w_PF)
     solver = df.LinearVariationalSolver(problem)
 
@@ -267,7 +275,7 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
              c_1, u_1, K_, veps_, phi_, rho_1,
              dt, z, dbeta,
              enable_NS, enable_PF,
-             use_iterative_solvers):
+             use_iterative_solvers, reuse_factorization):
     """ Set up electrochemistry subproblem. """
 
     F_c = []
@@ -293,6 +301,12 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
     F = sum(F_c) + F_V
     a, L = df.lhs(F), df.rhs(F)
 
+    if reuse_factorization:
+        if use_iterative_solvers:
+            return CachedLinearSolver(a, L, w_EC, dirichlet_bcs, "gmres",
+                                      split=False)
+        return CachedLinearSolver(a, L, w_EC, dirichlet_bcs, split=False)
+
     problem = df.LinearVariationalProblem(a, L, w_EC, dirichlet_bcs)
     solver = df.LinearVariationalSolver(problem)
 
@@ -310,7 +324,7 @@ def setup_NSu(w_NSu, u, v,
               M_, nu_, nu_1, rho_e_, rho_e_1, V_,
               dt, drho, sigma_bar, eps, dveps, grav, dbeta, z,
               enable_PF, enable_EC,
-              use_iterative_solvers):
+              use_iterative_solvers, reuse_factorization):
     """ Set up the Navier-Stokes velocity subproblem. """
     mom_1 = rho_1*u_1
     if enable_PF:
@@ -340,6 +354,12 @@ def setup_NSu(w_NSu, u, v,
 
     a, L = df.lhs(F), df.rhs(F)
 
+    if reuse_factorization:
+        if use_iterative_solvers:
+            return CachedLinearSolver(a, L, w_NSu, dirichlet_bcs, "gmres",
+                                      split=False)
+        return CachedLinearSolver(a, L, w_NSu, dirichlet_bcs, split=False)
+
     problem = df.LinearVariationalProblem(a, L, w_NSu, dirichlet_bcs)
     solver = df.LinearVariationalSolver(problem)
 
@@ -355,31 +375,27 @@ def setup_NSp(w_NSp, p, q,
               dirichlet_bcs, neumann_bcs, boundary_to_mark,
               u_, u_1, p_, p_1, rho_, dt, chi,
               use_iterative_solvers):
+    """ Set up Navier-Stokes pressure subproblem. The matrix is
+    constant, so it is assembled only once. """
     F = (
         df.dot(df.grad(q), df.grad(p - p_1)) * dx
         + chi/dt * q * df.div(2*u_ - u_1) * dx
     )
     a, L = df.lhs(F), df.rhs(F)
-    problem = df.LinearVariationalProblem(a, L, w_NSp, dirichlet_bcs)
-    solver = df.LinearVariationalSolver(problem)
-
-    if use_iterative_solvers:
-        solver.parameters["linear_solver"] = "gmres"
-        # solver.parameters["preconditioner"] = "hypre_euclid"
-
-    return solver
+    return projection_solver(a, L, w_NSp, dirichlet_bcs,
+                             "gmres" if use_iterative_solvers else None)
 
 
 def solve(tstep, w_, w_1, w_tmp, solvers,
           enable_PF, enable_EC, enable_NS,
           **namespace):
     """ Solve equations. """
-    timer_outer = df.Timer("Solve system")
+    timer_outer = Timer("solve", "Solve system")
     for subproblem, enable in zip(
             ["PF", "EC", "NSu", "NSp"],
             [enable_PF, enable_EC, enable_NS, enable_NS]):
         if enable:
-            timer_inner = df.Timer("Solve subproblem " + subproblem)
+            timer_inner = Timer(subproblem, "Solve subproblem " + subproblem)
             df.mpi_comm_world().barrier()
             solvers[subproblem].solve()
             timer_inner.stop()
@@ -19,9 +19,13 @@ GL, 2017-05-29
 
 """
 import dolfin as df
+from common.profiling import Timer
 import math
 from common.functions import ramp, dramp, diff_pf_potential_linearised, \
     unit_interval_filter, diff_pf_contact_linearised, pf_potential, alpha
+from common.assembly import CachedLinearSolver
+from common.preconditioners import fieldsplit_NS_solver, ns_schur_mass_form, \
+    fieldsplit_EC_solver
 from . import *
 from . import __all__
 
@@ -59,13 +63,15 @@ def setup(test_functions, trial_functions,
           pf_mobility,
           pf_mobility_coeff,
           use_iterative_solvers, use_pressure_stabilization,
+          use_cached_assembly, reuse_factorization,
+          NS_preconditioner, EC_preconditioner,
           p_lagrange,
           q_rhs,
           **namespace):
     """ Set up problem. """
     # Constant
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
-    per_tau = df.Constant(1./dt)
+    per_tau = 1./dt
     grav = df.Constant((0., -grav_const))
     gamma = pf_mobility_coeff
     eps = interface_thickness
@@ -155,7 +161,9 @@ def setup(test_functions, trial_functions,
                                  phi_1, u_1, M_1, c_1, V_1,
                                  per_tau, sigma_bar, eps, dbeta, dveps,
                                  enable_NS, enable_EC,
-                                 use_iterative_solvers, q_rhs)
+                                 use_iterative_solvers, use_cached_assembly,
+                                 reuse_factorization,
+                                 q_rhs)
 
     if enable_EC:
         solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e,
@@ -166,7 +174,9 @@ def setup(test_functions, trial_functions,
                                  solutes,
                                  per_tau, z, dbeta,
                                  enable_NS, enable_PF,
-                                 use_iterative_solvers,
+                                 use_iterative_solvers, use_cached_assembly,
+                                 reuse_factorization,
+                                 EC_preconditioner,
                                  q_rhs)
 
     if enable_NS:
@@ -183,6 +193,8 @@ def setup(test_functions, trial_functions,
                                  enable_PF, enable_EC,
                                  use_iterative_solvers,
                                  use_pressure_stabilization,
+                                 use_cached_assembly, reuse_factorization,
+                                 NS_preconditioner,
                                  p_lagrange,
                                  q_rhs)
     return dict(solvers=solvers)
@@ -198,6 +210,8 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
              per_tau, drho, sigma_bar, eps, dveps, grav,
              enable_PF, enable_EC,
              use_iterative_solvers, use_pressure_stabilization,
+             use_cached_assembly, reuse_factorization,
+             NS_preconditioner,
              p_lagrange,
              q_rhs):
     """ Set up the Navier-Stokes subproblem. """
@@ -251,6 +265,23 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
 
     a, L = df.lhs(F), df.rhs(F)
 
+    if use_iterative_solvers and NS_preconditioner != "default":
+        # Block preconditioned solve; requires explicit assembly.
+        solver = fieldsplit_NS_solver(w_NS.function_space(),
+                                      NS_preconditioner)
+        a_P = None
+        if NS_preconditioner == "fieldsplit_mass":
+            a_P = a + ns_schur_mass_form(p, q, mu_, dx)
+        return CachedLinearSolver(a, L, w_NS, dirichlet_bcs,
+                                  a_P=a_P, solver=solver)
+
+    if use_cached_assembly or reuse_factorization:
+        if use_iterative_solvers and use_pressure_stabilization:
+            return CachedLinearSolver(a, L, w_NS, dirichlet_bcs, "gmres",
+                                      split=use_cached_assembly)
+        return CachedLinearSolver(a, L, w_NS, dirichlet_bcs,
+                                  split=use_cached_assembly)
+
     problem = df.LinearVariationalProblem(a, L, w_NS, dirichlet_bcs)
     solver = df.LinearVariationalSolver(problem)
 
@@ -268,7 +299,8 @@ def setup_PF(w_PF, phi, g, psi, h,
              per_tau, sigma_bar, eps,
              dbeta, dveps,
              enable_NS, enable_EC,
-             use_iterative_solvers,
+             use_iterative_solvers, use_cached_assembly,
+             reuse_factorization,
              q_rhs):
     """ Set up phase field subproblem. """
 
@@ -297,6 +329,12 @@ def setup_PF(w_PF, phi, g, psi, h,
     F = F_phi + F_g
     a, L = df.lhs(F), df.rhs(F)
 
+    if use_cached_assembly or reuse_factorization:
+        if use_iterative_solvers:
+            return CachedLinearSolver(a, L, w_PF, method="gmres",
+                                      split=use_cached_assembly)
+        return CachedLinearSolver(a, L, w_PF, split=use_cached_assembly)
+
     problem = df.LinearVariationalProblem(a, L, w_PF)
     solver = df.LinearVariationalSolver(problem)
 
@@ -314,7 +352,9 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
              solutes,
              per_tau, z, dbeta,
              enable_NS, enable_PF,
-             use_iterative_solvers,
+             use_iterative_solvers, use_cached_assembly,
+             reuse_factorization,
+             EC_preconditioner,
              q_rhs):
     """ Set up electrochemistry subproblem. """
     F_c = []
@@ -345,6 +385,19 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
     F = sum(F_c) + F_V
     a, L = df.lhs(F), df.rhs(F)
 
+    if use_iterative_solvers and EC_preconditioner != "default":
+        # Block preconditioned solve; requires explicit assembly.
+        solver = fieldsplit_EC_solver(w_EC.function_space(), solutes,
+                                      EC_preconditioner)
+        return CachedLinearSolver(a, L, w_EC, dirichlet_bcs, solver=solver)
+
+    if use_cached_assembly or reuse_factorization:
+        if use_iterative_solvers:
+            return CachedLinearSolver(a, L, w_EC, dirichlet_bcs, "gmres",
+                                      split=use_cached_assembly)
+        return CachedLinearSolver(a, L, w_EC, dirichlet_bcs,
+                                  split=use_cached_assembly)
+
     problem = df.LinearVariationalProblem(a, L, w_EC, dirichlet_bcs)
     solver = df.LinearVariationalSolver(problem)
 
@@ -357,11 +410,11 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
 
 def solve(w_, solvers, enable_PF, enable_EC, enable_NS, **namespace):
     """ Solve equations. """
-    timer_outer = df.Timer("Solve system")
+    timer_outer = Timer("solve", "Solve system")
     for subproblem, enable in zip(["PF", "EC", "NS"],
                                   [enable_PF, enable_EC, enable_NS]):
         if enable:
-            timer_inner = df.Timer("Solve subproblem " + subproblem)
+            timer_inner = Timer(subproblem, "Solve subproblem " + subproblem)
             df.mpi_comm_world().barrier()
             solvers[subproblem].solve()
             timer_inner.stop()
@@ -7,17 +7,25 @@ linearisation. The problem is split between the following subproblems.
 
 * EC: Same as basic
 
-* NSu: Velocity. 
+* NSu: Velocity. Tentative velocity and velocity correction.
 
 * NSp: Pressure.
 
+The tentative velocity and pressure correction can be repeated
+ipcs_max_iter times per timestep, until the relative change in the
+tentative velocity is below ipcs_tol. The matrices of the pressure and
+velocity correction are assembled only once if they are time-invariant.
+The time spent on each substep is reported by the timers "NS: ...".
+
 GL, 2017-05-29
 
 """
 import dolfin as df
+from common.profiling import Timer
 import math
 from common.functions import ramp, dramp, diff_pf_potential_linearised
 from common.cmd import info_red
+from common.assembly import CachedLinearSolver, projection_solver
 from basic import setup_PF, setup_EC, unit_interval_filter
 from . import *
 from . import __all__
@@ -42,22 +50,28 @@ def get_subproblems(base_elements, solutes,
     return subproblems
 
 
-def setup(tstep, test_functions, trial_functions, w_, w_1, bcs, permittivity,
-          density, viscosity,
+def setup(tstep, test_functions, trial_functions, w_, w_1,
+          ds, dx, normal,
+          dirichlet_bcs, neumann_bcs, boundary_to_mark,
+          permittivity, density, viscosity,
           solutes, enable_PF, enable_EC, enable_NS,
           surface_tension, dt, interface_thickness,
           grav_const, pf_mobility, pf_mobility_coeff,
-          use_iterative_solvers, use_pressure_stabilization,
+          use_iterative_solvers, use_cached_assembly, reuse_factorization,
+          EC_preconditioner,
+          q_rhs,
           **namespace):
     """ Set up problem. """
     # Constant
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
-    per_tau = df.Constant(1./dt)
+    per_tau = 1./dt
     grav = df.Constant((0., -grav_const))
     gamma = pf_mobility_coeff
     eps = interface_thickness
 
     # Navier-Stokes
+    u_ = p_ = None
+    u_1 = p_1 = None
     if enable_NS:
         u = trial_functions["NSu"]
         p = trial_functions["NSp"]
@@ -79,6 +93,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1, bcs, permittivity,
     else:
         # Defaults to phase 1 if phase field is disabled
         phi_ = phi_1 = 1.
+        g_ = g_1 = None
 
     # Electrochemistry
     if enable_EC:
@@ -93,14 +108,19 @@ def setup(tstep, test_functions, trial_functions, w_, w_1, bcs, permittivity,
         cV_1 = df.split(w_1["EC"])
         c_, V_ = cV_[:num_solutes], cV_[num_solutes]
         c_1, V_1 = cV_1[:num_solutes], cV_1[num_solutes]
+    else:
+        c_ = V_ = c_1 = V_1 = None
+
+    phi_flt_ = unit_interval_filter(phi_)
+    phi_flt_1 = unit_interval_filter(phi_1)
 
-    M_ = pf_mobility(unit_interval_filter(phi_), gamma)
-    M_1 = pf_mobility(unit_interval_filter(phi_1), gamma)
-    nu_ = ramp(unit_interval_filter(phi_), viscosity)
-    rho_ = ramp(unit_interval_filter(phi_), density)
-    veps_ = ramp(unit_interval_filter(phi_), permittivity)
+    M_ = pf_mobility(phi_flt_, gamma)
+    M_1 = pf_mobility(phi_flt_1, gamma)
+    nu_ = ramp(phi_flt_, viscosity)
+    rho_ = ramp(phi_flt_, density)
+    veps_ = ramp(phi_flt_, permittivity)
 
-    rho_1 = ramp(unit_interval_filter(phi_1), density)
+    rho_1 = ramp(phi_flt_1, density)
 
     dveps = dramp(permittivity)
     drho = dramp(density)
@@ -116,184 +136,185 @@ def setup(tstep, test_functions, trial_functions, w_, w_1, bcs, permittivity,
         beta_.append(ramp(phi_, [solute[4], solute[5]]))
         dbeta.append(dramp([solute[4], solute[5]]))
 
-    rho_e = sum([c_e*z_e for c_e, z_e in zip(c, z)])  # Sum of trial functions
-    rho_e_ = sum([c_e*z_e for c_e, z_e in zip(c_, z)])  # Sum of current sol.
+    if enable_EC:
+        rho_e = sum([c_e*z_e for c_e, z_e in zip(c, z)])  # Sum of trial func.
+        rho_e_ = sum([c_e*z_e for c_e, z_e in zip(c_, z)])  # Sum of curr. sol.
+    else:
+        rho_e_ = None
 
     if tstep == 0 and enable_NS:
-        solve_initial_pressure(w_["NSp"], p, q, u, v, bcs["NSp"],
+        solve_initial_pressure(w_["NSp"], p, q, u, v, dirichlet_bcs["NSp"],
                                M_, g_, phi_, rho_, rho_e_, V_,
                                drho, sigma_bar, eps, grav, dveps,
                                enable_PF, enable_EC)
 
     solvers = dict()
     if enable_PF:
-        solvers["PF"] = setup_PF(w_["PF"], phi, g, psi, h, bcs["PF"],
+        solvers["PF"] = setup_PF(w_["PF"], phi, g, psi, h,
+                                 dx, ds,
+                                 dirichlet_bcs["PF"], neumann_bcs,
+                                 boundary_to_mark,
                                  phi_1, u_1, M_1, c_1, V_1,
                                  per_tau, sigma_bar, eps, dbeta, dveps,
                                  enable_NS, enable_EC,
-                                 use_iterative_solvers)
+                                 use_iterative_solvers, use_cached_assembly,
+                                 reuse_factorization,
+                                 q_rhs)
 
     if enable_EC:
-        solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e, bcs["EC"], c_1,
-                                 u_1, K_, veps_, phi_, per_tau, z, dbeta,
+        solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e,
+                                 dx, ds,
+                                 dirichlet_bcs["EC"], neumann_bcs,
+                                 boundary_to_mark,
+                                 c_1, u_1, K_, veps_, phi_flt_,
+                                 solutes,
+                                 per_tau, z, dbeta,
                                  enable_NS, enable_PF,
-                                 use_iterative_solvers)
+                                 use_iterative_solvers, use_cached_assembly,
+                                 reuse_factorization,
+                                 EC_preconditioner,
+                                 q_rhs)
 
+    p_k = None
     if enable_NS:
+        # Pressure guess of the current inner iteration
+        p_k = df.Function(w_["NSp"].function_space(), name="p_k")
+        p_k.assign(w_1["NSp"])
         solvers["NSu"] = setup_NSu(
-            u, v, u_, p_, bcs["NSu"],
+            w_["NSu"], u, v, u_, p_, p_k,
+            dx, ds, normal,
+            dirichlet_bcs["NSu"], neumann_bcs, boundary_to_mark,
             u_1, p_1, phi_, rho_, rho_1, g_, M_, nu_, rho_e_, V_,
             dt, drho, sigma_bar, eps, dveps, grav,
-            enable_PF, enable_EC)
-        solvers["NSp"] = setup_NSp(p, q, bcs["NSp"], u_, p_, p_1, rho_, dt)
+            enable_PF, enable_EC,
+            use_iterative_solvers, use_cached_assembly,
+            q_rhs)
+        solvers["NSp"] = setup_NSp(w_["NSp"], p, q, dirichlet_bcs["NSp"],
+                                   u_, p_k, rho_, dt,
+                                   use_iterative_solvers)
 
-    return dict(solvers=solvers)
+    return dict(solvers=solvers, p_k=p_k)
 
 
-def setup_NSu(u, v, u_, p_, bcs_NSu,
+def setup_NSu(w_NSu, u, v, u_, p_, p_k,
+              dx, ds, normal,
+              dirichlet_bcs, neumann_bcs, boundary_to_mark,
               u_1, p_1, phi_, rho_, rho_1, g_, M_, nu_, rho_e_, V_,
               dt, drho, sigma_bar, eps, dveps, grav,
-              enable_PF, enable_EC):
-    """ Set up the Navier-Stokes subproblem. """
+              enable_PF, enable_EC,
+              use_iterative_solvers, use_cached_assembly,
+              q_rhs):
+    """ Set up the Navier-Stokes velocity subproblems, i.e. the tentative
+    velocity and the velocity correction. """
     # Crank-Nicolson velocity
     # u_CN = 0.5*(u_1 + u)
 
     F_predict = (
-        1./dt * df.sqrt(rho_) * df.dot(df.sqrt(rho_)*u - df.sqrt(rho_1)*u_1, v)*df.dx
-        # + rho_*df.inner(df.grad(u), df.outer(u_1, v))*df.dx
-        # + 2*nu_*df.inner(df.sym(df.grad(u)), df.grad(v))*df.dx
-        # - p_1 * df.div(v)*df.dx
-        # + df.div(u)*q*df.dx
-        + rho_*df.dot(df.dot(u_1, df.nabla_grad(u)), v)*df.dx
-        + 2*nu_*df.inner(df.sym(df.grad(u)), df.sym(df.grad(v)))*df.dx
-        - p_1*df.div(v)*df.dx
-        - df.dot(rho_*grav, v)*df.dx
+        1./dt * df.sqrt(rho_) * df.dot(df.sqrt(rho_)*u - df.sqrt(rho_1)*u_1, v)*dx
+        + rho_*df.dot(df.dot(u_1, df.nabla_grad(u)), v)*dx
+        + 2*nu_*df.inner(df.sym(df.grad(u)), df.sym(df.grad(v)))*dx
+        - p_k*df.div(v)*dx
+        - df.dot(rho_*grav, v)*dx
     )
 
+    for boundary_name, pressure in neumann_bcs["p"].iteritems():
+        F_predict += pressure * df.inner(
+            normal, v) * ds(boundary_to_mark[boundary_name])
+
     phi_filtered = unit_interval_filter(phi_)
     if enable_PF:
         F_predict += - drho*M_*df.dot(df.dot(df.nabla_grad(g_),
-                                             df.nabla_grad(u)), v)*df.dx
+                                             df.nabla_grad(u)), v)*dx
         F_predict += - sigma_bar*eps*df.inner(df.outer(df.grad(phi_filtered),
                                                        df.grad(phi_filtered)),
-                                              df.grad(v))*df.dx
+                                              df.grad(v))*dx
     if enable_EC and rho_e_ != 0:
-        F_predict += rho_e_ * df.dot(df.grad(V_), v)*df.dx
+        F_predict += rho_e_ * df.dot(df.grad(V_), v)*dx
     if enable_PF and enable_EC:
         F_predict += dveps * df.dot(df.grad(
             phi_filtered), v)*df.dot(df.grad(V_),
-                                     df.grad(V_))*df.dx
+                                     df.grad(V_))*dx
 
-    # a1, L1 = df.lhs(F_predict), df.rhs(F_predict)
+    if "u" in q_rhs:
+        F_predict += -df.dot(q_rhs["u"], v)*dx
+
+    a1, L1 = df.lhs(F_predict), df.rhs(F_predict)
 
     F_correct = (
-        df.inner(u - u_, v)*df.dx
-        + dt/rho_ * df.inner(df.grad(p_ - p_1), v)*df.dx
+        df.inner(u - u_, v)*dx
+        + dt/rho_ * df.inner(df.grad(p_ - p_k), v)*dx
     )
-    # a3 = df.dot(u, v)*df.dx
-    # L3 = df.dot(u_, v)*df.dx - dt*df.dot(df.grad(p_), v)*df.dx
-    # a3, L3 = df.lhs(F_correct), df.rhs(F_correct)
-
-    solver = dict()
-    # solver["a1"] = a1
-    # solver["L1"] = L1
-    solver["Fu"] = F_predict
-    solver["Fu_corr"] = F_correct
-    # solver["a3"] = a3
-    # solver["L3"] = L3
-    solver["bcs"] = bcs_NSu
-    return solver
-
-
-def setup_NSp(p, q, bcs_NSp, u_, p_, p_1, rho_, dt):
+    a3, L3 = df.lhs(F_correct), df.rhs(F_correct)
+
+    solvers = dict()
+    if use_iterative_solvers:
+        solvers["predict"] = CachedLinearSolver(
+            a1, L1, w_NSu, dirichlet_bcs, "bicgstab", "jacobi",
+            split=use_cached_assembly)
+    else:
+        solvers["predict"] = CachedLinearSolver(
+            a1, L1, w_NSu, dirichlet_bcs, split=use_cached_assembly)
+    solvers["correct"] = projection_solver(
+        a3, L3, w_NSu, dirichlet_bcs,
+        "bicgstab" if use_iterative_solvers else None, "jacobi")
+    return solvers
+
+
+def setup_NSp(w_NSp, p, q, dirichlet_bcs, u_, p_k, rho_, dt,
+              use_iterative_solvers):
+    """ Set up Navier-Stokes pressure subproblem. Without phase field,
+    the matrix is constant and assembled only once. """
     F_correct = (
-        1./rho_ * df.dot(df.grad(p - p_1), df.grad(q)) * df.dx
+        1./rho_ * df.dot(df.grad(p - p_k), df.grad(q)) * df.dx
         + 1./dt * df.div(u_) * q * df.dx
     )
-    # a2 = df.dot(df.grad(p), df.grad(q))*df.dx
-    # L2 = (df.dot(df.grad(p_1), df.grad(q))*df.dx
-    #       - (1./dt)*df.div(rho_*u_)*q*df.dx)
-    # L2 = -(1./dt)*df.div(u_)*q*df.dx
-    # a2, L2 = df.lhs(F_correct), df.rhs(F_correct)
-
-    solver = dict()
-    # solver["a2"] = a2
-    # solver["L2"] = L2
-    solver["Fp"] = F_correct
-    solver["bcs"] = bcs_NSp
-    return solver
+    a2, L2 = df.lhs(F_correct), df.rhs(F_correct)
+    return projection_solver(a2, L2, w_NSp, dirichlet_bcs,
+                             "gmres" if use_iterative_solvers else None)
 
 
-def solve(tstep, w_, w_1, w_tmp, solvers,
+def solve(tstep, w_, w_1, w_tmp, solvers, p_k,
           enable_PF, enable_EC, enable_NS,
+          ipcs_max_iter, ipcs_tol,
           **namespace):
     """ Solve equations. """
-    timer_outer = df.Timer("Solve system")
+    timer_outer = Timer("solve", "Solve system")
     for subproblem, enable in zip(["PF", "EC"], [enable_PF, enable_EC]):
-            timer_inner = df.Timer("Solve subproblem " + subproblem)
+        if enable:
+            timer_inner = Timer(subproblem, "Solve subproblem " + subproblem)
             df.mpi_comm_world().barrier()
             solvers[subproblem].solve()
             timer_inner.stop()
     if enable_NS:
-        # timer = df.Timer("NS: Assemble matrices")
-        # A1 = df.assemble(solvers["NSu"]["a1"])
-        # A2 = df.assemble(solvers["NSp"]["a2"])
-        # A3 = df.assemble(solvers["NSu"]["a3"])
-        # timer.stop()
-
-        # timer = df.Timer("NS: Apply BCs 1")
-        # [bc.apply(A1) for bc in solvers["NSu"]["bcs"]]
-        # [bc.apply(A2) for bc in solvers["NSp"]["bcs"]]
-        # timer.stop()
-        du = np.array([1e9])
-        tol = 1e-6
-        max_num_iterations = 1
+        p_k.assign(w_1["NSp"])
+        du = np.inf
         i_iter = 0
-
-        Fu = solvers["NSu"]["Fu"]
-        bcs_u = solvers["NSu"]["bcs"]
-
-        while du > tol and i_iter < max_num_iterations:
-            print du[0]
+        while du > ipcs_tol and i_iter < ipcs_max_iter:
+            if i_iter > 0:
+                p_k.assign(w_["NSp"])
             i_iter += 1
-            du[0] = 0.
-            # Step 1: Tentative velocity
-            timer = df.Timer("NS: Tentative velocity")
-            # b1 = df.assemble(solvers["NSu"]["L1"])
-            # [bc.apply(b1) for bc in solvers["NSu"]["bcs"]]
-            # df.solve(A1, w_["NSu"].vector(), b1)
 
-            w_tmp["NSu"].vector()[:] = w_["NSu"].vector()
-
-            # A, L = df.system(Fu)
-            # df.solve(A == L, w_["NSu"], bcs_u)
-            df.solve(df.lhs(Fu) == df.rhs(Fu), w_["NSu"], bcs_u)
-
-            du[0] += df.norm(w_["NSu"].vector()-w_tmp["NSu"].vector())
+            # Step 1: Tentative velocity
+            timer = Timer("NSu_predict", "NS: Tentative velocity")
+            w_tmp["NSu"].assign(w_["NSu"])
+            solvers["NSu"]["predict"].solve()
+            w_tmp["NSu"].vector().axpy(-1., w_["NSu"].vector())
+            du = (w_tmp["NSu"].vector().norm("l2") /
+                  max(w_["NSu"].vector().norm("l2"), df.DOLFIN_EPS))
             timer.stop()
 
             # Step 2: Pressure correction
-            timer = df.Timer("NS: Pressure correction")
-            # b2 = df.assemble(solvers["NSp"]["L2"])
-            # [bc.apply(b2) for bc in solvers["NSp"]["bcs"]]
-            # df.solve(A2, w_["NSp"].vector(), b2)
-
-            Fp = solvers["NSp"]["Fp"]
-            bcs_p = solvers["NSp"]["bcs"]
-            df.solve(df.lhs(Fp) == df.rhs(Fp), w_["NSp"], bcs_p)
-
-            w_1["NSp"].assign(w_["NSp"])
-
+            timer = Timer("NSp", "NS: Pressure correction")
+            solvers["NSp"].solve()
             timer.stop()
 
-        # Step 3: Velocity correction
-        timer = df.Timer("NS: Velocity correction")
-        # b3 = df.assemble(solvers["NSu"]["L3"])
-        # df.solve(A3, w_["NSu"].vector(), b3)
-        Fu_corr = solvers["NSu"]["Fu_corr"]
-
-        df.solve(df.lhs(Fu_corr) == df.rhs(Fu_corr), w_["NSu"], bcs_u)
+        if du > ipcs_tol and ipcs_max_iter > 1:
+            info_red("IPCS: relative velocity change {:e} after {} inner "
+                     "iterations".format(du, i_iter))
 
+        # Step 3: Velocity correction
+        timer = Timer("NSu_correct", "NS: Velocity correction")
+        solvers["NSu"]["correct"].solve()
         timer.stop()
 
     timer_outer.stop()
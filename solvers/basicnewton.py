@@ -8,9 +8,11 @@ AB, 2017-06-1 (based on basic.py)
 GL, 2018-03 
 """
 import dolfin as df
+from common.profiling import Timer
 import math
 from common.functions import ramp, dramp, diff_pf_potential, diff_pf_contact,\
     unit_interval_filter, max_value
+from common.newton import LaggedNewtonSolver
 from . import *
 from . import __all__
 
@@ -53,11 +55,12 @@ def setup(test_functions, trial_functions, w_, w_1,
           q_rhs,
           use_iterative_solvers,
           p_lagrange,
+          jacobian_max_lag, jacobian_lag_ratio,
           **namespace):
     """ Set up problem. """
     # Constants
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
-    per_tau = df.Constant(1./dt)
+    per_tau = 1./dt
     grav = df.Constant((0., -grav_const))
     gamma = pf_mobility_coeff
     eps = interface_thickness
@@ -146,7 +149,8 @@ def setup(test_functions, trial_functions, w_, w_1,
                                     enable_NS, enable_PF, enable_EC,
                                     use_iterative_solvers,
                                     p_lagrange,
-                                    q_rhs)
+                                    q_rhs,
+                                    jacobian_max_lag, jacobian_lag_ratio)
     return dict(solvers=solver)
 
 
@@ -165,7 +169,8 @@ def setup_NSPFEC(w_NSPFEC, w_1NSPFEC,
                  enable_NS, enable_PF, enable_EC,
                  use_iterative_solvers,
                  p_lagrange,
-                 q_rhs):
+                 q_rhs,
+                 jacobian_max_lag, jacobian_lag_ratio):
     """ The full problem of electrohydrodynamics in two phases.
     Note that it is possible to turn off the different parts at will.
     """
@@ -296,18 +301,25 @@ def setup_NSPFEC(w_NSPFEC, w_1NSPFEC,
     F = sum(F)
 
     J = df.derivative(F, w_NSPFEC)
-    problem_NSPFEC = df.NonlinearVariationalProblem(F, w_NSPFEC, dirichlet_bcs_NSPFEC, J)
-    solver_NSPFEC = df.NonlinearVariationalSolver(problem_NSPFEC)
     if use_iterative_solvers:
-        solver_NSPFEC.parameters['newton_solver']['linear_solver'] = 'gmres'
-        solver_NSPFEC.parameters['newton_solver']['preconditioner'] = 'ilu'
+        method, preconditioner = "gmres", "ilu"
+    else:
+        method, preconditioner = "default", "default"
+    solver_NSPFEC = LaggedNewtonSolver(F, w_NSPFEC, dirichlet_bcs_NSPFEC, J,
+                                       method, preconditioner,
+                                       jacobian_max_lag, jacobian_lag_ratio,
+                                       name="NSPFEC")
 
     return solver_NSPFEC
 
 
 def solve(solvers, **namespace):
     """ Solve equations. """
+    timer_outer = Timer("solve", "Solve system")
+    timer_inner = Timer("NSPFEC", "Solve subproblem NSPFEC")
     solvers["NSPFEC"].solve()
+    timer_inner.stop()
+    timer_outer.stop()
 
 
 def update(w_, w_1, enable_PF, enable_EC, enable_NS, **namespace):
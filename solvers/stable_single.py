@@ -4,8 +4,11 @@ GL, 2017
 
 """
 import dolfin as df
+from common.profiling import Timer
 from common.functions import max_value, alpha, alpha_c, alpha_cc, \
     alpha_reg, alpha_c_reg, absolute
+from common.assembly import CachedLinearSolver
+from common.preconditioners import fieldsplit_EC_solver
 from . import *
 from . import __all__
 import numpy as np
@@ -40,6 +43,7 @@ def setup(test_functions, trial_functions, w_, w_1,
           grav_const,
           grav_dir,
           use_iterative_solvers,
+          EC_preconditioner,
           EC_scheme,
           c_cutoff,
           q_rhs,
@@ -282,6 +286,7 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
              enable_NS,
              solutes,
              use_iterative_solvers,
+             EC_preconditioner,
              nonlinear_EC,
              V_lagrange, p_lagrange,
              q_rhs,
@@ -350,6 +355,12 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
             solver.parameters["newton_solver"]["linear_solver"] = "bicgstab"
             if not V_lagrange:
                 solver.parameters["newton_solver"]["preconditioner"] = "hypre_amg"
+    elif use_iterative_solvers and EC_preconditioner != "default":
+        a, L = df.lhs(F), df.rhs(F)
+        solver = CachedLinearSolver(
+            a, L, w_EC, dirichlet_bcs_EC,
+            solver=fieldsplit_EC_solver(w_EC.function_space(), solutes,
+                                        EC_preconditioner))
     else:
         a, L = df.lhs(F), df.rhs(F)
         problem = df.LinearVariationalProblem(a, L, w_EC, dirichlet_bcs_EC)
@@ -375,10 +386,10 @@ def solve(w_, t, dt, q_rhs, solvers, enable_EC, enable_NS,
             if isinstance(bc.value, df.Expression):
                 bc.value.t = t+dt
 
-    timer_outer = df.Timer("Solve system")
+    timer_outer = Timer("solve", "Solve system")
     for subproblem, enable in zip(["EC", "NS"], [enable_EC, enable_NS]):
         if enable:
-            timer_inner = df.Timer("Solve subproblem " + subproblem)
+            timer_inner = Timer(subproblem, "Solve subproblem " + subproblem)
             df.mpi_comm_world().barrier()
             if subproblem == "NS" and use_iterative_solvers:
                 solver, a, L, bcs = solvers[subproblem]
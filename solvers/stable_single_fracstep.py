@@ -6,6 +6,8 @@ GL, 2017
 from stable_single import setup_EC, alpha_prime_approx, alpha_generalized, \
     regulate
 import dolfin as df
+from common.profiling import Timer
+from common.assembly import CachedLinearSolver, projection_solver
 from . import *
 from . import __all__
 import numpy as np
@@ -34,6 +36,7 @@ def setup(test_functions, trial_functions, w_, w_1,
           grav_const,
           grav_dir,
           use_iterative_solvers,
+          reuse_factorization,
           EC_scheme,
           c_cutoff,
           q_rhs,
@@ -185,6 +188,7 @@ def setup_NSu(w_NSu, u, v,
               enable_EC,
               trial_functions,
               use_iterative_solvers,
+              reuse_factorization,
               mesh,
               density_per_concentration,
               viscosity_per_concentration,
@@ -219,26 +223,26 @@ def setup_NSu(w_NSu, u, v,
                           for ci_1, grad_g_ci_ in zip(c_1, grad_g_c_)])
 
     a_predict, L_predict = df.lhs(F_predict), df.rhs(F_predict)
-    #    if not use_iterative_solvers:
-    problem_predict = df.LinearVariationalProblem(
-        a_predict, L_predict, w_NSu, dirichlet_bcs_NSu)
-    solvers["predict"] = df.LinearVariationalSolver(problem_predict)
-    if use_iterative_solvers:
-        solvers["predict"].parameters["linear_solver"] = "bicgstab"
-        solvers["predict"].parameters["preconditioner"] = "amg"
+    if reuse_factorization and not use_iterative_solvers:
+        solvers["predict"] = CachedLinearSolver(
+            a_predict, L_predict, w_NSu, dirichlet_bcs_NSu, split=False)
+    else:
+        problem_predict = df.LinearVariationalProblem(
+            a_predict, L_predict, w_NSu, dirichlet_bcs_NSu)
+        solvers["predict"] = df.LinearVariationalSolver(problem_predict)
+        if use_iterative_solvers:
+            solvers["predict"].parameters["linear_solver"] = "bicgstab"
+            solvers["predict"].parameters["preconditioner"] = "amg"
 
     F_correct = (
         rho_ * df.inner(u - u_, v) * dx
         - dt * (p_ - p_1) * df.div(v) * dx
     )
     a_correct, L_correct = df.lhs(F_correct), df.rhs(F_correct)
-    problem_correct = df.LinearVariationalProblem(
-        a_correct, L_correct, w_NSu, dirichlet_bcs_NSu)
-    solvers["correct"] = df.LinearVariationalSolver(problem_correct)
+    solvers["correct"] = projection_solver(
+        a_correct, L_correct, w_NSu, dirichlet_bcs_NSu,
+        "bicgstab" if use_iterative_solvers else None)
 
-    if use_iterative_solvers:
-        solvers["correct"].parameters["linear_solver"] = "bicgstab"
-        solvers["correct"].parameters["preconditioner"] = "amg"
     #else:
     #    solver = df.LUSolver("mumps")
     #    # solver.set_operator(A)
@@ -259,40 +263,35 @@ def setup_NSp(w_NSp, p, q, dirichlet_bcs_NSp,
 
     a, L = df.lhs(F), df.rhs(F)
 
-    problem = df.LinearVariationalProblem(
-        a, L, w_NSp, dirichlet_bcs_NSp)
-    solver = df.LinearVariationalSolver(problem)
-
-    if use_iterative_solvers:
-        solver.parameters["linear_solver"] = "bicgstab"
-        solver.parameters["preconditioner"] = "amg"
-
-    return solver
+    # The matrix is constant, so it is assembled only once.
+    return projection_solver(
+        a, L, w_NSp, dirichlet_bcs_NSp,
+        "bicgstab" if use_iterative_solvers else None)
 
 
 def solve(tstep, w_, w_1, solvers,
           enable_EC, enable_NS,
           **namespace):
     """ Solve equations. """
-    timer_outer = df.Timer("Solve system")
+    timer_outer = Timer("solve", "Solve system")
     if enable_EC:
-        timer_inner = df.Timer("Solve subproblem EC")
+        timer_inner = Timer("EC", "Solve subproblem EC")
         df.mpi_comm_world().barrier()
         solvers["EC"].solve()
         timer_inner.stop()
     if enable_NS:
         # Step 1: Predict u
-        timer = df.Timer("NS: Predict velocity.")
+        timer = Timer("NSu_predict", "NS: Predict velocity.")
         solvers["NSu"]["predict"].solve()
         timer.stop()
 
         # Step 2: Pressure correction
-        timer = df.Timer("NS: Pressure correction")
+        timer = Timer("NSp", "NS: Pressure correction")
         solvers["NSp"].solve()
         timer.stop()
 
         # Step 3: Velocity correction
-        timer = df.Timer("NS: Velocity correction")
+        timer = Timer("NSu_correct", "NS: Velocity correction")
         solvers["NSu"]["correct"].solve()
         timer.stop()
 
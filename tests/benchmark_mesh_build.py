@@ -0,0 +1,81 @@
+"""
+Timing of the ways to build a dolfin mesh from numpy arrays, e.g.
+python tests/benchmark_mesh_build.py 1000
+
+The temporary HDF5 file is how numpy_to_dolfin used to build meshes;
+the compiled fill_mesh is how it, and reorder_mesh, build them now.
+Run in serial.
+"""
+import os
+import sys
+import time
+import numpy as np
+import h5py
+import dolfin as df
+bernaise_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, bernaise_path)
+from common.ordering import fill_mesh, fill_mesh_editor, reorder_mesh
+
+
+def square_mesh(n):
+    """ Nodes and elements of a structured triangle mesh with n by n
+    squares. """
+    x = np.linspace(0., 1., n+1)
+    X, Y = np.meshgrid(x, x, indexing="ij")
+    nodes = np.vstack((X.ravel(), Y.ravel())).T
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    v = (i*(n+1) + j).ravel()
+    elements = np.vstack((np.vstack((v, v+n+1, v+n+2)).T,
+                          np.vstack((v, v+n+2, v+1)).T))
+    return nodes, elements
+
+
+def build_hdf5(nodes, elements, tmpfile="tmp_benchmark.h5"):
+    with h5py.File(tmpfile, "w") as h5f:
+        h5f.create_dataset("mesh/cell_indices",
+                           data=np.arange(len(elements)), dtype="int64")
+        topology = h5f.create_dataset("mesh/topology", data=elements,
+                                      dtype="int64")
+        h5f.create_dataset("mesh/coordinates", data=nodes, dtype="float64")
+        topology.attrs["celltype"] = np.string_("triangle")
+        topology.attrs["partition"] = np.array([0], dtype="uint64")
+    mesh = df.Mesh()
+    h5f = df.HDF5File(mesh.mpi_comm(), tmpfile, "r")
+    h5f.read(mesh, "mesh", False)
+    h5f.close()
+    os.remove(tmpfile)
+    return mesh
+
+
+def build_with(fill):
+    def build(nodes, elements):
+        mesh = df.Mesh()
+        fill(mesh, nodes, elements)
+        return mesh
+    return build
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nodes, elements = square_mesh(n)
+    print "{} vertices, {} cells".format(len(nodes), len(elements))
+
+    # Compile outside of the timings.
+    build_with(fill_mesh)(*square_mesh(1))
+
+    builders = [("temporary HDF5 file", build_hdf5),
+                ("compiled fill_mesh", build_with(fill_mesh)),
+                ("MeshEditor from Python", build_with(fill_mesh_editor))]
+    for name, build in builders:
+        t_0 = time.time()
+        mesh = build(nodes, elements)
+        print "{:<24} {:8.3f} s".format(name, time.time()-t_0)
+        assert mesh.num_cells() == len(elements)
+
+    t_0 = time.time()
+    reorder_mesh(mesh, "rcm")
+    print "{:<24} {:8.3f} s".format("reorder_mesh (rcm)", time.time()-t_0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make the BERNAISE root and the utilities folder importable, as in the
+# scripts.
+bernaise_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, bernaise_path)
+sys.path.insert(0, os.path.join(bernaise_path, "utilities"))
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+df = pytest.importorskip("dolfin")
+from common.assembly import CachedMatrix
+
+
+def test_cached_matrix_facet_terms():
+    # Only the coefficient-dependent part couples the cells through the
+    # facets, such that its sparsity pattern is not within the one of the
+    # time-invariant part.
+    mesh = df.UnitSquareMesh(4, 4)
+    V = df.FunctionSpace(mesh, "DG", 1)
+    u = df.TrialFunction(V)
+    v = df.TestFunction(V)
+    f = df.Function(V)
+    f.vector()[:] = 1.
+    a = u*v*df.dx + f("+")*df.jump(u)*df.jump(v)*df.dS
+
+    A = CachedMatrix(a)
+    for value in [1., 2.]:
+        f.vector()[:] = value
+        A.assemble()
+        A_ref = df.assemble(a)
+        assert np.allclose(A.A.array(), A_ref.array())
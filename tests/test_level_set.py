@@ -0,0 +1,65 @@
+import numpy as np
+from level_set import LevelSetExtractor, path_areas, path_lengths
+
+
+def square_mesh(n=81, L=1.):
+    """ Structured triangle mesh of [-L, L]^2 with n nodes per side. """
+    x = np.linspace(-L, L, n)
+    X, Y = np.meshgrid(x, x, indexing="ij")
+    nodes = np.vstack((X.ravel(), Y.ravel())).T
+    i, j = np.meshgrid(np.arange(n-1), np.arange(n-1), indexing="ij")
+    v = (i*n + j).ravel()
+    elems = np.vstack((np.vstack((v, v+n, v+n+1)).T,
+                       np.vstack((v, v+n+1, v+1)).T))
+    return nodes, elems
+
+
+def disks(nodes, centers, r):
+    """ Distance to the nearest of the circles, with the values of the
+    nodes that are on a circle set exactly to zero. """
+    vals = np.min([np.sqrt(np.sum((nodes-c)**2, axis=1)) - r
+                   for c in centers], axis=0)
+    vals[np.abs(vals) < 1e-12] = 0.
+    return vals
+
+
+def test_circles_through_nodes():
+    nodes, elems = square_mesh()
+    extractor = LevelSetExtractor(nodes, elems)
+    for centers, r in [([(-0.5, 0.), (0.5, 0.)], 0.3), ([(0., 0.)], 0.5)]:
+        vals = disks(nodes, np.array(centers), r)
+        assert np.sum(vals == 0.) > 0
+        paths, lengths, areas = extractor.measure(vals)
+        assert len(paths) == len(centers)
+        for path in paths:
+            assert np.allclose(path[0], path[-1])
+            assert np.all(np.sum(np.diff(path, axis=0)**2, axis=1) > 0.)
+        assert np.allclose(areas, np.pi*r**2, rtol=1e-2)
+        assert np.allclose(lengths, 2*np.pi*r, rtol=1e-2)
+
+
+def test_circles_near_nodes():
+    nodes, elems = square_mesh()
+    extractor = LevelSetExtractor(nodes, elems)
+    vals = disks(nodes, np.array([(-0.5, 0.), (0.5, 0.)]), 0.3)
+    on_level = vals == 0.
+    vals[on_level] = 1e-15*np.where(np.arange(np.sum(on_level)) % 2, 1., -1.)
+    paths, lengths, areas = extractor.measure(vals)
+    assert len(paths) == 2
+    assert np.allclose(areas, np.pi*0.3**2, rtol=1e-2)
+
+
+def test_line_along_nodes():
+    nodes, elems = square_mesh(n=11)
+    paths = LevelSetExtractor(nodes, elems)(nodes[:, 1])
+    assert len(paths) == 1
+    path = paths[0]
+    assert np.allclose(path[:, 1], 0.)
+    # The region below the level, y < 0, is on the left.
+    assert path[0, 0] > path[-1, 0]
+    assert np.allclose(path_lengths(paths), 2.)
+
+
+def test_path_areas_orientation():
+    square = np.array([[0., 0.], [1., 0.], [1., 1.], [0., 1.], [0., 0.]])
+    assert np.allclose(path_areas([square, square[::-1]]), [1., -1.])
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from obstacle_placement import min_image, pairs_brute_force, \
+    pairs_cell_list, place_obstacles
+
+
+def check_placement(obstacles, Lx, Ly, R):
+    pts = np.array(obstacles)
+    L = np.array([Lx, Ly])
+    # Inside the periodic box, and not overlapping any periodic image.
+    assert np.all(np.abs(pts) <= L/2)
+    dist = min_image(pts[:, None, :]-pts[None, :, :], L)
+    dist2 = np.sum(dist**2, axis=2)
+    np.fill_diagonal(dist2, np.inf)
+    assert np.all(dist2 > 4*R**2)
+    assert np.all(np.diff(pts[:, 0]) >= 0.)
+
+
+@pytest.mark.parametrize("mode", ["sequential", "rsa", "relax"])
+def test_place_obstacles(mode):
+    Lx, Ly, R = 4., 3., 0.2
+    np.random.seed(123)
+    obstacles, num_attempts = place_obstacles(40, Lx, Ly, R, mode)
+    assert len(obstacles) == 40
+    check_placement(obstacles, Lx, Ly, R)
+
+    np.random.seed(123)
+    assert place_obstacles(40, Lx, Ly, R, mode)[0] == obstacles
+
+
+def test_place_obstacles_dense():
+    # Beyond the jamming limit of random sequential adsorption.
+    N, R = 200, 0.02
+    np.random.seed(1)
+    obstacles, _ = place_obstacles(N, 1., 1., R, "relax")
+    check_placement(obstacles, 1., 1., R)
+    assert N*np.pi*R**2 > 0.24
+
+
+def test_place_obstacles_budget():
+    np.random.seed(1)
+    with pytest.raises(RuntimeError):
+        place_obstacles(100, 1., 1., 0.1, "sequential", max_attempts=1000)
+
+
+def test_pairs_cell_list():
+    L = np.array([3., 2.])
+    np.random.seed(2)
+    pts = (np.random.rand(300, 2)-0.5)*L
+    pairs_a = set(map(tuple, pairs_cell_list(pts, L, 0.3)))
+    pairs_b = set(map(tuple, pairs_brute_force(pts, L, 0.3)))
+    assert pairs_a == pairs_b
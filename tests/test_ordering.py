@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+df = pytest.importorskip("dolfin")
+from common.ordering import fill_mesh, fill_mesh_editor, reorder_arrays
+
+
+def test_fill_mesh():
+    nodes = np.array([[0., 0.], [1., 0.], [0., 1.], [1., 1.]])
+    elements = np.array([[0, 1, 3], [0, 3, 2]])
+    meshes = []
+    for fill in [fill_mesh, fill_mesh_editor]:
+        mesh = df.Mesh(df.mpi_comm_self())
+        fill(mesh, nodes, elements)
+        meshes.append(mesh)
+    for mesh in meshes:
+        assert np.allclose(mesh.coordinates(), nodes)
+        assert np.all(np.sort(mesh.cells(), axis=1) ==
+                      np.sort(elements, axis=1))
+
+
+def test_fill_mesh_reordered():
+    mesh = df.UnitSquareMesh(df.mpi_comm_self(), 8, 8)
+    nodes, elements = reorder_arrays(mesh.coordinates(), mesh.cells())
+    mesh_new = df.Mesh(df.mpi_comm_self())
+    fill_mesh(mesh_new, nodes, elements)
+    assert mesh_new.num_cells() == mesh.num_cells()
+    assert np.isclose(df.assemble(df.Constant(1.)*df.dx(mesh_new)), 1.)
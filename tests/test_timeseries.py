@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from node_map import node_indices, row_ids
+
+
+def test_row_ids():
+    x = np.array([[0., 1.], [1., 0.], [0., 1.], [-0., 1.]])
+    ids = row_ids(x)
+    assert ids[0] == ids[2] == ids[3]
+    assert ids[0] != ids[1]
+
+
+def test_node_indices():
+    nodes = np.random.rand(50, 2)
+    nodes[0] = [0., 0.5]
+    order = np.random.permutation(len(nodes))
+    x = nodes[order]
+    x[order == 0, 0] = -0.
+    assert np.all(node_indices(nodes, x) == order)
+
+
+def test_node_indices_unmatched():
+    nodes = np.random.rand(10, 2)
+    with pytest.raises(KeyError):
+        node_indices(nodes, np.vstack((nodes[:3], [[2., 2.]])))
+
+
+def test_node_indices_dofs():
+    df = pytest.importorskip("dolfin")
+    mesh = df.UnitSquareMesh(df.mpi_comm_self(), 6, 5)
+    V = df.FunctionSpace(mesh, "CG", 1)
+    nodes = mesh.coordinates()
+    indices = node_indices(nodes, V.tabulate_dof_coordinates().reshape(-1, 2))
+    # Set the dofs from nodal data, as TimeSeries.set_val does.
+    data = np.random.rand(len(nodes))
+    f = df.Function(V)
+    f.vector().set_local(data[indices])
+    f.vector().apply("insert")
+    assert np.allclose(f.compute_vertex_values(mesh)[:len(nodes)], data)
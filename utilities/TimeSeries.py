@@ -4,11 +4,14 @@ import sys
 from mpi4py import MPI
 import h5py
 import glob
+import copy
 # Find path to the BERNAISE root folder
 bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
 # ...and append it to sys.path to get functionality from BERNAISE
 sys.path.append(bernaise_path)
-from generate_mesh import numpy_to_dolfin
+from generate_mesh import numpy_to_dolfin, numpy_to_dolfin_serial
+from h5reader import DatasetReader
+from node_map import node_indices
 from common import makedirs_safe, info_warning, info_split, info_on_red, \
     load_parameters, parse_xdmf
 import dolfin as df
@@ -18,18 +21,36 @@ comm = MPI.COMM_WORLD
 size = comm.Get_size()
 rank = comm.Get_rank()
 
+# Meshes built from the timeseries of each folder, which are reused by
+# later TimeSeries of the same folder in this process.
+mesh_cache = dict()
+mesh_attributes = ["mesh", "function_space", "vector_function_space",
+                   "dim", "x", "indices"]
+
 
 def get_middle(string, prefix, suffix):
     return string.split(prefix)[1].split(suffix)[0]
 
 
-def prep(x_list):
-    """ Prepare a list representing coordinates to be used as key in a
-    dict. """
-    # M = 10000
-    # x_np = np.ceil(np.array(x_list)*M).astype(float)/M
-    # return tuple(x_np.tolist())
-    return tuple(x_list)
+def nearest_indices(x_sorted, x):
+    """ Returns the indices of the elements of x_sorted that are nearest
+    to the elements of x. """
+    if len(x_sorted) == 1:
+        return np.zeros(len(x), dtype=int)
+    ids = np.clip(np.searchsorted(x_sorted, x), 1, len(x_sorted)-1)
+    left_nearer = x-x_sorted[ids-1] < x_sorted[ids]-x
+    return np.where(left_nearer, ids-1, ids)
+
+
+def read_mesh(address):
+    """ Returns the nodes and elements of the mesh at the given
+    (topology, geometry) addresses in HDF5 files. """
+    (topology_file, topology_dset), (geometry_file, geometry_dset) = address
+    with h5py.File(topology_file, "r") as h5f:
+        elems = np.array(h5f[topology_dset])
+    with h5py.File(geometry_file, "r") as h5f:
+        nodes = np.array(h5f[geometry_dset])
+    return nodes, elems
 
 
 class TimeSeries:
@@ -46,6 +67,9 @@ class TimeSeries:
         self.tmp_folder = os.path.join(folder, ".tmp")
 
         self.memory_modest = memory_modest
+        self.reader = DatasetReader() if memory_modest else None
+        self.last_step = dict()
+        self.comm = comm
 
         self.params_prefix = os.path.join(self.settings_folder,
                                           "parameters_from_tstep_")
@@ -58,8 +82,14 @@ class TimeSeries:
 
         self.times = dict()
         self.datasets = dict()
+        # Mesh of each step of each field, as (topology, geometry)
+        # addresses, or None where it is the mesh of the timeseries.
+        self.step_meshes = dict()
+        self.step_mesh_cache = dict()
+        self.map_functions = dict()
 
         self._load_timeseries(sought_fields)
+        self._load_statistics()
 
         if len(self.fields) > 0:
             self._load_mesh(get_mesh_from)
@@ -70,30 +100,62 @@ class TimeSeries:
             makedirs_safe(self.plots_folder)
             makedirs_safe(self.tmp_folder)
 
-    def _load_mesh(self, get_mesh_from):
-        if not get_mesh_from:
-            self.mesh = numpy_to_dolfin(self.nodes, self.elems)
+    def _load_mesh(self, get_mesh_from, serial=False):
+        self.serial = serial
+        key = (os.path.realpath(self.folder), serial)
+        cached = mesh_cache.get(key)
+        if bool(not get_mesh_from and cached is not None and
+                np.array_equal(cached["nodes"], self.nodes) and
+                np.array_equal(cached["elems"], self.elems)):
+            for attr in mesh_attributes:
+                setattr(self, attr, cached[attr])
+        elif not get_mesh_from:
+            if serial:
+                self.mesh = numpy_to_dolfin_serial(self.nodes, self.elems)
+            else:
+                self.mesh = numpy_to_dolfin(self.nodes, self.elems)
             self.function_space = df.FunctionSpace(self.mesh, "CG", 1)
             self.vector_function_space = df.VectorFunctionSpace(
                 self.mesh, "CG", 1)
             self.dim = self.function_space.mesh().topology().dim()
 
             self.x = self._make_dof_coords()
-            self.xdict = self._make_xdict()
+            self.indices = self._make_indices()
 
-            indices_function = df.Function(self.function_space)
-            self.set_val(indices_function, np.arange(len(self.nodes)))
-            self.indices = np.asarray(indices_function.vector().get_local(),
-                                      dtype=int)
+            mesh_cache[key] = dict(nodes=self.nodes, elems=self.elems)
+            for attr in mesh_attributes:
+                mesh_cache[key][attr] = getattr(self, attr)
         else:
             self.mesh = get_mesh_from.mesh
             self.function_space = get_mesh_from.function_space
             self.vector_function_space = get_mesh_from.vector_function_space
             self.dim = get_mesh_from.dim
             self.x = get_mesh_from.x
-            self.xdict = get_mesh_from.xdict
             self.indices = get_mesh_from.indices
 
+    def serial_copy(self):
+        """ Returns a copy of the timeseries where the mesh lives on the
+        current process only, such that each process can work on its own
+        steps. The datasets are shared with the original. """
+        if self.comm.Get_size() == 1:
+            return self
+        ts = copy.copy(self)
+        ts.comm = MPI.COMM_SELF
+        ts.stats = dict(self.stats)
+        ts.reset_reader()
+        ts._load_mesh(False, serial=True)
+        ts.step_mesh_cache = dict()
+        ts.map_functions = dict()
+        ts.dummy_function = df.Function(ts.function_space)
+        return ts
+
+    def reset_reader(self):
+        """ Start with a fresh reader, e.g. in a serial copy, where the
+        open files of the original are not to be shared. """
+        if self.memory_modest:
+            self.reader = DatasetReader()
+        self.last_step = dict()
+
     def _load_timeseries(self, sought_fields=None):
         if bool(os.path.exists(self.settings_folder) and
                 os.path.exists(self.timeseries_folder)):
@@ -103,67 +165,117 @@ class TimeSeries:
                         "Settings or Timeseries folders.")
             exit()
 
-        data = dict()
         for params_file in glob.glob(
                 self.params_prefix + "*" + self.params_suffix):
             parameters = dict()
-            from_tstep = int(get_middle(params_file,
-                                        self.params_prefix,
-                                        self.params_suffix))
-
             load_parameters(parameters, params_file)
-
             t_0 = float(parameters["t_0"])
-
             self.parameters[t_0] = parameters
 
-            from_tstep_suffix = "_from_tstep_" + str(from_tstep) + ".h5"
-            from_tstep_xml_suffix = "_from_tstep_" + str(from_tstep) + ".xdmf"
-            for xml_file in glob.glob(os.path.join(
-                    self.timeseries_folder, "*" + from_tstep_xml_suffix)):
-
-                data_file = xml_file[:-4] + "h5"
-                field = get_middle(data_file,
-                                   self.timeseries_folder + "/",
-                                   from_tstep_suffix)
-
-                if bool(sought_fields is None or
-                        field in sought_fields):
-                    if bool(field not in data):
-                        data[field] = dict()
-
-                    dsets, topology_address, geometry_address \
-                        = parse_xdmf(xml_file, get_mesh_address=True)
-
-                    if self.elems is None:
-                        with h5py.File(topology_address[0], "r") as h5f:
-                            self.elems = np.array(h5f[topology_address[1]])
-
-                    if self.nodes is None:
-                        with h5py.File(geometry_address[0], "r") as h5f:
-                            self.nodes = np.array(h5f[geometry_address[1]])
-
-                    with h5py.File(data_file, "r") as h5f:
-                        for time, dset_address in dsets:
-                            # If in memory saving mode, only store
-                            # address for later use.
-                            if self.memory_modest:
-                                data[field][time] = (data_file, dset_address)
-                            else:
-                                data[field][time] = np.array(h5f[dset_address])
+        # New timeseries files are started at restarts and whenever the
+        # mesh is adapted. Later files override earlier ones.
+        xml_files = sorted(
+            glob.glob(os.path.join(self.timeseries_folder,
+                                   "*_from_tstep_*.xdmf")),
+            key=lambda f: int(get_middle(f, "_from_tstep_", ".xdmf")))
+        data = dict()
+        for xml_file in xml_files:
+            data_file = xml_file[:-4] + "h5"
+            field = os.path.basename(xml_file).split("_from_tstep_")[0]
+
+            if bool(sought_fields is None or
+                    field in sought_fields):
+                if bool(field not in data):
+                    data[field] = dict()
+
+                dsets, topology_address, geometry_address \
+                    = parse_xdmf(xml_file, get_mesh_address=True)
+                mesh_address = (tuple(topology_address),
+                                tuple(geometry_address))
+
+                with h5py.File(data_file, "r") as h5f:
+                    for time, dset_address in dsets:
+                        # If in memory saving mode, only store
+                        # address for later use.
+                        if self.memory_modest:
+                            dset = (data_file, dset_address)
+                        else:
+                            dset = np.array(h5f[dset_address])
+                        data[field][time] = (dset, mesh_address)
 
         for i, field in enumerate(data.keys()):
             tmps = sorted(data[field].items())
             if i == 0:
                 self.times = [tmp[0] for tmp in tmps]
-            self[field] = [tmp[1] for tmp in tmps]
+            self[field] = [tmp[1][0] for tmp in tmps]
+            self.step_meshes[field] = [tmp[1][1] for tmp in tmps]
+        self._load_step_meshes()
         self.parameters = sorted(self.parameters.items())
         self.fields = self.datasets.keys()
 
-    def _make_dof_coords(self):
-        dofmap = self.function_space.dofmap()
+    def _load_step_meshes(self):
+        """ Load the mesh of the first step, and find the steps that are
+        on other meshes, e.g. in runs with adaptive mesh refinement. """
+        addresses = set()
+        for field in self.step_meshes:
+            addresses.update(self.step_meshes[field])
+        if not addresses:
+            return
+        first_field = self.step_meshes.keys()[0]
+        self.nodes, self.elems = read_mesh(
+            self.step_meshes[first_field][0])
+
+        other_meshes = set()
+        for address in addresses:
+            nodes, elems = read_mesh(address)
+            if not (np.array_equal(nodes, self.nodes) and
+                    np.array_equal(elems, self.elems)):
+                other_meshes.add(address)
+        for field in self.step_meshes:
+            self.step_meshes[field] = [
+                address if address in other_meshes else None
+                for address in self.step_meshes[field]]
+        if other_meshes:
+            info_split("Meshes:", "{} (the steps on other meshes are "
+                       "interpolated onto the first)".format(
+                           len(other_meshes)+1))
+
+    def _load_statistics(self):
+        """ Load the statistics index written during the simulation, for
+        the fields where it covers all steps. """
+        self.stats = dict()
+        times = np.array(self.times, dtype=float)
+        for field in self.fields:
+            prefix = os.path.join(self.statistics_folder,
+                                  field + "_from_tstep_")
+            stats_files = sorted(
+                glob.glob(prefix + "*.dat"),
+                key=lambda f: int(get_middle(f, prefix, ".dat")))
+            # Later runs (restarts) override earlier ones.
+            rows = dict()
+            for stats_file in stats_files:
+                for row in np.loadtxt(stats_file, ndmin=2):
+                    rows[row[0]] = row[1:]
+            if len(rows) < len(times) or len(times) == 0:
+                continue
+            rows_times = np.array(sorted(rows.keys()))
+            ids = nearest_indices(rows_times, times)
+            if np.any(np.abs(rows_times[ids]-times) >
+                      1e-6*np.maximum(np.abs(times), 1.)):
+                continue
+            data = np.array([rows[time] for time in rows_times[ids]])
+            num_components = (data.shape[1]-1)/4
+            self.stats[field] = dict(
+                (key, data[:, i*num_components:(i+1)*num_components])
+                for i, key in enumerate(["min", "max", "mean", "integral"]))
+            self.stats[field]["L2"] = data[:, -1]
+
+    def _make_dof_coords(self, space=None):
+        if space is None:
+            space = self.function_space
+        dofmap = space.dofmap()
         my_first, my_last = dofmap.ownership_range()
-        x = self.function_space.tabulate_dof_coordinates().reshape(
+        x = space.tabulate_dof_coordinates().reshape(
             (-1, self.dim))
         unowned = dofmap.local_to_global_unowned()
         dofs = filter(lambda dof: dofmap.local_to_global_index(dof)
@@ -172,33 +284,61 @@ class TimeSeries:
         x = x[dofs]
         return x
 
-    def _make_xdict(self):
-        if rank == 0:
-            xdict = dict([(prep(list(x_list)), i) for i, x_list in
-                          enumerate(self.nodes.tolist())])
-        else:
-            xdict = None
-        xdict = comm.bcast(xdict, root=0)
-        return xdict
-
-    def set_val(self, f, f_data):
+    def _make_indices(self):
+        """ Returns the node index of each locally owned dof, found by
+        matching the dof coordinates to the node coordinates. """
+        return node_indices(self.nodes, self.x)
+
+    def _step_mesh(self, address):
+        """ Returns the function spaces and dof indices of a mesh that
+        some steps are on. """
+        if address not in self.step_mesh_cache:
+            nodes, elems = read_mesh(address)
+            if self.serial:
+                mesh = numpy_to_dolfin_serial(nodes, elems)
+            else:
+                mesh = numpy_to_dolfin(nodes, elems)
+            space = df.FunctionSpace(mesh, "CG", 1)
+            vector_space = df.VectorFunctionSpace(mesh, "CG", 1)
+            self.step_mesh_cache[address] = dict(
+                function_space=space,
+                indices=node_indices(nodes, self._make_dof_coords(space)),
+                dummy_function=df.Function(space),
+                function=df.Function(space),
+                vector_function=df.Function(vector_space))
+        return self.step_mesh_cache[address]
+
+    def set_val(self, f, f_data, indices=None):
+        if indices is None:
+            indices = self.indices
         vec = f.vector()
-        values = vec.get_local()
-        values[:] = [f_data[self.xdict[prep(x_val)]]
-                     for x_val in self.x.tolist()]
-        vec.set_local(values)
+        vec.set_local(np.asarray(f_data, dtype=float)[indices])
         vec.apply('insert')
 
-    def update(self, f, field, step):
-        """ Set dolfin vector f with values from field. """
+    def _set_data(self, f, field, data, indices, dummy_function):
         if field == "u":
-            u_data = self["u", step][:, :self.dim]
+            u_data = data[:, :self.dim]
             for i in range(self.dim):
-                self.set_val(self.dummy_function, u_data[:, i])
-                df.assign(f.sub(i), self.dummy_function)
+                self.set_val(dummy_function, u_data[:, i], indices)
+                df.assign(f.sub(i), dummy_function)
         else:
-            f_data = self[field, step][:]
-            self.set_val(f, f_data)
+            self.set_val(f, data[:], indices)
+
+    def _update(self, f, field, step, data):
+        address = self.step_meshes[field][step]
+        if address is None:
+            self._set_data(f, field, data, self.indices, self.dummy_function)
+        else:
+            step_mesh = self._step_mesh(address)
+            g = step_mesh["vector_function" if field == "u" else "function"]
+            self._set_data(g, field, data, step_mesh["indices"],
+                           step_mesh["dummy_function"])
+            df.LagrangeInterpolator.interpolate(f, g)
+
+    def update(self, f, field, step):
+        """ Set dolfin vector f with values from field. Steps on another
+        mesh than the timeseries are interpolated. """
+        self._update(f, field, step, self._read(field, step))
 
     def update_all(self, f, step):
         """ Set dict f of dolfin functions with values from all fields. """
@@ -230,12 +370,39 @@ class TimeSeries:
             return self.datasets[key]
         if len(key) == 2:
             field, step = key
-            if self.memory_modest:
-                data_file, dset_address = self.datasets[field][step]
-                with h5py.File(data_file, "r") as h5f:
-                    return np.array(h5f[dset_address])
-            else:
-                return self.datasets[field][step]
+            data = self._read(field, step)
+            if self.step_meshes[field][step] is not None:
+                data = self._map_to_nodes(field, step, data)
+            return data
+
+    def _read(self, field, step):
+        """ Returns the data of field at step, on the mesh of the step. """
+        if self.memory_modest:
+            data_file, dset_address = self.datasets[field][step]
+            # Read ahead when the steps of a field are scanned in order.
+            if self.last_step.get(field) == step-1:
+                depth = self.reader.prefetch_depth
+                self.reader.prefetch(
+                    self.datasets[field][step+1:step+1+depth])
+            self.last_step[field] = step
+            # The files of added fields may be rewritten, so their data
+            # is not memory mapped.
+            copy = os.path.dirname(data_file) == self.tmp_folder
+            return self.reader.read(data_file, dset_address, copy)
+        return self.datasets[field][step]
+
+    def _map_to_nodes(self, field, step, data):
+        """ Interpolate the data of a step on another mesh onto the nodes
+        of the timeseries. """
+        if field not in self.map_functions:
+            self.map_functions[field] = self.function(field)
+        f = self.map_functions[field]
+        self._update(f, field, step, data)
+        values = self.nodal_values(f)
+        data_mapped = np.zeros((len(self.nodes),) + data.shape[1:])
+        data_mapped.reshape((len(self.nodes), -1))[:, :values.shape[1]] \
+            = values
+        return data_mapped
 
     def __setitem__(self, key, val):
         self.datasets[key] = val
@@ -290,20 +457,33 @@ class TimeSeries:
                          for step in range(len(self))])
 
     def max(self, field):
+        if field in self.stats:
+            return np.max(self.stats[field]["max"])
         return self._operate(np.max, field)
 
     def min(self, field):
+        if field in self.stats:
+            return np.min(self.stats[field]["min"])
         return self._operate(np.min, field)
 
     def mean(self, field):
+        if field in self.stats:
+            return np.mean(self.stats[field]["mean"])
         return self._operate(np.mean, field)
 
+    def get_statistics(self, field, key):
+        """ Returns the statistic key ("min", "max", "mean", "integral" or
+        "L2") of field at each step, or None if it is not in the index. """
+        return self.stats.get(field, dict()).get(key, None)
+
     def add_field(self, field, datasets):
         if self.memory_modest:
             data_file = os.path.join(self.tmp_folder,
                                      field + ".h5")
             self[field] = [(data_file, field + "/" + str(step))
                            for step in range(len(datasets))]
+            self.reader.close(data_file)
+            comm.Barrier()
             if rank == 0:
                 with h5py.File(data_file, "w") as h5f:
                     for step, dataset in enumerate(datasets):
@@ -312,7 +492,12 @@ class TimeSeries:
             comm.Barrier()
         else:
             self[field] = datasets
+        self.step_meshes[field] = [None]*len(datasets)
         self.fields = self.datasets.keys()
+        self.stats[field] = dict(
+            min=np.array([np.min(dataset, 0) for dataset in datasets]),
+            max=np.array([np.max(dataset, 0) for dataset in datasets]),
+            mean=np.array([np.mean(dataset, 0) for dataset in datasets]))
 
     def compute_charge(self):
         """ Computing charge datasets by summing over all species. """
@@ -335,8 +520,7 @@ class TimeSeries:
 
         arr = np.zeros((len(self.nodes), fdim))
         arr_loc = np.zeros_like(arr)
-        for i, fval in zip(self.indices, farray):
-            arr_loc[i, :] = fval
-        comm.Allreduce(arr_loc, arr, op=MPI.SUM)
+        arr_loc[self.indices, :] = farray
+        self.comm.Allreduce(arr_loc, arr, op=MPI.SUM)
 
         return arr
@@ -8,46 +8,87 @@ Mesh generating functions in BERNAISE.
 Usage:
 python generate_mesh.py mesh={mesh generating function} [+optional arguments]
 
+To generate the mesh at several resolutions, e.g. for a convergence study,
+give a resolution ladder:
+python generate_mesh.py mesh=snoevsen ladder=[30,60,120]
+For mesh scripts that build their meshes from arrays, such as
+periodic_porous_2d, the levels are built in parallel on the MPI ranks:
+mpiexec -n 3 python generate_mesh.py mesh=periodic_porous_2d \
+    ladder=[0.1,0.05,0.025]
+
+Add reorder=rcm or reorder=hilbert to renumber the vertices and cells of
+the stored meshes, for a smaller matrix bandwidth and better locality.
+
 """
 import mshr  # must be imported before dolfin!
 import dolfin as df
 import numpy as np
 import os
 import sys
+import time
+import simplejson as json
 # Find path to the BERNAISE root folder
 bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
 # ...and append it to sys.path to get functionality from BERNAISE
 sys.path.append(bernaise_path)
-from common import parse_command_line, info, info_on_red, \
-    remove_safe
+from common import parse_command_line, info, info_on_red
+from common.ordering import fill_mesh, reorder_mesh
 from mpi4py.MPI import COMM_WORLD
 import meshpy.triangle as tri
 from plot import plot_edges, plot_faces
-import h5py
 from utilities import get_methods, get_help
 
 
 # Directory to store meshes in
 MESHES_DIR = os.path.join(bernaise_path, "meshes/")
 
-__all__ = ["store_mesh_HDF5", "numpy_to_dolfin", "plot_faces",
-           "plot_edges"]
+__all__ = ["store_mesh_HDF5", "numpy_to_dolfin", "numpy_to_dolfin_serial",
+           "plot_faces", "plot_edges"]
 
 
 comm = COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
-
-def store_mesh_HDF5(mesh, meshpath, save_xdmf=False):
+# Paths, element counts and quality of the meshes stored by this process
+stored_meshes = []
+# Reordering of the meshes before they are stored, see common/ordering.py
+store_options = dict(reorder=None)
+# Build the meshes on the current process only, see generate_ladder
+build_options = dict(serial=False)
+# Geometry shared between the levels of a ladder, see cached_geometry
+geometry_cache = dict()
+
+
+def mesh_quality(mesh):
+    """ Returns the element counts and quality metrics of the mesh. """
+    comm_mesh = mesh.mpi_comm()
+    rr_min, rr_max = df.MeshQuality.radius_ratio_min_max(mesh)
+    return dict(num_vertices=int(mesh.num_entities_global(0)),
+                num_cells=int(mesh.num_entities_global(
+                    mesh.topology().dim())),
+                hmin=df.MPI.min(comm_mesh, mesh.hmin()),
+                hmax=df.MPI.max(comm_mesh, mesh.hmax()),
+                radius_ratio_min=rr_min,
+                radius_ratio_max=rr_max)
+
+
+def store_mesh_HDF5(mesh, meshpath, save_xdmf=False, reorder=None):
     '''
     Function that stores generated mesh in both "HDMF5"
     (.h5) format and in "XDMF" (.XMDF) format.
+    The mesh is first reordered if reorder is "rcm" or "hilbert",
+    by default as given by reorder=... on the command line.
     '''
+    if reorder is None:
+        reorder = store_options["reorder"]
+    if reorder:
+        mesh = reorder_mesh(mesh, reorder)
     meshpath_hdf5 = meshpath + ".h5"
     with df.HDF5File(mesh.mpi_comm(), meshpath_hdf5, "w") as hdf5:
         info("Storing mesh: {}".format(meshpath_hdf5))
         hdf5.write(mesh, "mesh")
+    stored_meshes.append(dict(path=meshpath_hdf5, **mesh_quality(mesh)))
     if save_xdmf:
         meshpath_xdmf = meshpath + "_xdmf.xdmf"
         xdmff = df.XDMFFile(mesh.mpi_comm(), meshpath_xdmf)
@@ -142,32 +183,38 @@ def numpy_to_dolfin_old(nodes, elements):
 
 
 def numpy_to_dolfin(nodes, elements):
-    """ Convert nodes and elements to a dolfin mesh object. """
-    tmpfile = "tmp.h5"
-
+    """ Convert nodes and elements to a dolfin mesh object. The mesh is
+    built in memory on the root process, and then distributed over all
+    processes, unless the meshes are built serially (see
+    generate_ladder). """
+    if build_options["serial"]:
+        return numpy_to_dolfin_serial(nodes, elements)
+    mesh = df.Mesh()
     if rank == 0:
-        with h5py.File(tmpfile, "w") as h5f:
-            cell_indices = h5f.create_dataset(
-                "mesh/cell_indices", data=np.arange(len(elements)),
-                dtype='int64')
-            topology = h5f.create_dataset(
-                "mesh/topology", data=elements, dtype='int64')
-            coordinates = h5f.create_dataset(
-                "mesh/coordinates", data=nodes, dtype='float64')
-            topology.attrs["celltype"] = np.string_("triangle")
-            topology.attrs["partition"] = np.array([0], dtype='uint64')
+        fill_mesh(mesh, nodes, elements)
+    else:
+        fill_mesh(mesh, np.asarray(nodes)[:0], np.asarray(elements)[:0])
+    if size > 1:
+        df.MeshPartitioning.build_distributed_mesh(mesh)
+    return mesh
 
-    comm.Barrier()
 
-    mesh = df.Mesh()
-    h5f = df.HDF5File(mesh.mpi_comm(), tmpfile, "r")
-    h5f.read(mesh, "mesh", False)
-    h5f.close()
+def numpy_to_dolfin_serial(nodes, elements):
+    """ Convert nodes and elements to a dolfin mesh object that lives on
+    the current process only. """
+    mesh = df.Mesh(df.mpi_comm_self())
+    fill_mesh(mesh, nodes, elements)
+    return mesh
 
-    comm.Barrier()
 
-    remove_safe(tmpfile)
-    return mesh
+def cached_geometry(key, func, *args, **kwargs):
+    """ Returns func(*args, **kwargs), which is only computed once per
+    key in this process. The mesh scripts use this for the parts of the
+    geometry that do not depend on the resolution, such that all levels
+    of a ladder share e.g. the same obstacles. """
+    if key not in geometry_cache:
+        geometry_cache[key] = func(*args, **kwargs)
+    return geometry_cache[key]
 
 
 def call_method(method, methods, scripts_folder, cmd_kwargs):
@@ -183,6 +230,106 @@ def call_method(method, methods, scripts_folder, cmd_kwargs):
         info_on_red("The specified mesh generation method doesn't exist.")
 
 
+def resolution_key(func):
+    """ The argument of a mesh generating function that sets its
+    resolution. """
+    varnames = func.__code__.co_varnames[:func.__code__.co_argcount]
+    for key in ["res", "dx"]:
+        if key in varnames:
+            return key
+    return None
+
+
+def generate_level(task):
+    """ Generate the mesh of one level of a resolution ladder. Returns the
+    meshes that were stored. """
+    method, scripts_folder, kwargs = task
+    # The mesh scripts store their meshes through the imported module,
+    # which is not __main__ when this file is run as a script.
+    from generate_mesh import stored_meshes, build_options
+    m = __import__("{}.{}".format(scripts_folder, method)).__dict__[method]
+    del stored_meshes[:]
+    t_0 = time.time()
+    build_options["serial"] = bool(size > 1 and
+                                   getattr(m, "serial_levels", False))
+    try:
+        m.method(**kwargs)
+    finally:
+        build_options["serial"] = False
+    elapsed = time.time() - t_0
+    return [dict(stored, time=elapsed) for stored in stored_meshes]
+
+
+def generate_ladder(method, methods, scripts_folder, cmd_kwargs):
+    """ Generate the mesh at each level of a resolution ladder, and write
+    a manifest with the element counts and quality of each level.
+
+    If the mesh script sets serial_levels = True, i.e. it builds its
+    meshes from arrays through numpy_to_dolfin, the levels are
+    distributed over the MPI ranks, and each level is built and stored
+    on its rank only. Otherwise, e.g. for meshes generated by mshr, all
+    ranks build each level together. The levels share the geometry
+    that the script caches with cached_geometry. """
+    if method not in methods:
+        info_on_red("The specified mesh generation method doesn't exist.")
+        return
+    m = __import__("{}.{}".format(scripts_folder, method)).__dict__[method]
+
+    kwargs = dict(cmd_kwargs)
+    ladder = kwargs.pop("ladder")
+    if not isinstance(ladder, list):
+        ladder = [ladder]
+    key = kwargs.pop("ladder_key", resolution_key(m.method))
+    if key is None:
+        info_on_red("Could not find the resolution argument of {}. "
+                    "Specify it with ladder_key=...".format(method))
+        return
+    kwargs.setdefault("do_plot", False)
+
+    tasks = []
+    for level in ladder:
+        level_kwargs = dict(kwargs)
+        level_kwargs[key] = level
+        tasks.append((method, scripts_folder, level_kwargs))
+
+    if size > 1 and getattr(m, "serial_levels", False):
+        info("Generating {} levels of {} with {}={} on {} processes."
+             .format(len(ladder), method, key, ladder, size))
+        results = [(k, generate_level(tasks[k]))
+                   for k in range(rank, len(tasks), size)]
+        results = dict(sum(comm.allgather(results), []))
+        results = [results[k] for k in range(len(tasks))]
+    else:
+        info("Generating {} levels of {} with {}={}.".format(
+            len(ladder), method, key, ladder))
+        results = [generate_level(task) for task in tasks]
+
+    levels = [dict(level=level, meshes=meshes)
+              for level, meshes in zip(ladder, results)]
+    paths = [stored["path"] for meshes in results for stored in meshes]
+    if len(set(paths)) < len(paths):
+        info_on_red("Some levels were stored to the same path, "
+                    "and were overwritten.")
+
+    for level in levels:
+        for stored in level["meshes"]:
+            info("{}={:<8} cells: {:<9} hmin: {:.3e} hmax: {:.3e} "
+                 "radius ratio: {:.3f}  {}".format(
+                     key, level["level"], stored["num_cells"],
+                     stored["hmin"], stored["hmax"],
+                     stored["radius_ratio_min"],
+                     os.path.basename(stored["path"])))
+
+    if rank == 0:
+        manifest_path = os.path.join(MESHES_DIR, "{}_{}_ladder.json".format(
+            method, key))
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(dict(mesh=method, key=key, parameters=kwargs,
+                           levels=levels),
+                      manifest_file, indent=4*" ")
+        info("Manifest: {}".format(manifest_path))
+
+
 def main():
     cmd_kwargs = parse_command_line()
 
@@ -196,7 +343,15 @@ def main():
     if cmd_kwargs.get("help", False):
         get_help(methods, scripts_folder, __file__)
 
-    call_method(method, methods, scripts_folder, cmd_kwargs)
+    if cmd_kwargs.get("reorder", False):
+        # The mesh scripts store their meshes through the imported module
+        from generate_mesh import store_options
+        store_options["reorder"] = cmd_kwargs["reorder"]
+
+    if "ladder" in cmd_kwargs:
+        generate_ladder(method, methods, scripts_folder, cmd_kwargs)
+    else:
+        call_method(method, methods, scripts_folder, cmd_kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+"""
+This module contains a reader for the HDF5 datasets of a timeseries,
+used by TimeSeries in memory_modest mode.
+"""
+import threading
+import Queue
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+__author__ = "Gaute Linga"
+
+
+class DatasetReader:
+    """ Reads datasets from HDF5 files.
+
+    Files are kept open in a pool of at most max_open_files handles,
+    where the least recently used file is closed when the pool is full.
+    Contiguous, uncompressed datasets are returned as copy-on-write
+    memory maps of the file, i.e. without copying, unless a copy is
+    requested; other datasets are read through the HDF5 chunk cache.
+    A file must not be rewritten while memory maps of it are in use,
+    so files that may be rewritten should always be read with copies.
+
+    Datasets requested by prefetch() are read into memory by a
+    background thread, such that they are ready when they are needed.
+    """
+    def __init__(self, max_open_files=16, prefetch_depth=2,
+                 chunk_cache_size=16*1024**2):
+        self.max_open_files = max_open_files
+        self.prefetch_depth = prefetch_depth
+        self.chunk_cache_size = chunk_cache_size
+        self.files = OrderedDict()
+        self.cache = OrderedDict()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def _open(self, data_file):
+        """ Returns open file handle, from the pool if possible.
+        Must be called with the lock held. """
+        if data_file in self.files:
+            h5f = self.files.pop(data_file)
+        else:
+            if len(self.files) >= self.max_open_files:
+                _, h5f_old = self.files.popitem(last=False)
+                h5f_old.close()
+            try:
+                h5f = h5py.File(data_file, "r",
+                                rdcc_nbytes=self.chunk_cache_size)
+            except TypeError:
+                # Older h5py versions do not expose the chunk cache.
+                h5f = h5py.File(data_file, "r")
+        self.files[data_file] = h5f
+        return h5f
+
+    def _read(self, data_file, dset_address, copy=False):
+        with self.lock:
+            dset = self._open(data_file)[dset_address]
+            offset = dset.id.get_offset()
+            if bool(not copy and offset is not None and
+                    dset.chunks is None and dset.compression is None):
+                return np.memmap(data_file, dtype=dset.dtype, mode="c",
+                                 offset=offset,
+                                 shape=dset.shape).view(np.ndarray)
+            data = np.empty(dset.shape, dtype=dset.dtype)
+            if data.size > 0:
+                dset.read_direct(data)
+            return data
+
+    def read(self, data_file, dset_address, copy=False):
+        """ Returns the dataset at dset_address in data_file, read into
+        memory if copy is True. """
+        key = (data_file, dset_address)
+        with self.lock:
+            data = self.cache.pop(key, None)
+            is_pending = key in self.pending
+        if data is None and is_pending:
+            # Wait for the prefetcher rather than reading twice.
+            self.queue.join()
+            with self.lock:
+                data = self.cache.pop(key, None)
+        if data is None:
+            data = self._read(data_file, dset_address, copy)
+        return data
+
+    def prefetch(self, keys):
+        """ Read the given (data_file, dset_address) pairs in the
+        background. """
+        with self.lock:
+            keys = [key for key in keys[:self.prefetch_depth]
+                    if key not in self.cache and key not in self.pending]
+            self.pending.update(keys)
+        if not keys:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._prefetch_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        for key in keys:
+            self.queue.put(key)
+
+    def _prefetch_loop(self):
+        while True:
+            key = self.queue.get()
+            try:
+                data = self._read(*key, copy=True)
+            except (IOError, KeyError):
+                data = None
+            with self.lock:
+                self.pending.discard(key)
+                if data is not None:
+                    self.cache[key] = data
+                    while len(self.cache) > 2*self.prefetch_depth:
+                        self.cache.popitem(last=False)
+            self.queue.task_done()
+
+    def close(self, data_file=None):
+        """ Close data_file, or all files if not given, and forget the
+        datasets read from it. Must be called before a file is
+        rewritten, which is only safe if it has been read with
+        copies. """
+        self.queue.join()
+        with self.lock:
+            for key in self.cache.keys():
+                if data_file is None or key[0] == data_file:
+                    del self.cache[key]
+            for name in self.files.keys():
+                if data_file is None or name == data_file:
+                    self.files.pop(name).close()
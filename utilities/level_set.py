@@ -0,0 +1,152 @@
+"""
+Extraction of level sets of nodal fields on triangle meshes by marching
+triangles, e.g. the phase boundary phi = 0.
+"""
+import numpy as np
+
+__author__ = "Gaute Linga"
+
+__all__ = ["LevelSetExtractor", "zero_level_set", "path_lengths",
+           "path_areas"]
+
+
+def path_lengths(paths):
+    """ Length of each polyline. """
+    return np.array([np.sum(np.sqrt(np.sum(np.diff(x, axis=0)**2, axis=1)))
+                     for x in paths])
+
+
+def path_areas(paths):
+    """ Signed area enclosed by each polyline, positive if it runs
+    counter-clockwise. Open polylines, e.g. ending on the boundary of the
+    domain, are closed by the straight line between their ends. """
+    return np.array([0.5*np.sum(x[:, 0]*np.roll(x[:, 1], -1) -
+                                np.roll(x[:, 0], -1)*x[:, 1])
+                     for x in paths])
+
+
+class LevelSetExtractor:
+    """ Extracts level sets of nodal values on a triangle mesh.
+
+    The edges of the mesh are found once, such that extracting the level
+    set of a snapshot only takes a few vectorized operations, plus a
+    walk along the cut edges to connect the segments into polylines.
+    """
+    def __init__(self, nodes, elems):
+        self.nodes = np.asarray(nodes, dtype=float)[:, :2]
+        elems = np.asarray(elems, dtype=int)
+        edges = np.sort(elems[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+        edge_keys = edges[:, 0]*len(self.nodes) + edges[:, 1]
+        _, first, edge_ids = np.unique(edge_keys, return_index=True,
+                                       return_inverse=True)
+        self.edges = edges[first]
+        self.elem_edges = edge_ids.reshape(-1, 3)
+        self.elem_nodes = elems
+
+    def __call__(self, vals, level=0.):
+        """ Returns the level set as a list of polylines, i.e. arrays of
+        points. Closed polylines end with their first point. The polylines
+        run counter-clockwise around the regions below the level. """
+        vals = np.asarray(vals, dtype=float).ravel() - level
+        above = vals > 0.
+        a, b = self.edges[:, 0], self.edges[:, 1]
+        cut = above[a] != above[b]
+
+        # Crossing points on the cut edges. Crossings on a node with its
+        # value exactly at the level are merged into one point per node,
+        # such that they do not give segments of zero length.
+        cut_edges = np.flatnonzero(cut)
+        a, b = a[cut_edges], b[cut_edges]
+        s = vals[a]/(vals[a]-vals[b])
+        keys = cut_edges + len(self.nodes)
+        keys[s == 0.] = a[s == 0.]
+        keys[s == 1.] = b[s == 1.]
+        _, first, point_ids = np.unique(keys, return_index=True,
+                                        return_inverse=True)
+        points = (self.nodes[a] + s[:, None]*(self.nodes[b]-self.nodes[a])
+                  )[first]
+        point_of_edge = -np.ones(len(self.edges), dtype=int)
+        point_of_edge[cut_edges] = point_ids
+
+        # Each crossed triangle has exactly two cut edges, which gives
+        # a segment between their crossing points.
+        elem_cut = cut[self.elem_edges]
+        crossed = elem_cut.any(axis=1)
+        segments = point_of_edge[
+            self.elem_edges[crossed][elem_cut[crossed]]].reshape(-1, 2)
+
+        # Orient the segments such that the values above the level are
+        # on their right hand side. The nodes above the level are
+        # strictly off the segment, unlike those at the level.
+        elems_above = above[self.elem_nodes[crossed]]
+        x_above = (np.sum(self.nodes[self.elem_nodes[crossed]] *
+                          elems_above[:, :, None], axis=1) /
+                   np.sum(elems_above, axis=1)[:, None])
+        dx_seg = points[segments[:, 1]] - points[segments[:, 0]]
+        dx_above = x_above - points[segments[:, 0]]
+        flip = dx_seg[:, 0]*dx_above[:, 1] - dx_seg[:, 1]*dx_above[:, 0] > 0.
+        segments[flip] = segments[flip, ::-1]
+        # Triangles touching the level only at a node give no segment.
+        segments = segments[segments[:, 0] != segments[:, 1]]
+        return self._connect(points, segments)
+
+    def _connect(self, points, segments):
+        """ Chain directed segments into polylines. """
+        num_points = len(points)
+        forward = -np.ones(num_points, dtype=int)
+        forward[segments[:, 0]] = segments[:, 1]
+        src = np.concatenate((segments[:, 0], segments[:, 1]))
+        dst = np.concatenate((segments[:, 1], segments[:, 0]))
+        order = np.argsort(src, kind="mergesort")
+        src, dst = src[order], dst[order]
+        first = np.ones(len(src), dtype=bool)
+        first[1:] = src[1:] != src[:-1]
+        neighbors = -np.ones((num_points, 2), dtype=int)
+        neighbors[src[first], 0] = dst[first]
+        neighbors[src[~first], 1] = dst[~first]
+        degree = np.sum(neighbors >= 0, axis=1)
+
+        visited = np.zeros(num_points, dtype=bool)
+        paths = []
+        # Open polylines start at a point with a single neighbor.
+        for start in np.concatenate((np.flatnonzero(degree == 1),
+                                     np.arange(num_points))):
+            if visited[start]:
+                continue
+            path = [start]
+            visited[start] = True
+            prev, current = -1, start
+            while True:
+                n_0, n_1 = neighbors[current]
+                following = n_0 if n_0 != prev else n_1
+                if following < 0 or visited[following]:
+                    if following == start and len(path) > 2:
+                        path.append(start)
+                    break
+                path.append(following)
+                visited[following] = True
+                prev, current = current, following
+            # Run along the majority of the directed segments.
+            path = np.array(path)
+            num_forward = np.sum(forward[path[:-1]] == path[1:])
+            if 2*num_forward < len(path)-1:
+                path = path[::-1]
+            paths.append(points[path])
+        return paths
+
+    def measure(self, vals, level=0.):
+        """ Returns the polylines of the level set, and their lengths and
+        enclosed areas. """
+        paths = self(vals, level)
+        return paths, path_lengths(paths), path_areas(paths)
+
+    def batch(self, vals, level=0.):
+        """ Measure the level sets of several snapshots, given as an array
+        with one row of nodal values per snapshot. """
+        return [self.measure(vals_i, level) for vals_i in vals]
+
+
+def zero_level_set(nodes, elems, vals):
+    """ Returns the zero level set of the nodal values vals, as a list of
+    polylines. """
+    return LevelSetExtractor(nodes, elems)(vals)
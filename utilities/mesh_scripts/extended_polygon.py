@@ -9,6 +9,11 @@ import dolfin as df
 from common import info
 
 
+# The mesh is built from arrays, so the levels of a ladder can be built
+# on separate processes, see generate_ladder.
+serial_levels = True
+
+
 def description(**kwargs):
     info("")
 
@@ -1,7 +1,7 @@
 """ periodic_porous script. """
 import numpy as np
 from generate_mesh import MESHES_DIR, store_mesh_HDF5, line_points, \
-    rad_points, round_trip_connect, numpy_to_dolfin
+    rad_points, round_trip_connect, numpy_to_dolfin, cached_geometry
 from utilities.plot import plot_edges, plot_faces
 from meshpy import triangle as tri
 from common import info
@@ -9,19 +9,17 @@ import os
 import dolfin as df
 
 
-def description(**kwargs):
-    info("")
-
+# The mesh is built from arrays, so the levels of a ladder can be built
+# on separate processes, see generate_ladder.
+serial_levels = True
 
-def method(Lx=6., Ly=4., Lx_inner=4., num_obstacles=32,
-           rad=0.2, R=0.3, dx=0.05, seed=121, do_plot=True, **kwargs):
-    N = int(np.ceil(Lx/dx))
 
-    x_min, x_max = -Lx/2, Lx/2
-    y_min, y_max = -Ly/2, Ly/2
+def description(**kwargs):
+    info("")
 
-    y = np.linspace(y_min, y_max, N).flatten()
 
+def place_obstacles(Lx_inner, Ly, num_obstacles, R, seed):
+    """ Place the obstacle centres, periodically in y. """
     pts = np.zeros((num_obstacles, 2))
     diam2 = 4*R**2
 
@@ -42,8 +40,21 @@ def method(Lx=6., Ly=4., Lx_inner=4., num_obstacles=32,
         pts[i, :] = pt
 
     pts = pts[pts[:, 0].argsort(), :]
+    return [tuple(row) for row in pts]
+
+
+def method(Lx=6., Ly=4., Lx_inner=4., num_obstacles=32,
+           rad=0.2, R=0.3, dx=0.05, seed=121, do_plot=True, **kwargs):
+    N = int(np.ceil(Lx/dx))
+
+    x_min, x_max = -Lx/2, Lx/2
+    y_min, y_max = -Ly/2, Ly/2
+
+    y = np.linspace(y_min, y_max, N).flatten()
 
-    obstacles = [tuple(row) for row in pts]
+    geometry_args = (Lx_inner, Ly, num_obstacles, R, seed)
+    obstacles = cached_geometry(("periodic_porous",) + geometry_args,
+                                place_obstacles, *geometry_args)
 
     line_segments_top = []
     line_segments_btm = []
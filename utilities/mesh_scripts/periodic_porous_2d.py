@@ -1,39 +1,23 @@
 """ periodic_porous script. """
 import numpy as np
 from generate_mesh import MESHES_DIR, store_mesh_HDF5, line_points, \
-    rad_points, round_trip_connect, numpy_to_dolfin, numpy_to_dolfin_old
+    rad_points, round_trip_connect, numpy_to_dolfin, numpy_to_dolfin_old, \
+    cached_geometry
 from utilities.plot import plot_edges, plot_faces, plt
+from obstacle_placement import place_obstacles
 from meshpy import triangle as tri
 from common import info
 import os
 import dolfin as df
 
 
-def description(**kwargs):
-    info("")
+# The mesh is built from arrays, so the levels of a ladder can be built
+# on separate processes, see generate_ladder.
+serial_levels = True
 
 
-def place_obstacles(num_obstacles, Lx, Ly, R):
-    diam2 = 4*R**2
-    pts = np.zeros((num_obstacles, 2))
-    for i in range(num_obstacles):
-        while True:
-            pt = (np.random.rand(2)-0.5) * np.array([Lx, Ly])
-            if i == 0:
-                break
-            dist = pts[:i, :] - np.outer(np.ones(i), pt)
-            for j in range(len(dist)):
-                if abs(dist[j, 1]) > Ly/2:
-                    dist[j, 1] = abs(dist[j, 1])-Ly
-                if abs(dist[j, 0]) > Lx/2:
-                    dist[j, 0] = abs(dist[j, 0])-Lx
-            dist2 = dist[:, 0]**2 + dist[:, 1]**2
-            if all(dist2 > diam2):
-                break
-        pts[i, :] = pt
-    pts = pts[pts[:, 0].argsort(), :]
-    obstacles = [tuple(row) for row in pts]
-    return obstacles
+def description(**kwargs):
+    info("")
 
 
 def correct_obstacles(obstacles, rad, x_min, x_max, y_min, y_max):
@@ -314,13 +298,18 @@ def discretize_loop(pt_start, curve_start, curves, segments, dx):
     return pts
 
 
-def method(Lx=4., Ly=4., num_obstacles=25,
-           rad=0.25, R=0.3, dx=0.05, seed=123, do_plot=True, **kwargs):
+def make_geometry(Lx, Ly, num_obstacles, rad, R, seed, mode, max_attempts):
+    """ Place the obstacles, and find where they cross the boundary of the
+    domain. None of this depends on the resolution. """
     x_min, x_max = -Lx/2, Lx/2
     y_min, y_max = -Ly/2, Ly/2
 
     np.random.seed(seed)
-    obstacles = place_obstacles(num_obstacles, Lx, Ly, R)
+    obstacles, num_attempts = place_obstacles(num_obstacles, Lx, Ly, R,
+                                              mode, max_attempts)
+    info("Placed {} obstacles ({}) in {} {}.".format(
+        num_obstacles, mode, num_attempts,
+        "iterations" if mode == "relax" else "attempts"))
     obstacles = correct_obstacles(obstacles, rad, x_min, x_max, y_min, y_max)
 
     interior_obstacles, exterior_obstacles, obst = classify_obstacles(
@@ -328,6 +317,19 @@ def method(Lx=4., Ly=4., num_obstacles=25,
 
     theta_low, theta_high = compute_intersections(
         obst, rad, x_min, x_max, y_min, y_max)
+    return interior_obstacles, obst, theta_low, theta_high
+
+
+def method(Lx=4., Ly=4., num_obstacles=25,
+           rad=0.25, R=0.3, dx=0.05, seed=123, do_plot=True,
+           mode="sequential", max_attempts=None, **kwargs):
+    x_min, x_max = -Lx/2, Lx/2
+    y_min, y_max = -Ly/2, Ly/2
+
+    geometry_args = (Lx, Ly, num_obstacles, rad, R, seed, mode, max_attempts)
+    interior_obstacles, obst, theta_low, theta_high = cached_geometry(
+        ("periodic_porous_2d",) + geometry_args, make_geometry,
+        *geometry_args)
 
     curves = draw_curves(obst, theta_low, theta_high, rad, dx)
     if len(curves) > 0:
@@ -400,15 +402,15 @@ def method(Lx=4., Ly=4., num_obstacles=25,
 
     msh = numpy_to_dolfin(coords, faces)
 
-    mesh_path = os.path.join(MESHES_DIR,
-                             "periodic_porous_Lx{}_Ly{}_rad{}_N{}_dx{}".format(
-                                 Lx, Ly, rad, num_obstacles, dx))
+    # Other placement modes give other obstacles for the same seed.
+    mesh_name = "periodic_porous_Lx{}_Ly{}_rad{}_N{}_dx{}".format(
+        Lx, Ly, rad, num_obstacles, dx)
+    if mode != "sequential":
+        mesh_name += "_" + mode
+    mesh_path = os.path.join(MESHES_DIR, mesh_name)
     store_mesh_HDF5(msh, mesh_path)
 
-    obstacles_path = os.path.join(
-        MESHES_DIR,
-        "periodic_porous_Lx{}_Ly{}_rad{}_N{}_dx{}.dat".format(
-            Lx, Ly, rad, num_obstacles, dx))
+    obstacles_path = os.path.join(MESHES_DIR, mesh_name + ".dat")
 
     if len(obst) and len(interior_obstacles):
         all_obstacles = np.vstack((np.array(obst),
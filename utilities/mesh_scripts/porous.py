@@ -3,7 +3,7 @@ import mshr
 from common import info
 import numpy as np
 import dolfin as df
-from generate_mesh import MESHES_DIR, store_mesh_HDF5
+from generate_mesh import MESHES_DIR, store_mesh_HDF5, cached_geometry
 import os
 
 
@@ -11,12 +11,8 @@ def description(**kwargs):
     info("")
 
 
-def method(Lx=4., Ly=4., rad=0.2, R=0.3, N=24, n_segments=40, res=80,
-           do_plot=False,
-           **kwargs):
-    """ Porous mesh. Not really done or useful. """
-    info("Generating porous mesh")
-
+def make_domain(Lx, Ly, rad, R, N, n_segments):
+    """ Rectangle with N circular holes at random positions. """
     # x = np.random.rand(N, 2)
 
     diam2 = 4*R**2
@@ -38,6 +34,20 @@ def method(Lx=4., Ly=4., rad=0.2, R=0.3, N=24, n_segments=40, res=80,
     for i in range(N):
         domain -= mshr.Circle(df.Point(pts[i, 0], pts[i, 1]),
                               rad, segments=n_segments)
+    return domain
+
+
+def method(Lx=4., Ly=4., rad=0.2, R=0.3, N=24, n_segments=40, res=80,
+           do_plot=False,
+           **kwargs):
+    """ Porous mesh. Not really done or useful. """
+    info("Generating porous mesh")
+
+    # The obstacles are placed once, such that all levels of a ladder
+    # have the same ones.
+    domain_args = (Lx, Ly, rad, R, N, n_segments)
+    domain = cached_geometry(("porous",) + domain_args, make_domain,
+                             *domain_args)
 
     mesh = mshr.generate_mesh(domain, res)
 
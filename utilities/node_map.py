@@ -0,0 +1,33 @@
+"""
+Mapping between the nodes of a timeseries mesh and the coordinates of
+the degrees of freedom of a function space on it.
+"""
+import numpy as np
+
+__author__ = "Gaute Linga"
+
+__all__ = ["row_ids", "node_indices"]
+
+
+def row_ids(x):
+    """ Returns an integer id for each row of the array x, such that equal
+    rows get equal ids. """
+    # Adding zero turns -0.0 into 0.0, which differ in their bytes.
+    x = np.ascontiguousarray(x, dtype=float) + 0.
+    x_void = x.view(np.dtype((np.void, x.dtype.itemsize*x.shape[1])))
+    _, ids = np.unique(x_void.ravel(), return_inverse=True)
+    return ids
+
+
+def node_indices(nodes, x):
+    """ Returns the index of the node at each of the coordinates x. Raises
+    KeyError if a coordinate does not match any node. """
+    num_nodes = len(nodes)
+    ids = row_ids(np.vstack((nodes, x)))
+    node_of_id = -np.ones(ids.max()+1, dtype=int)
+    node_of_id[ids[:num_nodes]] = np.arange(num_nodes)
+    indices = node_of_id[ids[num_nodes:]]
+    if np.any(indices < 0):
+        raise KeyError("No node at the coordinates {}.".format(
+            x[np.flatnonzero(indices < 0)[0]]))
+    return indices
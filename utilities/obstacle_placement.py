@@ -0,0 +1,201 @@
+"""
+Random placement of non-overlapping disks in a periodic box, e.g. the
+obstacles of a porous medium.
+"""
+import numpy as np
+
+__author__ = "Gaute Linga"
+
+__all__ = ["min_image", "overlapping_pairs", "place_obstacles_sequential",
+           "place_obstacles_rsa", "place_obstacles_relax",
+           "place_obstacles"]
+
+
+def min_image(dx, L):
+    """ Minimum image of the displacements dx in a periodic box of size
+    L, along the last axis. """
+    return dx - L*np.round(dx/L)
+
+
+def place_obstacles_sequential(num_obstacles, Lx, Ly, R, max_attempts):
+    """ Place the centres one by one, each at the first random position
+    that is free. This is the original algorithm, and draws the same
+    positions for a given random seed. """
+    L = np.array([Lx, Ly])
+    diam2 = 4*R**2
+    pts = np.zeros((num_obstacles, 2))
+    num_attempts = 0
+    for i in range(num_obstacles):
+        while True:
+            if num_attempts >= max_attempts:
+                raise RuntimeError(
+                    "Placed only {} of {} obstacles in {} attempts.".format(
+                        i, num_obstacles, num_attempts))
+            num_attempts += 1
+            pt = (np.random.rand(2)-0.5)*L
+            dist = min_image(pts[:i, :]-pt, L)
+            if np.all(np.sum(dist**2, axis=1) > diam2):
+                break
+        pts[i, :] = pt
+    return pts, num_attempts
+
+
+def place_obstacles_rsa(num_obstacles, Lx, Ly, R, max_attempts,
+                        batch_size=64):
+    """ Random sequential adsorption of disks of radius R.
+
+    The centres are kept in a periodic cell list, where the cells are
+    small enough to hold at most one centre each. Batches of candidates
+    are tested against the centres in the surrounding cells at once,
+    and the free candidates of a batch are then tested against each
+    other. """
+    L = np.array([Lx, Ly])
+    diam2 = 4*R**2
+    num_cells = np.maximum(np.ceil(L/(np.sqrt(2)*R)).astype(int), 1)
+    cell_size = L/num_cells
+    reach = np.ceil(2*R/cell_size).astype(int)
+    offsets = np.array([(i, j)
+                        for i in range(-reach[0], reach[0]+1)
+                        for j in range(-reach[1], reach[1]+1)])
+    owner = -np.ones(num_cells, dtype=int)
+
+    pts = np.zeros((num_obstacles, 2))
+    num_placed = 0
+    num_attempts = 0
+    while num_placed < num_obstacles:
+        if num_attempts >= max_attempts:
+            raise RuntimeError(
+                "Placed only {} of {} obstacles in {} attempts.".format(
+                    num_placed, num_obstacles, num_attempts))
+        batch = min(batch_size, max_attempts-num_attempts)
+        num_attempts += batch
+
+        candidates = (np.random.rand(batch, 2)-0.5)*L
+        cells = np.floor((candidates+L/2)/cell_size).astype(int) % num_cells
+        neighbor_cells = (cells[:, None, :] + offsets[None, :, :]) % num_cells
+        neighbors = owner[neighbor_cells[:, :, 0], neighbor_cells[:, :, 1]]
+        dist = min_image(pts[np.maximum(neighbors, 0)]
+                         - candidates[:, None, :], L)
+        is_free = np.all(np.logical_or(neighbors < 0,
+                                       np.sum(dist**2, axis=2) > diam2),
+                         axis=1)
+
+        num_placed_0 = num_placed
+        for k in np.flatnonzero(is_free):
+            dist = min_image(pts[num_placed_0:num_placed]-candidates[k], L)
+            if np.all(np.sum(dist**2, axis=1) > diam2):
+                pts[num_placed, :] = candidates[k]
+                owner[cells[k, 0], cells[k, 1]] = num_placed
+                num_placed += 1
+                if num_placed == num_obstacles:
+                    break
+    return pts, num_attempts
+
+
+def pairs_brute_force(pts, L, diam):
+    """ Pairs of points closer than diam in the periodic box of size L,
+    by testing all pairs. """
+    dist = min_image(pts[:, None, :]-pts[None, :, :], L)
+    i, j = np.nonzero(np.triu(np.sum(dist**2, axis=2) <= diam**2, 1))
+    return np.vstack((i, j)).T
+
+
+def pairs_cell_list(pts, L, diam):
+    """ Pairs of points closer than diam in the periodic box of size L,
+    by testing only the points in neighboring cells of a cell list. """
+    num_cells = np.floor(L/diam).astype(int)
+    if np.any(num_cells < 3):
+        return pairs_brute_force(pts, L, diam)
+    cells = np.floor(((pts+L/2) % L)/L*num_cells).astype(int) % num_cells
+    cell_ids = cells[:, 0]*num_cells[1] + cells[:, 1]
+
+    # The points of each cell, padded with -1.
+    order = np.argsort(cell_ids, kind="mergesort")
+    counts = np.bincount(cell_ids, minlength=np.prod(num_cells))
+    starts = np.cumsum(counts)-counts
+    slot = np.arange(len(pts)) - starts[cell_ids[order]]
+    cell_points = -np.ones((len(counts), max(counts.max(), 1)), dtype=int)
+    cell_points[cell_ids[order], slot] = order
+
+    offsets = np.array([(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)])
+    neighbor_cells = (cells[:, None, :] + offsets[None, :, :]) % num_cells
+    neighbor_ids = (neighbor_cells[:, :, 0]*num_cells[1] +
+                    neighbor_cells[:, :, 1])
+    j = cell_points[neighbor_ids].reshape(len(pts), -1)
+    i = np.repeat(np.arange(len(pts))[:, None], j.shape[1], axis=1)
+    dist = min_image(pts[np.maximum(j, 0)]-pts[i], L)
+    is_pair = np.logical_and(j > i, np.sum(dist**2, axis=2) <= diam**2)
+    return np.vstack((i[is_pair], j[is_pair])).T
+
+
+def overlapping_pairs(pts, L, diam):
+    """ Pairs of disks of diameter diam that overlap in the periodic box
+    of size L. """
+    try:
+        from scipy.spatial import cKDTree
+        tree = cKDTree((pts+L/2) % L, boxsize=L)
+        pairs = np.array(sorted(tree.query_pairs(diam)), dtype=int)
+    except ImportError:
+        pairs = pairs_cell_list(pts, L, diam)
+    return pairs.reshape(-1, 2)
+
+
+def place_obstacles_relax(num_obstacles, Lx, Ly, R, max_attempts,
+                          skin=0.01):
+    """ Dense packing of disks of radius R by collective rearrangement:
+    all centres are placed at random, and overlapping pairs are pushed
+    apart until there are no overlaps left. This reaches packing
+    fractions beyond what random sequential adsorption can. The pairs
+    are pushed slightly further apart than the diameter, by the relative
+    skin, since the relaxation otherwise only approaches the end state
+    asymptotically. """
+    L = np.array([Lx, Ly])
+    diam = 2*R
+    pts = (np.random.rand(num_obstacles, 2)-0.5)*L
+    for it in range(max_attempts):
+        pairs = overlapping_pairs(pts, L, diam)
+        if len(pairs) == 0:
+            return pts, it
+        i, j = pairs[:, 0], pairs[:, 1]
+        dx = min_image(pts[j]-pts[i], L)
+        dist = np.sqrt(np.sum(dx**2, axis=1))
+        coincident = dist == 0.
+        dx[coincident] = np.random.rand(np.sum(coincident), 2)-0.5
+        dist = np.sqrt(np.sum(dx**2, axis=1))
+        push = (0.5*((1+skin)*diam-dist)/dist)[:, None]*dx
+        np.add.at(pts, i, -push)
+        np.add.at(pts, j, push)
+        pts = min_image(pts, L)
+    raise RuntimeError(
+        "Could not remove the overlaps between {} obstacles in {} "
+        "iterations.".format(num_obstacles, max_attempts))
+
+
+placements = dict(sequential=place_obstacles_sequential,
+                  rsa=place_obstacles_rsa,
+                  relax=place_obstacles_relax)
+
+
+def place_obstacles(num_obstacles, Lx, Ly, R, mode="sequential",
+                    max_attempts=None):
+    """ Place num_obstacles centres in the periodic box
+    [-Lx/2, Lx/2] x [-Ly/2, Ly/2], at least 2*R apart, sorted by x.
+
+    With mode="sequential" (the original algorithm) or mode="rsa" (the
+    same with a cell list, for many obstacles), the centres are placed
+    one by one at random positions, and max_attempts is the number of
+    candidate positions tried. With mode="relax", which gives denser
+    packings, max_attempts is the number of relaxation iterations.
+    Returns the centres and the number of attempts or iterations used.
+    """
+    if mode not in placements:
+        raise ValueError("Unknown obstacle placement mode: {}. "
+                         "Use one of {}.".format(
+                             mode, ", ".join(sorted(placements.keys()))))
+    if max_attempts is None:
+        max_attempts = 1000 if mode == "relax" else 1000*num_obstacles
+    pts, num_attempts = placements[mode](num_obstacles, Lx, Ly, R,
+                                         max_attempts)
+    pts = pts[pts[:, 0].argsort(), :]
+    obstacles = [tuple(row) for row in pts]
+    return obstacles, num_attempts
@@ -7,6 +7,7 @@ from matplotlib.tri import tricontour
 from matplotlib.tri import TriContourSet
 from mpi4py.MPI import COMM_WORLD as comm
 from common.io import remove_safe
+from level_set import LevelSetExtractor
 
 rank = comm.Get_rank()
 size = comm.Get_size()
@@ -292,30 +293,23 @@ def plot_any_field(nodes, elems, values, save=None, show=True, label=None):
 
 def zero_level_set(nodes, elems, vals, show=False, save_file=False):
     """ Returns the zero level set of the phase field, i.e. the phase boundary.
-    GL: Possibly not a plot function?
+    See utilities.level_set for extracting it from many snapshots.
     """
-    fig = plt.figure()
-    ax = fig.add_subplot(1, 1, 1)
-    cs = ax.tricontour(nodes[:, 0], nodes[:, 1], elems, vals, levels=[0.])
-    paths = cs.collections[0].get_paths()
-    x, y = zip(*paths[0].vertices)
-    plt.close(fig)
+    paths = LevelSetExtractor(nodes, elems)(vals)
 
     if rank == 0 and show:
         fig = plt.figure()
         ax = fig.add_subplot(1, 1, 1)
         ax.set_aspect('equal')
-        ax.plot(x, y, '*-')
+        for path in paths:
+            ax.plot(path[:, 0], path[:, 1], '*-')
         plt.show()
 
     if rank == 0 and save_file:
         remove_safe(save_file)
         with open(save_file, "ab+") as f:
             for path in paths:
-                np.savetxt(f, path.vertices)
+                np.savetxt(f, path)
                 f.write("\n")
 
-    paths_out = []
-    for path in paths:
-        paths_out.append(path.vertices)
-    return paths_out
+    return paths